@@ -101,12 +101,10 @@ class _SoundBank:
             pass
 
 # =================== Plateau ===================
-ROWS = 4
-COLS = 8
-SEEDS_PER_PIT = 3
-
-J1_ROWS = [2, 3]  # joueur 1 (bas)
-J2_ROWS = [1, 0]  # joueur 2 (haut)
+# (règles et constantes : voir katro_engine.py)
+import katro_engine as engine
+from katro_engine import ROWS, COLS, SEEDS_PER_PIT, J1_ROWS, J2_ROWS
+import katro_ai
 
 # couleurs fallback si pas d’images
 C_BG, C_BOARD, C_FRAME = (0.07, 0.06, 0.05, 1), (0.22, 0.16, 0.11, 1), (0.28, 0.20, 0.14, 1)
@@ -247,6 +245,10 @@ class KatroBoard(Widget):
     running_anim = BooleanProperty(False)
     vs_ai = BooleanProperty(False)
     ai_player = NumericProperty(2)
+    ai_level = StringProperty(katro_ai.DEFAULT_LEVEL)  # "facile" | "moyen" | "difficile"
+    ai_engine = StringProperty(katro_ai.DEFAULT_ENGINE)  # "alphabeta" | "mcts"
+    ai_thinking = BooleanProperty(False)   # recherche en cours (thread)
+    ai_progress = StringProperty("")       # ex. "profondeur 3"
         # vue locale :true = les rangées sont retournées verticalement
     view_flip_v = BooleanProperty(False)  # flip vertical (haut/bas)
     view_flip_h = BooleanProperty(False)  # flip horizontal (gauche/droite)
@@ -290,10 +292,8 @@ class KatroBoard(Widget):
             self._sbank.set_master(self.volume_master)
 
     # utilitaires côté
-    def side_rows(self, p): return J1_ROWS if p == 1 else J2_ROWS
-    def _sum_side(self, p):
-        rows = self.side_rows(p)
-        return sum(self.pits[r*COLS + c] for r in rows for c in range(COLS))
+    def side_rows(self, p): return engine.side_rows(p)
+    def _sum_side(self, p): return engine.sum_side(self.pits, p)
 
     def __init__(self, **kw):
         super().__init__(**kw)
@@ -305,6 +305,20 @@ class KatroBoard(Widget):
         # sons
         self._sbank = _SoundBank(SOUNDS, master=self.volume_master, enabled=self.sound_enabled)
         self._last_sow_tick = 0
+        # état compact suivi pendant l'animation d'un coup (None au repos)
+        self._live_state = None
+        # génération du coup animé : abort_move() l'incrémente, et les rappels
+        # d'animation déjà programmés pour l'ancien coup deviennent sans effet
+        self._move_gen = 0
+        # IA (créée au premier coup ; sa table de transposition sert d'un tour à l'autre)
+        # La recherche tourne dans un thread pour ne pas figer le rendu.
+        self._ai = None
+        self._ai_worker = None
+        self._ai_turn_at = 0.0
+        self._ai_key = None      # clé de Zobrist de la position cherchée
+        self._ai_ready = None    # (coup, jeton) arrivé avant la fin de l'animation
+        self._pondering = False
+        self._ponder_left = 0.0  # budget de réflexion restant (tranches)
 
         # === Online (flags/état) ===
         self.online_mode = False
@@ -481,13 +495,21 @@ class KatroBoard(Widget):
         print(msg)
 
     def is_own_pit(self, idx):
-        return (idx // COLS) in self.side_rows(self.player)
+        return engine.is_own_pit(self.player, idx)
 
     def boustro_path(self, player):
-        rows = self.side_rows(player)
-        return [rows[0]*COLS + c for c in range(COLS)] + [rows[1]*COLS + c for c in reversed(range(COLS))]
-
-    def update_counts(self):
+        return list(engine.PATHS[player])
+
+    def update_counts(self, *idxs):
+        """Sans argument : tout le plateau. Avec des indices : seulement ces cases,
+        les totaux venant alors de l'état compact qui suit l'animation (O(1) par graine)."""
+        live = self._live_state
+        if idxs and live is not None and len(self.pit_widgets) == len(self.pits):
+            for i in idxs:
+                self.pit_widgets[i].count = self.pits[i]
+            self.j1_total = live.totals[1]
+            self.j2_total = live.totals[2]
+            return
         for i, p in enumerate(self.pit_widgets):
             p.count = self.pits[i]
         self.j1_total = self._sum_side(1)
@@ -504,6 +526,8 @@ class KatroBoard(Widget):
             return True
         if self.running_anim:
             return True
+        # l'humain joue : la réflexion de fond lui rendrait le rendu saccadé
+        self._stop_ponder()
 
         # bloque si pas ton tour en mode online
         if self.online_mode:
@@ -594,46 +618,91 @@ class KatroBoard(Widget):
         # sens
         self._current_step = 1 if step >= 0 else -1
 
+        # le coup est résolu d'un bloc par le moteur, le plateau n'anime que la trace
+        try:
+            state = engine.KatroState(self.pits, self.player)
+            result = engine.resolve_move(state, start_idx, self._current_step)
+        except ValueError as e:
+            print("play_move:", e)
+            self._sbank.play("error")
+            return
+
         # main / z-order
         self._apply_hand_asset(self.player)
         if self.hand:
             self.remove_widget(self.hand)
             self.add_widget(self.hand)
 
-        # on soulève tout du trou de départ
-        seeds = self.pits[start_idx]
-        self.pits[start_idx] = 0
-        self.update_counts()
-
-        # position "courante" = sur la case de départ (main part de là)
-        path = self.boustro_path(self.player)
-        pos = path.index(start_idx)
-
-        # on place visuellement la main sur la case de départ
         self.running_anim = True
-        self._move_hand_to(start_idx, after=lambda *_: self._sow_loop(path, pos, seeds))
+        self._live_state = state.copy()
 
-    def _sow_loop(self, path, pos, seeds_left):
-        if seeds_left <= 0:
-            last_idx = path[pos]
-            self._after_sow_rules(last_idx)
-            return
+        # IA : elle commence à réfléchir dès que le coup humain est résolu,
+        # pendant que la main anime (la réponse est souvent prête à la fin)
+        if (self.vs_ai and not self.online_mode and not result.winner
+                and state.player != self.ai_player and result.state.player == self.ai_player):
+            self._start_ai_search(result.state)
 
-        next_pos = (pos + self._current_step) % len(path)
-        next_idx = path[next_pos]
+        self._animate_trace(result, 0, self._move_gen)
 
-        def _arrived(*_):
-            self.pits[next_idx] += 1
-            self.update_counts()
-            self._sbank.play("sow")
-
-            if seeds_left - 1 <= 0:
-                self._after_sow_rules(next_idx)
-            else:
-                self._sow_loop(path, next_pos, seeds_left - 1)
+    def abort_move(self):
+        """Abandonne le coup en cours d'animation (plateau remis à zéro) :
+        la suite de sa trace et son _finish_move ne toucheront pas au nouveau plateau."""
+        self._move_gen += 1
+        if self.hand is not None:
+            Animation.cancel_all(self.hand)
+        self._live_state = None
+        self.running_anim = False
+        self._await_dir_choice = False
+        self._pending_start_idx = -1
+
+    def _animate_trace(self, result, i, gen):
+        """Rejoue un à un les évènements de la trace (main + compteurs + sons)."""
+        if gen != self._move_gen:
+            return  # coup abandonné (remise à zéro pendant l'animation)
+        ev = result.trace[i]
+        op = ev[0]
+        live = self._live_state
+        _next = lambda *_: self._animate_trace(result, i + 1, gen)
+
+        if op == engine.PICK:
+            # on soulève tout du trou de départ, la main se pose dessus
+            live.take(ev[1])
+            self.pits[ev[1]] = 0
+            self.update_counts(ev[1])
+            self._move_hand_to(ev[1], after=_next)
+
+        elif op == engine.SOW:
+            idx = ev[1]
+
+            def _arrived(*_):
+                if gen != self._move_gen:
+                    return
+                live.add(idx)
+                self.pits[idx] += 1
+                self.update_counts(idx)
+                self._sbank.play("sow")
+                _next()
+
+            self._move_hand_to(idx, after=_arrived)
+
+        elif op == engine.CAPTURE:
+            _, last_idx, opp_idx, captured = ev
+            live.take(opp_idx)
+            live.take(last_idx)
+            self.pits[opp_idx] = 0
+            self.pits[last_idx] = 0
+            self.update_counts(opp_idx, last_idx)
+            self._sbank.play("capture")
+            self._animate_capture(last_idx, opp_idx, captured, then_continue=_next)
 
-        self._move_hand_to(next_idx, after=_arrived)
+        elif op == engine.RELAY:
+            live.take(ev[1])
+            self.pits[ev[1]] = 0
+            self.update_counts(ev[1])
+            _next()
 
+        else:
+            self._finish_move(result)
 
     def _is_local_winner(self, winner: int) -> bool:
         """
@@ -651,68 +720,27 @@ class KatroBoard(Widget):
         return winner == 1
         
 
-    def _after_sow_rules(self, last_idx: int):
-        """Règles officielles : CAPTURE > RELAIS > STOP."""
-        opponent = 2 if self.player == 1 else 1
-
-        # fin si un camp est vide
-        def _no_seeds_side(p):
-            rows = self.side_rows(p)
-            return sum(self.pits[r*COLS + c] for r in rows for c in range(COLS)) == 0
-
-        if _no_seeds_side(1) or _no_seeds_side(2):
-            winner = 2 if _no_seeds_side(1) else 1
+    def _finish_move(self, result):
+        """Fin d'animation : on recale le plateau sur le résultat du moteur."""
+        self._live_state = None
+        self.pits = result.state.to_list()
+        self.update_counts()
 
-            # Son selon résultat LOCAL (pas absolu)
-            if self._is_local_winner(winner):
+        if result.winner:
+            # Son selon résultat LOCAL (pas absolu) ; coup infini = partie nulle
+            if result.winner == engine.DRAW:
+                self._sbank.play("stop")
+            elif self._is_local_winner(result.winner):
                 self._sbank.play("win")
             else:
                 self._sbank.play("lose")
 
             self.running_anim = False
-            self._show_end_dialog(winner)
+            self._show_end_dialog(result.winner)
             return
 
-
-        r, c = divmod(last_idx, COLS)
-        seeds_here = self.pits[last_idx]
-
-        def front_row_of(p): return 2 if p == 1 else 1
-        def back_row_of(p):  return 3 if p == 1 else 0
-        def effective_front_row_of(p):
-            fr = front_row_of(p)
-            if all(self.pits[fr*COLS + i] == 0 for i in range(COLS)):
-                return back_row_of(p)
-            return fr
-
-        # 1) CAPTURE si sur ta 1re rangée et en face > 0 (rangée 'effective')
-        if r == front_row_of(self.player):
-            opp_front_eff = effective_front_row_of(opponent)
-            opp_idx = opp_front_eff * COLS + c
-            if self.pits[opp_idx] > 0:
-                captured = self.pits[opp_idx] + self.pits[last_idx]
-                self.pits[opp_idx] = 0
-                self.pits[last_idx] = 0
-                self.update_counts()
-                self._sbank.play("capture")
-                path = self.boustro_path(self.player)
-                pos = path.index(last_idx)
-                return self._animate_capture(
-                    last_idx, opp_idx, captured,
-                    then_continue=lambda: self._sow_loop(path, pos, captured)
-                )
-
-        # 2) RELAIS si la case n’était pas vide (>1)
-        if seeds_here > 1:
-            pickup = seeds_here
-            self.pits[last_idx] = 0
-            self.update_counts()
-            path = self.boustro_path(self.player)
-            pos = path.index(last_idx)
-            return self._sow_loop(path, pos, pickup)
-
-        # 3) STOP
-        self.player = opponent
+        # STOP
+        self.player = result.state.player
         self._apply_hand_asset(self.player)
         if self.hand:
             self.remove_widget(self.hand); self.add_widget(self.hand)
@@ -722,35 +750,149 @@ class KatroBoard(Widget):
         # NE JAMAIS déclencher l’IA en ligne
         if not self.online_mode:
             self._maybe_ai_turn()
-        return
 
-    # ---------- IA (très simple) ----------
+    # ---------- IA (alpha-bêta dans un thread, voir katro_ai.py) ----------
+    def _ai_searcher(self):
+        wanted = katro_ai.MCTSAI if self.ai_engine == "mcts" else katro_ai.AlphaBetaAI
+        if not isinstance(self._ai, wanted):
+            if self._ai_worker is not None:
+                self._ai_worker.cancel()
+            self._ai = katro_ai.make_searcher(self.ai_engine)
+            self._ai_worker = katro_ai.AIWorker(self._ai)
+        self._ai.direction_mode = self.direction_mode
+        self._ai.time_budget = katro_ai.LEVELS.get(self.ai_level, katro_ai.LEVELS[katro_ai.DEFAULT_LEVEL])
+        return self._ai
+
     def _ai_choose_start(self):
-        import random
-        rows = self.side_rows(self.ai_player)
-        choices = [
-            r * COLS + c
-            for r in rows
-            for c in range(COLS)
-            if self.pits[r * COLS + c] > 0
-        ]
-        return random.choice(choices) if choices else None
-
-    def _ai_play(self, *_):
+        """Coup (start_idx, step) de l'IA, calculé de façon synchrone (tests / outils)."""
+        return self._ai_searcher().choose(engine.KatroState(self.pits, self.ai_player))
+
+    def _start_ai_search(self, state=None):
+        """Lance la réflexion de l'IA hors du thread Kivy ; le coup revient via Clock.
+        Sans rien faire si cette position est déjà cherchée (ou déjà résolue)."""
+        if state is None:
+            state = engine.KatroState(self.pits, self.ai_player)
+        worker = self._ai_worker
+        if (not self._pondering and state.key == self._ai_key
+                and (self._ai_ready is not None or (worker is not None and worker.busy))):
+            return
+        self._ai_searcher()
+        self._pondering = False
+        self._ai_key = state.key
+        self._ai_ready = None
+        self.ai_thinking = True
+        self.ai_progress = ""
+
+        def _done(move, token):
+            Clock.schedule_once(lambda dt: self._ai_play(move, token), 0)
+
+        def _progress(token, depth, score, move, nodes):
+            Clock.schedule_once(lambda dt: self._on_ai_progress(token, depth), 0)
+
+        self._ai_worker.start(state, _done, _progress)
+
+    def _start_ponder(self):
+        """Pendant que l'humain réfléchit : recherche depuis SA position,
+        qui remplit la table de transposition avec les réponses probables.
+        (Alpha-bêta seulement : MCTS ne garde rien d'un coup à l'autre.)
+        Elle avance par tranches de PONDER_SLICE séparées d'une pause, pour que
+        le thread de recherche ne monopolise pas le GIL pendant les animations,
+        et s'arrête dès que l'humain touche le plateau."""
+        searcher = self._ai_searcher()
+        if not hasattr(searcher, "tt"):
+            return
+        self._pondering = True
+        self._ai_key = None
+        self._ai_ready = None
+        self._ponder_left = katro_ai.PONDER_BUDGET
+        self._ponder_slice()
+
+    def _ponder_slice(self, token=None):
+        worker = self._ai_worker
+        if not self._pondering or worker is None or (token is not None and token != worker.token):
+            return  # réflexion interrompue entre deux tranches
+        if self._ponder_left <= 0 or self.player == self.ai_player:
+            self._pondering = False
+            return
+        self._ponder_left -= katro_ai.PONDER_SLICE
+
+        def _done(move, token):
+            Clock.schedule_once(lambda dt: self._ponder_slice(token), katro_ai.PONDER_PAUSE)
+
+        state = engine.KatroState(self.pits, self.player)
+        worker.start(state, _done, time_budget=katro_ai.PONDER_SLICE)
+
+    def _stop_ponder(self):
+        if self._pondering:
+            self._pondering = False
+            if self._ai_worker is not None:
+                self._ai_worker.cancel()
+
+    def _on_ai_progress(self, token, depth):
+        # alpha-bêta : profondeur atteinte ; MCTS : nombre de playouts
+        if self._ai_worker is not None and token == self._ai_worker.token:
+            if isinstance(self._ai, katro_ai.MCTSAI):
+                self.ai_progress = f"{depth} parties simulées"
+            else:
+                self.ai_progress = f"profondeur {depth}"
+
+    def cancel_ai(self):
+        """Abandonne la réflexion en cours (sortie d'écran, rejouer, changement de règles)."""
+        if self._ai_worker is not None:
+            self._ai_worker.cancel()
+        self._pondering = False
+        self._ai_key = None
+        self._ai_ready = None
+        self.ai_thinking = False
+        self.ai_progress = ""
+
+    def resume_ai(self):
+        """Relance l'IA si c'est à elle de jouer (retour sur l'écran IA)."""
+        if not self.running_anim and not self.ai_thinking:
+            self._maybe_ai_turn()
+
+    def _ai_play(self, move, token):
+        if self._ai_worker is None or token != self._ai_worker.token:
+            return  # résultat d'une recherche annulée
+        if self.running_anim or self.player != self.ai_player:
+            # réponse prête avant la fin de l'animation du coup humain : on la garde
+            self._ai_ready = (move, token)
+            return
+        # petit délai minimal pour que le coup de l'IA ne paraisse pas instantané
+        import time
+        wait = 0.2 - (time.perf_counter() - self._ai_turn_at)
+        if wait > 0:
+            Clock.schedule_once(lambda dt: self._ai_play(move, token), wait)
+            return
+        self._ai_ready = None
+        self._ai_key = None
+        self.ai_thinking = False
+        self.ai_progress = ""
         if not (self.vs_ai and self.player == self.ai_player) or self.running_anim:
             return
         self._apply_hand_asset(self.player)
-        idx = self._ai_choose_start()
-        if idx is None:
+        if move is None:
             self.player = 1 if self.ai_player == 2 else 2
             self.running_anim = False
             return
-        self.play_move(idx, step=+1)
+        idx, step = move
+        self.play_move(idx, step=step)
 
-    def _maybe_ai_turn(self): 
-        if self.vs_ai and self.player == self.ai_player:
-            self._sbank.play("ai")
-            Clock.schedule_once(self._ai_play, 0.2)
+    def _maybe_ai_turn(self):
+        if not self.vs_ai:
+            return
+        if self.player != self.ai_player:
+            self._start_ponder()
+            return
+        import time
+        self._ai_turn_at = time.perf_counter()
+        self._sbank.play("ai")
+        ready = self._ai_ready
+        if ready is not None and self._ai_key == engine.KatroState(self.pits, self.ai_player).key:
+            # recherche déjà terminée pendant l'animation
+            self._ai_play(*ready)
+        else:
+            self._start_ai_search()
 
     def _show_end_dialog(self, winner: int):
         """Fenêtre de fin avec bannière image + boutons Rejouer / Menu."""
@@ -762,7 +904,11 @@ class KatroBoard(Widget):
 
         local_win = self._is_local_winner(winner)
 
-        if local_win:
+        if winner == engine.DRAW:
+            title = "MITOVY!"
+            subtitle = "Le coup tourne en boucle : partie nulle."
+            banner_path = ""
+        elif local_win:
             title = "FANDRESENA!"
             subtitle = "Belle victoire !" if self.vs_ai else "Félicitations !"
             banner_path = ASSETS.get("end_win", "")
@@ -0,0 +1,504 @@
+# katro_ai.py — IA KATRO (recherche sur le moteur sans Kivy)
+# Aucune dépendance Kivy : utilisable depuis le plateau, un thread ou un script.
+
+import math
+import random
+import threading
+import traceback
+from time import perf_counter
+
+import katro_engine as engine
+
+# niveau -> budget de réflexion par coup (secondes)
+LEVELS = {"facile": 0.05, "moyen": 0.25, "difficile": 1.0}
+DEFAULT_LEVEL = "moyen"
+
+# part du budget au-delà de laquelle on ne commence plus de nouvelle profondeur
+SOFT_BUDGET = 0.5
+
+# réflexion pendant le tour de l'humain (remplit la table de transposition) :
+# par tranches courtes séparées d'une pause, pour laisser le GIL au rendu
+PONDER_BUDGET = 5.0
+PONDER_SLICE = 0.05
+PONDER_PAUSE = 0.05
+
+# moteurs disponibles (voir make_searcher)
+ENGINES = ("alphabeta", "mcts")
+DEFAULT_ENGINE = "alphabeta"
+
+WIN = 100000          # score d'une victoire (moins la distance en demi-coups)
+INF = 10 * WIN
+MATE = WIN - 1000     # au-delà : score de fin de partie forcée
+
+# type de borne stockée dans la table de transposition
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TranspositionTable:
+    """
+    Table de transposition de taille fixe (2**size_log2 seaux de 2 entrées),
+    indexée par la clé de Zobrist de KatroState :
+    - entrée 0 « profondeur d'abord » : remplacée si la nouvelle recherche est
+      au moins aussi profonde, ou si l'entrée date d'une recherche précédente ;
+    - entrée 1 « toujours remplacer » : reçoit tout le reste.
+    La table est gardée d'un tour à l'autre : `new_search()` vieillit simplement
+    les entrées pour qu'elles cèdent la place en priorité.
+    Les scores de fin de partie y sont stockés relativement au nœud (distance
+    au mat depuis lui, voir _to_tt/_from_tt), pas à la racine de la recherche.
+    """
+    __slots__ = ("mask", "keys", "entries", "generation", "probes", "hits")
+
+    def __init__(self, size_log2=16):
+        n = 1 << size_log2
+        self.mask = n - 1
+        self.keys = [0] * (2 * n)
+        self.entries = [None] * (2 * n)   # (depth, score, flag, move, generation)
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 0xFF
+
+    def clear(self):
+        n = len(self.keys)
+        self.keys = [0] * n
+        self.entries = [None] * n
+        self.generation = 0
+        self.probes = self.hits = 0
+
+    def probe(self, key):
+        """Renvoie (depth, score, flag, move, generation) ou None."""
+        self.probes += 1
+        i = (key & self.mask) << 1
+        keys = self.keys
+        if keys[i] == key and self.entries[i] is not None:
+            self.hits += 1
+            return self.entries[i]
+        if keys[i + 1] == key and self.entries[i + 1] is not None:
+            self.hits += 1
+            return self.entries[i + 1]
+        return None
+
+    def store(self, key, depth, score, flag, move):
+        i = (key & self.mask) << 1
+        entry = (depth, score, flag, move, self.generation)
+        old = self.entries[i]
+        if (old is None or self.keys[i] == key or depth >= old[0]
+                or old[4] != self.generation):
+            self.keys[i] = key
+            self.entries[i] = entry
+        else:
+            self.keys[i + 1] = key
+            self.entries[i + 1] = entry
+
+    def usage(self):
+        """Fraction des entrées occupées (pour régler la taille)."""
+        return sum(1 for e in self.entries if e is not None) / len(self.entries)
+
+
+# ---------- évaluation ----------
+def evaluate(state):
+    """Score statique du point de vue du joueur au trait : graines de son camp - adverses."""
+    p = state.player
+    return state.totals[p] - state.totals[3 - p]
+
+
+def _terminal_score(winner, mover, ply):
+    if winner == engine.DRAW:
+        return 0
+    return WIN - ply if winner == mover else ply - WIN
+
+
+def _to_tt(score, ply):
+    """Score vu de la racine -> score vu du nœud à `ply` (pour la table)."""
+    if score >= MATE:
+        return score + ply
+    if score <= -MATE:
+        return score - ply
+    return score
+
+
+def _from_tt(score, ply):
+    """Inverse de _to_tt : score lu dans la table, ramené à la racine actuelle."""
+    if score >= MATE:
+        return score - ply
+    if score <= -MATE:
+        return score + ply
+    return score
+
+
+class _Timeout(Exception):
+    pass
+
+
+# ---------- alpha-bêta ----------
+class AlphaBetaAI:
+    """
+    Négamax alpha-bêta avec approfondissement itératif sous budget de temps.
+    - ordre des coups : coup de la table de transposition, puis gain immédiat ;
+    - en mode "free", chaque case est essayée dans les deux sens ;
+    - `choose()` rend toujours un coup avant l'échéance : celui de la dernière
+      profondeur terminée (à défaut, le meilleur coup à 1 demi-coup) ; passé la
+      moitié du budget, on ne lance plus de nouvelle profondeur (elle coûte
+      plusieurs fois la précédente et serait de toute façon abandonnée) ;
+    - `cancel` (threading.Event) interrompt la recherche au nœud suivant ;
+    - `on_progress(depth, score, move, nodes)` est appelé après chaque profondeur ;
+    - les clés de la table sont mêlées de Z_FREE en mode "free" : une table
+      partagée entre les deux modes ne confond pas leurs positions.
+    """
+
+    def __init__(self, time_budget=LEVELS[DEFAULT_LEVEL], direction_mode="fixed",
+                 max_depth=64, tt=None):
+        self.time_budget = float(time_budget)
+        self.direction_mode = direction_mode
+        self.max_depth = int(max_depth)
+        self.tt = tt if tt is not None else TranspositionTable()
+        # statistiques du dernier choose()
+        self.nodes = 0
+        self.depth_reached = 0
+        self.best_score = 0
+        self.elapsed = 0.0
+        self.on_progress = None
+        self._deadline = 0.0
+        self._cancel = None
+        self._zmode = 0
+
+    def choose(self, state, time_budget=None, cancel=None):
+        """Meilleur coup (start_idx, step) pour state.player, ou None s'il n'y en a pas."""
+        t0 = perf_counter()
+        budget = self.time_budget if time_budget is None else float(time_budget)
+        self._deadline = t0 + budget
+        self._cancel = cancel
+        soft = t0 + budget * SOFT_BUDGET
+        self._zmode = engine.Z_FREE if self.direction_mode == "free" else 0
+        self.tt.new_search()
+        self.nodes = 0
+        self.depth_reached = 0
+
+        root = self._children(state, None, check=False)
+        if not root:
+            return None
+        best = root[0][0]
+        if len(root) > 1:
+            try:
+                for depth in range(1, self.max_depth + 1):
+                    score, move = self._search_root(state, root, depth)
+                    best, self.best_score, self.depth_reached = move, score, depth
+                    if self.on_progress:
+                        self.on_progress(depth, score, move, self.nodes)
+                    # coup de la dernière itération en tête pour la suivante
+                    root.sort(key=lambda mr: mr[0] != move)
+                    if abs(score) >= WIN - self.max_depth:
+                        break   # fin de partie forcée trouvée
+                    if perf_counter() > soft:
+                        break
+            except _Timeout:
+                pass
+        self.elapsed = perf_counter() - t0
+        return best
+
+    # -- interne --
+    def _check(self):
+        if perf_counter() > self._deadline or (self._cancel is not None and self._cancel.is_set()):
+            raise _Timeout()
+
+    def _children(self, state, tt_move, check=True):
+        """Coups jouables déjà résolus, triés : coup TT, puis meilleur gain immédiat.
+        Un coup peut coûter des centaines de semis (relais) : l'échéance est
+        relue avant chacun, sauf à la racine (check=False) où il faut un coup."""
+        mover = state.player
+        out = []
+        for m in engine.legal_moves(state, self.direction_mode):
+            if check:
+                self._check()
+            r = engine.resolve_move(state, m[0], m[1])
+            if r.winner:
+                order = _terminal_score(r.winner, mover, 0)
+            else:
+                order = -evaluate(r.state)
+            if m == tt_move:
+                order = INF
+            out.append((order, m, r))
+        out.sort(key=lambda t: t[0], reverse=True)
+        return [(m, r) for _, m, r in out]
+
+    def _value(self, r, mover, depth, alpha, beta, ply):
+        """Valeur d'un coup résolu, du point de vue de `mover`."""
+        if r.winner:
+            return _terminal_score(r.winner, mover, ply)
+        return -self._negamax(r.state, depth, -beta, -alpha, ply)
+
+    def _search_root(self, state, root, depth):
+        alpha, beta = -INF, INF
+        best_move = root[0][0]
+        for m, r in root:
+            v = self._value(r, state.player, depth - 1, alpha, beta, 1)
+            if v > alpha:
+                alpha, best_move = v, m
+        self.tt.store(state.key ^ self._zmode, depth, alpha, EXACT, best_move)
+        return alpha, best_move
+
+    def _negamax(self, state, depth, alpha, beta, ply):
+        self.nodes += 1
+        # un nœud coûte déjà ~16 résolutions de coup : on peut lire l'horloge à chaque fois
+        self._check()
+        if depth <= 0:
+            return evaluate(state)
+
+        key = state.key ^ self._zmode
+        tt_move = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            e_depth, e_score, e_flag, tt_move, _ = entry
+            e_score = _from_tt(e_score, ply)
+            if e_depth >= depth:
+                if e_flag == EXACT:
+                    return e_score
+                if e_flag == LOWER and e_score > alpha:
+                    alpha = e_score
+                elif e_flag == UPPER and e_score < beta:
+                    beta = e_score
+                if alpha >= beta:
+                    return e_score
+
+        children = self._children(state, tt_move)
+        if not children:
+            return evaluate(state)
+
+        alpha0 = alpha
+        best, best_move = -INF, None
+        for m, r in children:
+            v = self._value(r, state.player, depth - 1, alpha, beta, ply + 1)
+            if v > best:
+                best, best_move = v, m
+                if v > alpha:
+                    alpha = v
+                    if alpha >= beta:
+                        break
+
+        flag = UPPER if best <= alpha0 else (LOWER if best >= beta else EXACT)
+        self.tt.store(key, depth, _to_tt(best, ply), flag, best_move)
+        return best
+
+
+# ---------- MCTS (UCT) ----------
+def playout(s, rng, direction_mode="fixed", max_plies=200):
+    """
+    Partie aléatoire jouée SUR PLACE depuis `s` (qui est donc modifié).
+    Pas de liste de coups ni de copie : on tire une case du chemin du joueur
+    et on prend la première non vide à partir de là. Renvoie le gagnant
+    (1, 2, DRAW) ; au-delà de `max_plies`, le camp le plus fourni l'emporte.
+    """
+    pits = s.pits
+    paths = engine.PATHS
+    play = engine.play_inplace
+    randrange = rng.randrange
+    free = direction_mode == "free"
+    for _ in range(max_plies):
+        path = paths[s.player]
+        i = randrange(16)
+        while not pits[path[i]]:
+            i = (i + 1) & 15
+        step = -1 if (free and randrange(2)) else 1
+        winner = play(s, path[i], step)
+        if winner:
+            return winner
+    t1, t2 = s.totals[1], s.totals[2]
+    return 1 if t1 > t2 else (2 if t2 > t1 else engine.DRAW)
+
+
+class _Node:
+    __slots__ = ("state", "move", "parent", "children", "untried", "visits", "wins", "winner")
+
+    def __init__(self, state, move, parent, winner, direction_mode):
+        self.state = state          # position APRÈS `move`
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.winner = winner        # partie finie dans ce nœud ?
+        self.untried = [] if winner else engine.legal_moves(state, direction_mode)
+        self.visits = 0
+        self.wins = 0.0             # du point de vue du joueur qui a joué `move`
+
+
+class MCTSAI:
+    """
+    Monte Carlo Tree Search (UCT) sous budget de temps et/ou de playouts.
+    Même interface que AlphaBetaAI (`choose`, `cancel`, `on_progress`), donc
+    utilisable tel quel avec AIWorker. `playouts_per_sec` sert à régler le
+    budget selon l'appareil.
+    """
+
+    def __init__(self, time_budget=LEVELS[DEFAULT_LEVEL], direction_mode="fixed",
+                 max_playouts=None, c=1.4, playout_plies=40, seed=None):
+        self.time_budget = float(time_budget)
+        self.direction_mode = direction_mode
+        self.max_playouts = max_playouts
+        self.c = float(c)
+        self.playout_plies = int(playout_plies)
+        self.rng = random.Random(seed)
+        self.on_progress = None
+        # statistiques du dernier choose()
+        self.playouts = 0
+        self.elapsed = 0.0
+        self.playouts_per_sec = 0.0
+        self.best_score = 0.0   # taux de victoire estimé du coup choisi
+
+    def choose(self, state, time_budget=None, cancel=None):
+        """Coup (start_idx, step) le plus visité, ou None s'il n'y en a pas."""
+        t0 = perf_counter()
+        budget = self.time_budget if time_budget is None else float(time_budget)
+        deadline = t0 + budget
+        root = _Node(state.copy(), None, None, 0, self.direction_mode)
+        if not root.untried:
+            return None
+        if len(root.untried) == 1:
+            return root.untried[0]
+
+        rng, c, free = self.rng, self.c, self.direction_mode
+        max_playouts = self.max_playouts
+        log, sqrt = math.log, math.sqrt
+        n = 0
+        while True:
+            if max_playouts is not None and n >= max_playouts:
+                break
+            # un playout (jusqu'à playout_plies coups semés) coûte bien plus
+            # qu'une lecture d'horloge : on la relit à chaque itération
+            if perf_counter() > deadline or (cancel is not None and cancel.is_set()):
+                break
+            if self.on_progress and n and not (n & 1023):
+                best = max(root.children, key=lambda ch: ch.visits)
+                self.on_progress(n, best.wins / best.visits, best.move, n)
+
+            # 1) sélection
+            node = root
+            while not node.untried and node.children:
+                lv = log(node.visits)
+                best_ch, best_u = None, -1.0
+                for ch in node.children:
+                    u = ch.wins / ch.visits + c * sqrt(lv / ch.visits)
+                    if u > best_u:
+                        best_ch, best_u = ch, u
+                node = best_ch
+
+            # 2) expansion
+            if node.untried:
+                m = node.untried.pop(rng.randrange(len(node.untried)))
+                s = node.state.copy()
+                w = engine.play_inplace(s, m[0], m[1])
+                child = _Node(s, m, node, w, free)
+                node.children.append(child)
+                node = child
+
+            # 3) simulation
+            if node.winner:
+                winner = node.winner
+            else:
+                winner = playout(node.state.copy(), rng, free, self.playout_plies)
+
+            # 4) rétropropagation
+            while node.parent is not None:
+                node.visits += 1
+                mover = node.parent.state.player
+                if winner == mover:
+                    node.wins += 1.0
+                elif winner == engine.DRAW:
+                    node.wins += 0.5
+                node = node.parent
+            root.visits += 1
+            n += 1
+
+        self.playouts = n
+        self.elapsed = perf_counter() - t0
+        self.playouts_per_sec = n / self.elapsed if self.elapsed > 0 else 0.0
+        if not root.children:
+            return root.untried[0]
+        best = max(root.children, key=lambda ch: ch.visits)
+        self.best_score = best.wins / best.visits
+        return best.move
+
+
+# ---------- recherche en arrière-plan ----------
+class AIWorker:
+    """
+    Lance `searcher.choose()` dans un thread démon (une recherche à la fois).
+    Les callbacks sont appelés DANS le thread de recherche : côté Kivy, les
+    renvoyer sur le thread UI avec Clock.schedule_once (comme online.py).
+    Chaque recherche a un jeton ; `cancel()` l'invalide, donc un résultat
+    arrivé trop tard n'est jamais livré. `cancel()` n'attend pas le thread
+    (il tourne souvent sur le thread UI) : l'ancienne recherche s'arrête
+    d'elle-même au nœud suivant, et c'est le thread de la recherche suivante
+    qui l'attend avant de commencer. Les recherches se suivent donc sur le
+    même moteur sans jamais se chevaucher : table de transposition, rng et
+    statistiques (nodes, depth_reached, playouts_per_sec...) ne sont touchés
+    que par un thread à la fois et restent lisibles sur `searcher`.
+    Si la recherche lève une exception, elle est tracée et on_done reçoit le
+    premier coup jouable : le plateau n'attend jamais un coup qui ne viendra pas.
+    """
+
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.token = 0
+        self._thread = None   # recherche en cours (None une fois annulée)
+        self._last = None     # dernier thread lancé, annulé ou non
+        self._cancel = None
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, state, on_done, on_progress=None, time_budget=None):
+        """Démarre une recherche sur une copie de `state` ; renvoie son jeton.
+        on_done(move, token) / on_progress(token, depth, score, move, nodes)."""
+        self.cancel()
+        with self._lock:
+            self.token += 1
+            token = self.token
+        cancel = threading.Event()
+        self._cancel = cancel
+        state = state.copy()
+
+        def _progress(*info):
+            if on_progress and token == self.token:
+                on_progress(token, *info)
+
+        searcher = self.searcher
+        previous = self._last
+
+        def _run():
+            if previous is not None:
+                previous.join()   # recherche annulée : elle finit son nœud
+            if cancel.is_set():
+                return            # annulée à son tour pendant l'attente
+            searcher.on_progress = _progress
+            try:
+                move = searcher.choose(state, time_budget, cancel)
+            except Exception:
+                # bug de recherche : on le trace, mais la partie continue
+                # avec le premier coup jouable plutôt que d'attendre l'IA
+                traceback.print_exc()
+                moves = engine.legal_moves(state, searcher.direction_mode)
+                move = moves[0] if moves else None
+            if not cancel.is_set() and token == self.token:
+                on_done(move, token)
+
+        self._thread = self._last = threading.Thread(target=_run, daemon=True)
+        self._thread.start()
+        return token
+
+    def cancel(self):
+        """Interrompt la recherche en cours (le thread s'arrête au nœud suivant)."""
+        with self._lock:
+            self.token += 1
+        if self._cancel is not None:
+            self._cancel.set()
+        self._thread = None
+
+
+def make_searcher(engine_name=DEFAULT_ENGINE, **kw):
+    """Crée le moteur demandé ("alphabeta" ou "mcts")."""
+    if engine_name == "mcts":
+        return MCTSAI(**kw)
+    return AlphaBetaAI(**kw)
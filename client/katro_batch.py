@@ -0,0 +1,282 @@
+# katro_batch.py — simulateur KATRO vectorisé (NumPy) : N parties en parallèle
+# Outil de réglage / statistiques, hors application (dépendance : pip install numpy).
+#
+#   python katro_batch.py --games 20000 --boards 16384 --seeds 3 --direction free
+
+import argparse
+import time
+
+import numpy as np
+
+import katro_engine as engine
+from katro_engine import ROWS, COLS, SEEDS_PER_PIT, DRAW, MAX_SOWS
+
+# Les plateaux sont rangés dans l'ordre des CHEMINS : board[b, j, k] = case
+# engine.PATHS[j + 1][k]. Positions 0..7 = 1re rangée (colonne k), 8..15 =
+# 2e rangée (colonne 15 - k). La case d'en face d'une arrivée en position k < 8
+# est donc la position k (1re rangée adverse) ou 15 - k (2e rangée adverse).
+_PATH = np.array([engine.PATHS[1], engine.PATHS[2]], dtype=np.int64)   # (2, 16)
+
+# semis d'un bloc : _SOW[h, p0, sens] = graines reçues par chacune des 16 positions
+# du chemin quand on sème h graines depuis la position p0 (sens 0 : -1, sens 1 : +1)
+_k = np.arange(16)
+_dist = ((_k[None, None, :] - _k[None, :, None]) * np.array([-1, 1])[:, None, None] - 1) % 16 + 1
+_h = np.arange(engine.MAX_SEEDS + 1)[:, None, None, None]
+_SOW = ((_h - _dist.transpose(1, 0, 2)[None] + 16) // 16).astype(np.int8)   # (97, 16, 2, 16)
+del _k, _dist, _h
+
+
+class BatchSimulator:
+    """
+    N plateaux dans un tableau (N, 2, 16), avancés tous ensemble d'UN semis par
+    tick avec des opérations masquées. À chaque tick, chaque partie en cours :
+      - choisit un coup (politique aléatoire uniforme) si elle n'a rien en main,
+      - sème toutes ses graines en main (calcul d'un bloc, voir step()),
+      - applique fin de partie > CAPTURE > RELAIS > STOP (1re rangée effective
+        incluse) ; CAPTURE et RELAIS remettent des graines en main pour le
+        tick suivant, comme katro_engine.resolve_move.
+    Un coup qui dépasse `max_sows` graines est nul (DRAW) ; la détection de
+    cycles par hachage n'est pas vectorisée, le budget suffit à borner.
+    Les parties finies sont relancées dans `run()` pour garder N plateaux actifs.
+    """
+
+    def __init__(self, n, seeds_per_pit=SEEDS_PER_PIT, direction_mode="fixed",
+                 seed=None, max_sows=MAX_SOWS, max_plies=1000):
+        self.n = int(n)
+        self.seeds_per_pit = int(seeds_per_pit)
+        self.free = direction_mode == "free"
+        self.rng = np.random.default_rng(seed)
+        self.max_sows = int(max_sows)
+        self.max_plies = int(max_plies)
+
+        n = self.n
+        self.board = np.zeros((n, 2, 16), dtype=np.int8)   # ordre des chemins (voir plus haut)
+        self.rows = self.board.reshape(2 * n, 16)   # vue : ligne 2*b + (joueur - 1)
+        self.side = np.zeros(n, dtype=np.intp)      # joueur au trait - 1
+        self.totals = np.zeros((n, 2), dtype=np.int16)  # graines par camp (main comprise)
+        self.hand = np.zeros(n, dtype=np.int16)     # graines en main
+        self.pos = np.zeros(n, dtype=np.int16)      # position sur le chemin (0..15)
+        self.dirn = np.ones(n, dtype=np.int16)      # sens du coup en cours
+        self.sown = np.zeros(n, dtype=np.int32)     # graines semées dans le coup
+        self.winner = np.zeros(n, dtype=np.int8)    # 0 en cours, 1, 2 ou DRAW
+        self.plies = np.zeros(n, dtype=np.int32)
+        self.captures = np.zeros(n, dtype=np.int32)
+        self.relays = np.zeros(n, dtype=np.int32)
+        self.reset()
+
+    @property
+    def player(self):
+        return self.side + 1
+
+    @property
+    def pits(self):
+        """Plateaux au format de katro_engine (N, 32) — copie, pour inspection."""
+        out = np.zeros((self.n, ROWS * COLS), dtype=np.int16)
+        out[:, _PATH[0]] = self.board[:, 0]
+        out[:, _PATH[1]] = self.board[:, 1]
+        return out
+
+    def reset(self, mask=None):
+        """Remet en position initiale les plateaux de `mask` (tous par défaut)."""
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        self.board[mask] = self.seeds_per_pit
+        self.totals[mask] = self.seeds_per_pit * 16
+        for a in (self.side, self.hand, self.pos, self.sown, self.winner,
+                  self.plies, self.captures, self.relays):
+            a[mask] = 0
+        self.dirn[mask] = 1
+
+    # -- politique --
+    def choose_moves(self, b):
+        """Coups (position de départ sur le chemin, sens) pour les plateaux `b` :
+        aléatoire uniforme parmi les cases non vides du joueur au trait."""
+        valid = self.rows[2 * b + self.side[b]] > 0                      # (M, 16)
+        keys = self.rng.random(valid.shape, dtype=np.float32)
+        keys[~valid] = -1.0
+        start = keys.argmax(1)
+        if self.free:
+            step = np.where(self.rng.random(len(b)) < 0.5, 1, -1).astype(np.int16)
+        else:
+            step = np.ones(len(b), dtype=np.int16)
+        return start, step
+
+    # -- un tick --
+    def step(self):
+        """
+        Avance toutes les parties en cours d'un semis complet ; renvoie le nombre
+        de parties actives. Le semis de h graines sur le cycle de 16 cases se
+        calcule d'un bloc : chaque case reçoit h // 16 graines, plus une pour
+        les h % 16 premières dans le sens du coup.
+        """
+        rows = self.rows
+        running = self.winner == 0
+
+        # 1) choix + ramassage pour les parties qui n'ont rien en main
+        b = np.flatnonzero(running & (self.hand == 0))
+        if len(b):
+            start, step = self.choose_moves(b)
+            r = 2 * b + self.side[b]
+            self.hand[b] = rows[r, start]
+            rows[r, start] = 0
+            self.pos[b] = start
+            self.dirn[b] = step
+            self.sown[b] = 0
+
+        # 2) semis de toute la main
+        b = np.flatnonzero(running)
+        if not len(b):
+            return 0
+        r = 2 * b + self.side[b]
+        h = self.hand[b]
+        p0 = self.pos[b]
+        d = self.dirn[b]
+        rows[r] += _SOW[h, p0, (d + 1) >> 1]                             # (M, 16)
+        pos = (p0 + h * d) % 16
+        self.pos[b] = pos
+        self.hand[b] = 0
+        self.sown[b] += h
+
+        # 3) arrivée : fin > CAPTURE > RELAIS > STOP
+        self._land(b, r, pos)
+        return len(b)
+
+    def _land(self, b, r, pos):
+        rows, totals = self.rows, self.totals
+        t = totals[b]
+        end = (t[:, 0] == 0) | (t[:, 1] == 0)
+        if end.any():
+            be = b[end]
+            self.winner[be] = np.where(t[end, 0] == 0, 2, 1)
+            self.plies[be] += 1
+            go = ~end
+            b, r, pos = b[go], r[go], pos[go]
+            if not len(b):
+                return
+        here = rows[r, pos]
+
+        # 1) CAPTURE : arrivée sur la 1re rangée (positions 0..7), case d'en face
+        #    sur la 1re rangée adverse, ou la 2e si la 1re est vide
+        cap = pos < COLS
+        ci = np.flatnonzero(cap)
+        if len(ci):
+            oc, pc = r[ci] ^ 1, pos[ci]
+            front_empty = ~rows[oc, :COLS].any(1)
+            opp_pos = np.where(front_empty, 15 - pc, pc)
+            there = rows[oc, opp_pos].astype(np.int16)
+            ok = there > 0
+            cap[ci[~ok]] = False
+            if ok.any():
+                ci, oc, opp_pos, there = ci[ok], oc[ok], opp_pos[ok], there[ok]
+                bc, rc = b[ci], r[ci]
+                self.hand[bc] = there + here[ci]
+                rows[oc, opp_pos] = 0
+                rows[rc, pos[ci]] = 0
+                # totaux à plat : case 2*b + (joueur - 1), comme les lignes
+                tf = totals.reshape(-1)
+                tf[rc] += there
+                tf[oc] -= there
+                self.captures[bc] += 1
+
+        # 2) RELAIS
+        relay = ~cap & (here > 1)
+        if relay.any():
+            over = relay & (self.sown[b] >= self.max_sows)
+            self.winner[b[over]] = DRAW
+            relay &= ~over
+            br = b[relay]
+            self.hand[br] = here[relay]
+            rows[r[relay], pos[relay]] = 0
+            self.relays[br] += 1
+
+        # 3) STOP
+        stop = ~cap & ~relay & (self.winner[b] == 0)
+        bs = b[stop]
+        self.side[bs] ^= 1
+        self.plies[bs] += 1
+
+        # parties trop longues : le camp le plus fourni l'emporte
+        long_ = bs[self.plies[bs] >= self.max_plies]
+        if len(long_):
+            l1, l2 = totals[long_, 0], totals[long_, 1]
+            self.winner[long_] = np.where(l1 > l2, 1, np.where(l2 > l1, 2, DRAW))
+
+    # -- boucle complète --
+    def run(self, n_games):
+        """
+        Joue `n_games` parties (les plateaux libérés sont relancés) et renvoie
+        un dict de tableaux : winner, plies, captures, relays (une case par partie).
+        """
+        out = {"winner": [], "plies": [], "captures": [], "relays": []}
+        done = 0
+        started = self.n
+        live = np.ones(self.n, dtype=bool)   # slot occupé par une partie à compter
+        if n_games < self.n:
+            live[n_games:] = False
+            self.winner[~live] = DRAW        # slots inutiles : gelés
+            started = n_games
+        while done < n_games:
+            self.step()
+            fin = np.flatnonzero(live & (self.winner != 0))
+            if not len(fin):
+                continue
+            for k, a in (("winner", self.winner), ("plies", self.plies),
+                         ("captures", self.captures), ("relays", self.relays)):
+                out[k].append(a[fin].copy())
+            done += len(fin)
+            # relance (ou gel) des slots libérés
+            again = fin[:max(0, n_games - started)]
+            started += len(again)
+            mask = np.zeros(self.n, dtype=bool)
+            mask[again] = True
+            self.reset(mask)
+            rest = fin[len(again):]
+            live[rest] = False
+        return {k: np.concatenate(v)[:n_games] for k, v in out.items()}
+
+
+def scalar_games(n_games, seeds_per_pit=SEEDS_PER_PIT, direction_mode="fixed", seed=None, max_plies=1000):
+    """Même politique avec le moteur scalaire (référence de vitesse)."""
+    import random
+    rng = random.Random(seed)
+    winners = []
+    for _ in range(n_games):
+        s = engine.KatroState.initial(seeds_per_pit)
+        winner = 0
+        for _ in range(max_plies):
+            idx, step = rng.choice(engine.legal_moves(s, direction_mode))
+            winner = engine.play_inplace(s, idx, step)
+            if winner:
+                break
+        winners.append(winner)
+    return winners
+
+
+def _main():
+    ap = argparse.ArgumentParser(description="Simulation KATRO vectorisée (parties aléatoires).")
+    ap.add_argument("--games", type=int, default=20000)
+    ap.add_argument("--boards", type=int, default=16384, help="plateaux simulés en parallèle")
+    ap.add_argument("--seeds", type=int, default=SEEDS_PER_PIT, choices=(2, 3))
+    ap.add_argument("--direction", default="fixed", choices=("fixed", "free"))
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--compare", type=int, default=200, help="parties scalaires pour comparer (0 = non)")
+    args = ap.parse_args()
+
+    sim = BatchSimulator(args.boards, args.seeds, args.direction, seed=args.seed)
+    t0 = time.perf_counter()
+    res = sim.run(args.games)
+    dt = time.perf_counter() - t0
+    w = res["winner"]
+    print(f"batch  : {args.games} parties en {dt:.2f}s -> {args.games / dt:,.0f} parties/s")
+    print(f"         J1 {np.mean(w == 1):.3f}  J2 {np.mean(w == 2):.3f}  nul {np.mean(w == DRAW):.3f}"
+          f"  | demi-coups moy. {res['plies'].mean():.1f}  relais/partie {res['relays'].mean():.1f}"
+          f"  captures/partie {res['captures'].mean():.1f}")
+    if args.compare:
+        t0 = time.perf_counter()
+        scalar_games(args.compare, args.seeds, args.direction, seed=args.seed)
+        ds = time.perf_counter() - t0
+        print(f"scalaire : {args.compare / ds:,.0f} parties/s  (x{(args.games / dt) / (args.compare / ds):.1f})")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,254 @@
+# katro_tournament.py — tournoi de bots KATRO sur tous les cœurs (sans Kivy)
+# Sert à vérifier qu'un changement d'IA la rend réellement plus forte.
+#
+#   python katro_tournament.py random ab2 ab4 mcts500 --games 200 --seeds 2 3 --direction fixed free
+#
+# Bots : random | ab<profondeur> (ab seul = au temps) | mcts<playouts> (mcts seul = au temps)
+
+import argparse
+import math
+import os
+import random
+import re
+import time
+from itertools import combinations, product
+from multiprocessing import Pool
+
+import katro_engine as engine
+import katro_ai
+
+_SPEC = re.compile(r"^(random|ab|mcts)(\d*)$")
+
+# résultat d'une partie, du point de vue du bot A
+A_WINS, B_WINS, DRAWN = 1, 2, 3
+
+
+# ---------- bots ----------
+class RandomBot:
+    def __init__(self, direction_mode, seed):
+        self.direction_mode = direction_mode
+        self.rng = random.Random(seed)
+
+    def choose(self, state):
+        moves = engine.legal_moves(state, self.direction_mode)
+        return self.rng.choice(moves) if moves else None
+
+
+def check_spec(spec):
+    """Valide un nom de bot (pour argparse) et le renvoie."""
+    if not _SPEC.match(spec):
+        raise argparse.ArgumentTypeError(f"bot inconnu: {spec!r} (random, ab<n>, mcts<n>)")
+    return spec
+
+
+def bot_budget(spec, time_budget):
+    """Budget par coup de `spec` : time_budget s'il est donné, sinon pas de
+    limite pour ab<n>/mcts<n> et budget du niveau par défaut pour ab/mcts."""
+    if time_budget is not None:
+        return time_budget
+    return math.inf if _SPEC.match(spec).group(2) else katro_ai.LEVELS[katro_ai.DEFAULT_LEVEL]
+
+
+def make_bot(spec, direction_mode, time_budget, seed):
+    kind, n = _SPEC.match(spec).groups()
+    if kind == "random":
+        return RandomBot(direction_mode, seed)
+    time_budget = bot_budget(spec, time_budget)
+    if kind == "ab":
+        # profondeur fixe : le budget de temps ne sert que de garde-fou
+        return katro_ai.AlphaBetaAI(time_budget, direction_mode,
+                                    max_depth=int(n) if n else 64, tt=katro_ai.TranspositionTable(14))
+    return katro_ai.MCTSAI(time_budget, direction_mode,
+                           max_playouts=int(n) if n else None, seed=seed)
+
+
+# ---------- une partie (dans un processus de travail) ----------
+def play_game(task):
+    """
+    Joue une partie et renvoie un tuple d'entiers/flottants (pas de plateau) :
+    (game_id, résultat pour A, demi-coups, captures, relais, plus longue chaîne
+    de relais, coups avec relais, temps de réflexion de A, de B, coups de A, de B).
+    """
+    (game_id, spec_a, spec_b, a_first, seeds, direction_mode, seed,
+     time_budget, opening, max_plies) = task
+    bots = {
+        "A": make_bot(spec_a, direction_mode, time_budget, seed * 2),
+        "B": make_bot(spec_b, direction_mode, time_budget, seed * 2 + 1),
+    }
+    by_player = {1: "A", 2: "B"} if a_first else {1: "B", 2: "A"}
+    think = {"A": 0.0, "B": 0.0}
+    moves = {"A": 0, "B": 0}
+
+    # ouverture aléatoire commune aux deux parties d'une paire (couleurs inversées)
+    rng = random.Random(seed)
+    s = engine.KatroState.initial(seeds)
+    plies = captures = relays = longest = relay_moves = 0
+    winner = 0
+    while not winner and plies < max_plies:
+        if plies < opening:
+            move = rng.choice(engine.legal_moves(s, direction_mode))
+        else:
+            who = by_player[s.player]
+            t0 = time.perf_counter()
+            move = bots[who].choose(s)
+            think[who] += time.perf_counter() - t0
+            moves[who] += 1
+        r = engine.resolve_move(s, *move)
+        s, winner = r.state, r.winner
+        plies += 1
+        chain = 0
+        for ev in r.trace:
+            if ev[0] == engine.RELAY:
+                chain += 1
+            elif ev[0] == engine.CAPTURE:
+                captures += 1
+        relays += chain
+        longest = max(longest, chain)
+        relay_moves += chain > 0
+
+    if not winner:
+        # partie trop longue : le camp le plus fourni l'emporte
+        t1, t2 = s.totals[1], s.totals[2]
+        winner = 1 if t1 > t2 else 2 if t2 > t1 else engine.DRAW
+    if winner == engine.DRAW:
+        result = DRAWN
+    else:
+        result = A_WINS if by_player[winner] == "A" else B_WINS
+    return (game_id, result, plies, captures, relays, longest, relay_moves,
+            think["A"], think["B"], moves["A"], moves["B"])
+
+
+# ---------- statistiques ----------
+def wilson(score, n, z=1.96):
+    """Intervalle de Wilson (95 %) pour une proportion observée `score` sur n parties."""
+    if not n:
+        return 0.0, 1.0
+    d = 1 + z * z / n
+    centre = (score + z * z / (2 * n)) / d
+    half = z * math.sqrt(score * (1 - score) / n + z * z / (4 * n * n)) / d
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+class MatchStats:
+    """Cumul des résultats compacts d'un duel A contre B."""
+    __slots__ = ("a", "b", "games", "wins", "losses", "draws", "plies", "captures",
+                 "relays", "longest", "relay_moves", "think", "moves")
+
+    def __init__(self, a, b):
+        self.a, self.b = a, b
+        self.games = self.wins = self.losses = self.draws = 0
+        self.plies = self.captures = self.relays = self.longest = self.relay_moves = 0
+        self.think = [0.0, 0.0]
+        self.moves = [0, 0]
+
+    def add(self, res):
+        _, result, plies, captures, relays, longest, relay_moves, ta, tb, ma, mb = res
+        self.games += 1
+        self.wins += result == A_WINS
+        self.losses += result == B_WINS
+        self.draws += result == DRAWN
+        self.plies += plies
+        self.captures += captures
+        self.relays += relays
+        self.longest = max(self.longest, longest)
+        self.relay_moves += relay_moves
+        self.think[0] += ta
+        self.think[1] += tb
+        self.moves[0] += ma
+        self.moves[1] += mb
+
+    @property
+    def score(self):
+        """Score de A (victoire 1, nulle 1/2)."""
+        return (self.wins + 0.5 * self.draws) / self.games if self.games else 0.0
+
+    def report(self):
+        lo, hi = wilson(self.score, self.games)
+        n = max(1, self.games)
+        plies = max(1, self.plies)
+        ms = [1000 * t / max(1, m) for t, m in zip(self.think, self.moves)]
+        return (f"{self.a:>8} - {self.b:<8} {self.games:5d}  "
+                f"+{self.wins} ={self.draws} -{self.losses}  "
+                f"score A {self.score:.3f} [{lo:.3f}, {hi:.3f}]  "
+                f"| demi-coups {self.plies / n:6.1f}  relais/coup {self.relays / plies:.2f}"
+                f"  coups avec relais {self.relay_moves / plies:.0%}  chaîne max {self.longest}"
+                f"  captures/partie {self.captures / n:.1f}"
+                f"  | ms/coup {ms[0]:.1f} / {ms[1]:.1f}")
+
+
+# ---------- tournoi ----------
+def tasks_for(bots, games, seeds, direction_mode, base_seed, time_budget, opening, max_plies):
+    """Toutes les parties d'un tournoi toutes-rondes ; chaque paire de parties
+    consécutives partage la même ouverture avec les couleurs inversées."""
+    tasks = []
+    for a, b in combinations(bots, 2):
+        for g in range(games):
+            gid = len(tasks)
+            tasks.append((gid, a, b, g % 2 == 0, seeds, direction_mode,
+                          base_seed + gid - (g % 2), time_budget, opening, max_plies))
+    return tasks
+
+
+def run_tournament(bots, games, seeds, direction_mode, base_seed=0, time_budget=None,
+                   opening=2, max_plies=400, processes=None, on_result=None):
+    """Répartit les parties sur `processes` processus et renvoie {(a, b): MatchStats}.
+    time_budget None : voir bot_budget (même défaut que --time)."""
+    tasks = tasks_for(bots, games, seeds, direction_mode, base_seed, time_budget, opening, max_plies)
+    stats = {(a, b): MatchStats(a, b) for a, b in combinations(bots, 2)}
+    pair_of = [(t[1], t[2]) for t in tasks]
+    chunk = max(1, len(tasks) // (16 * (processes or os.cpu_count() or 1)))
+    with Pool(processes) as pool:
+        for res in pool.imap_unordered(play_game, tasks, chunksize=chunk):
+            stats[pair_of[res[0]]].add(res)
+            if on_result:
+                on_result(res)
+    return stats
+
+
+def standings(stats):
+    """Score cumulé de chaque bot sur tous ses duels : {bot: (score, parties)}."""
+    total = {}
+    for st in stats.values():
+        for bot, pts in ((st.a, st.wins + 0.5 * st.draws), (st.b, st.losses + 0.5 * st.draws)):
+            p, n = total.get(bot, (0.0, 0))
+            total[bot] = (p + pts, n + st.games)
+    return {bot: (p / n if n else 0.0, n) for bot, (p, n) in total.items()}
+
+
+def _main():
+    ap = argparse.ArgumentParser(description="Tournoi de bots KATRO (multi-processus).")
+    ap.add_argument("bots", nargs="+", type=check_spec, help="random, ab<profondeur>, mcts<playouts>, ab, mcts")
+    ap.add_argument("--games", type=int, default=100, help="parties par duel (paires de couleurs)")
+    ap.add_argument("--seeds", type=int, nargs="+", default=[engine.SEEDS_PER_PIT], choices=(2, 3))
+    ap.add_argument("--direction", nargs="+", default=["fixed"], choices=("fixed", "free"))
+    ap.add_argument("--time", type=float, default=None,
+                    help=f"budget par coup des bots au temps (défaut {katro_ai.LEVELS[katro_ai.DEFAULT_LEVEL]}) ;"
+                         " si donné, garde-fou aussi pour ab<n>/mcts<n> (sinon sans limite)")
+    ap.add_argument("--opening", type=int, default=2, help="demi-coups aléatoires en début de partie")
+    ap.add_argument("--max-plies", type=int, default=400)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--processes", type=int, default=None, help="par défaut : tous les cœurs")
+    args = ap.parse_args()
+    if len(args.bots) < 2:
+        ap.error("il faut au moins deux bots")
+    if len(set(args.bots)) != len(args.bots):
+        ap.error("bot en double : " + ", ".join(sorted({b for b in args.bots if args.bots.count(b) > 1})))
+
+    for seeds, direction_mode in product(args.seeds, args.direction):
+        print(f"== {seeds} graines/case, sens {direction_mode} ==")
+        t0 = time.perf_counter()
+        stats = run_tournament(args.bots, args.games, seeds, direction_mode, args.seed,
+                               args.time, args.opening, args.max_plies, args.processes)
+        dt = time.perf_counter() - t0
+        for st in stats.values():
+            print(st.report())
+        print("classement :")
+        for bot, (score, n) in sorted(standings(stats).items(), key=lambda kv: -kv[1][0]):
+            lo, hi = wilson(score, n)
+            print(f"  {bot:>8}  {score:.3f} [{lo:.3f}, {hi:.3f}]  ({n} parties)")
+        n_games = sum(st.games for st in stats.values())
+        print(f"{n_games} parties en {dt:.1f}s\n")
+
+
+if __name__ == "__main__":
+    _main()
@@ -1,15 +1,18 @@
 # main.py — Shell KATRO (écrans & UI)
 # Compatible Kivy 2.3.0 / KivyMD 1.2.0
+import os
 from dataclasses import dataclass
 from kivy.lang import Builder
 from kivy.utils import get_color_from_hex as hex
 from kivy.properties import ObjectProperty, StringProperty, NumericProperty, ListProperty
 from kivy.clock import Clock
+from kivy.storage.jsonstore import JsonStore
 
 from kivymd.app import MDApp
 from kivymd.uix.screenmanager import MDScreenManager
 from kivymd.uix.screen import MDScreen
 from kivymd.uix.dialog import MDDialog
+from kivymd.uix.button import MDFlatButton
 
 # (les 3 imports ci-dessous ne sont pas indispensables ici, mais gardés si tu veux t'en servir)
 from kivy.uix.boxlayout import BoxLayout
@@ -20,6 +23,11 @@ from online import OnlineClient   # ton fichier online.py
 WS_URL = "ws://localhost:8765/ws"    # plus tard: wss://ton-domaine/ws
 
 from KATRO import KatroBoard, ROWS, COLS, SEEDS_PER_PIT
+import katro_engine as engine
+from katro_ai import (
+    LEVELS as AI_LEVELS, DEFAULT_LEVEL as AI_DEFAULT_LEVEL,
+    ENGINES as AI_ENGINES, DEFAULT_ENGINE as AI_DEFAULT_ENGINE,
+)
 
 KV = """
 #:import dp kivy.metrics.dp
@@ -213,11 +221,14 @@ KV = """
 
 <AIScreen>:
     name: "ai"
+    # la réflexion de l'IA s'arrête quand on quitte l'écran et reprend au retour
+    on_leave: board_ai.cancel_ai()
+    on_enter: board_ai.resume_ai()
     MDBoxLayout:
         orientation: "vertical"
 
         MDTopAppBar:
-            title: "KATRO — Contre ordinateur"
+            title: "KATRO — Contre ordinateur" + (("  · réfléchit… " + board_ai.ai_progress) if board_ai.ai_thinking else "")
             md_bg_color: app.c_appbar
             specific_text_color: 1, 1, 1, 1
             left_action_items: [["arrow-left", lambda *_: app.go_home()]]
@@ -368,6 +379,63 @@ KV = """
 
                 MDSeparator:
 
+                # --- Niveau de l'ordinateur ---
+                MDLabel:
+                    text: "Niveau de l'ordinateur"
+                    font_style: "H6"
+                    size_hint_y: None
+                    height: self.texture_size[1]
+
+                MDBoxLayout:
+                    spacing: dp(10)
+                    adaptive_height: True
+
+                    MDCheckbox:
+                        group: "ai_level"
+                        active: app.ai_level == "facile"
+                        on_active: app.set_ai_level("facile") if self.active else None
+                    MDLabel:
+                        text: "Facile"
+                        halign: "left"
+
+                    MDCheckbox:
+                        group: "ai_level"
+                        active: app.ai_level == "moyen"
+                        on_active: app.set_ai_level("moyen") if self.active else None
+                    MDLabel:
+                        text: "Moyen"
+                        halign: "left"
+
+                    MDCheckbox:
+                        group: "ai_level"
+                        active: app.ai_level == "difficile"
+                        on_active: app.set_ai_level("difficile") if self.active else None
+                    MDLabel:
+                        text: "Difficile"
+                        halign: "left"
+
+                MDBoxLayout:
+                    spacing: dp(10)
+                    adaptive_height: True
+
+                    MDCheckbox:
+                        group: "ai_engine"
+                        active: app.ai_engine == "alphabeta"
+                        on_active: app.set_ai_engine("alphabeta") if self.active else None
+                    MDLabel:
+                        text: "Alpha-bêta"
+                        halign: "left"
+
+                    MDCheckbox:
+                        group: "ai_engine"
+                        active: app.ai_engine == "mcts"
+                        on_active: app.set_ai_engine("mcts") if self.active else None
+                    MDLabel:
+                        text: "Monte-Carlo (MCTS)"
+                        halign: "left"
+
+                MDSeparator:
+
                 # --- Son ---
                 MDLabel:
                     text: "Son"
@@ -439,7 +507,8 @@ class KatroAppShell(MDApp):
         "tu prends ces graines + celles de ta case et tu continues. "
         "La 2ᵉ rangée adverse devient 1ʳᵉ si la 1ʳᵉ est vide.\n"
         "• STOP : si la case d’arrivée était vide (devient 1) et qu’aucune capture n’est possible, le tour passe.\n"
-        "• Fin : si un camp n’a plus de graines, il perd."
+        "• Fin : si un camp n’a plus de graines, il perd. "
+        "Un coup dont les relais tournent en boucle sans fin donne une partie nulle."
     )
     info_outro = StringProperty(
         "Bonne partie ! Partage KATRO — un jeu simple et profond du patrimoine malagasy."
@@ -467,6 +536,8 @@ class KatroAppShell(MDApp):
     # Paramètres gameplay
     seeds_per_pit = NumericProperty(SEEDS_PER_PIT)   # 2 ou 3
     direction_mode = StringProperty("fixed")         # "fixed" ou "free"
+    ai_level = StringProperty(AI_DEFAULT_LEVEL)       # "facile" | "moyen" | "difficile"
+    ai_engine = StringProperty(AI_DEFAULT_ENGINE)     # "alphabeta" | "mcts"
 
     # Audio global (lié aux widgets Paramètres)
     sound_enabled = NumericProperty(1)   # 1=ON / 0=OFF
@@ -483,6 +554,13 @@ class KatroAppShell(MDApp):
         self.room_code = ""
         self.role = None         # "a" ou "b"
         self.board_online = None # plateau courant en ligne
+        self._online_rules = {}  # seeds / direction annoncés par le serveur dans "start"
+        self._online_state = None  # copie du plateau serveur (vérif. du hash)
+        self._queue_dialog = None  # "Recherche d'un adversaire" (matchmaking)
+        # identité en ligne (id + secret remis par le serveur) et classement
+        self._identity_store = JsonStore(os.path.join(self.user_data_dir, "katro_identity.json"))
+        self.identity = self._identity_store.get("me") if self._identity_store.exists("me") else None
+        self.rating = None
 
         Builder.load_string(KV)
 
@@ -500,6 +578,8 @@ class KatroAppShell(MDApp):
 
     # --------- Hooks init des plateaux
     def _init_board_common(self, board: KatroBoard):
+        board.cancel_ai()
+        board.abort_move()
         board.pits = [self.seeds_per_pit] * (ROWS * COLS)
         board.update_counts()
         board.direction_mode = self.direction_mode
@@ -517,6 +597,8 @@ class KatroAppShell(MDApp):
         self.board_ai = scrai.ids.board_ai
         self.board_ai.vs_ai = True
         self.board_ai.ai_player = 2
+        self.board_ai.ai_level = self.ai_level
+        self.board_ai.ai_engine = self.ai_engine
         self._init_board_common(self.board_ai)
 
     # --------- Navigation
@@ -540,7 +622,8 @@ class KatroAppShell(MDApp):
                 on_message=self._on_ws_message,
                 on_open=lambda: self._set_status("Connecté au serveur"),
                 on_close=lambda: self._set_status("Connexion fermée"),
-                on_error=lambda e: self._set_status(f"Erreur: {e}")
+                on_error=lambda e: self._set_status(f"Erreur: {e}"),
+                identity=self.identity,
             )
             self._set_status("Connexion…")
             self.online.connect()
@@ -554,13 +637,32 @@ class KatroAppShell(MDApp):
 
 
     def goto_matchmaking(self):
-        MDDialog(title="Bientôt", text="À implémenter.").open()
+        # file d'attente du serveur : adversaire de niveau proche, puis match_start
+        self._ensure_online()
+        self.online.join_queue()
+        if self._queue_dialog is None:
+            self._queue_dialog = MDDialog(
+                title="Recherche d'un adversaire",
+                text="Recherche en cours…",
+                auto_dismiss=False,
+                buttons=[MDFlatButton(text="ANNULER", on_release=lambda *_: self.cancel_matchmaking())],
+            )
+        self._queue_dialog.open()
+
+    def cancel_matchmaking(self):
+        if self.online:
+            self.online.leave_queue()
+        self._close_queue_dialog()
+
+    def _close_queue_dialog(self):
+        if self._queue_dialog is not None:
+            self._queue_dialog.dismiss()
 
     # --------- Online client
     def online_connect(self):
         if self.online:
             return
-        self.online = OnlineClient(WS_URL, self._on_ws_message)
+        self.online = OnlineClient(WS_URL, self._on_ws_message, identity=self.identity)
         self.online.connect()
 
     def online_create(self):
@@ -568,7 +670,7 @@ class KatroAppShell(MDApp):
         scr.ids.lbl_status.text = "Connexion..."
         self._ensure_online()
         # grâce à la queue, on peut envoyer tout de suite :
-        self.online.create_room()
+        self.online.create_room(self.seeds_per_pit, self.direction_mode)
 
     def online_join(self, code):
         scr = self.sm.get_screen("online")
@@ -614,17 +716,49 @@ class KatroAppShell(MDApp):
             self.role = msg.get("role", "b")
             self._set_status(f"Rejoint la salle {self.room_code} (rôle {self.role}).")
 
+        elif t == "identity":
+            # 1re connexion : le secret n'est envoyé qu'une fois, on le garde
+            if msg.get("secret"):
+                self.identity = {"player_id": msg["player_id"], "secret": msg["secret"]}
+                self._identity_store.put("me", **self.identity)
+            self.rating = msg.get("rating")
+
+        elif t == "rating":
+            # partie classée terminée
+            before, self.rating = self.rating, msg.get("rating")
+            delta = f" ({self.rating - before:+d})" if isinstance(before, int) and isinstance(self.rating, int) else ""
+            self.snack(f"Classement : {self.rating}{delta}, rang {msg.get('rank') or '-'}")
+
+        elif t == "queue_joined":
+            if self._queue_dialog is not None:
+                self._queue_dialog.text = f"Recherche en cours… (classement {msg.get('rating', '?')})"
+
+        elif t == "match_start":
+            # adversaire trouvé (matchmaking ou invitation) : la partie commence tout de suite
+            self._close_queue_dialog()
+            self.room_code = msg.get("code", "")
+            self.role = msg.get("role", "a")
+            self._online_rules = {k: msg[k] for k in ("seeds", "direction") if k in msg}
+            try:
+                self.start_online_match()
+            except Exception as e:
+                print("start_online_match error:", e)
+
         elif t == "peer_joined":
             self._set_status(f"Un ami a rejoint ({self.room_code}).")
 
         elif t == "start":
-            # Ouvrir l’écran plateau en ligne
+            # Ouvrir l’écran plateau en ligne (règles fixées par le serveur)
+            self._online_rules = {k: msg[k] for k in ("seeds", "direction") if k in msg}
             try:
                 self.start_online_match()
             except Exception as e:
                 print("start_online_match error:", e)
 
         elif t == "move":
+            # 0) Le serveur arbitre : on rejoue le coup sur notre copie et on compare le hash
+            self._check_online_hash(msg)
+
             # 1) Si c'est le coup que NOUS venons d'envoyer (même nonce), on ignore.
             nonce = msg.get("nonce")
             if self.board_online and nonce and getattr(self.board_online, "_last_local_nonce", None) == nonce:
@@ -656,17 +790,75 @@ class KatroAppShell(MDApp):
                 pass
 
 
+        elif t == "resumed":
+            # retour après une coupure : l'état serveur fait foi (coups manqués inclus)
+            self._set_status(f"Reconnecté à la salle {msg.get('code', '')}.")
+            self._apply_server_board(msg)
+
+        elif t == "sync":
+            # réponse à request_sync() après un hash différent
+            self._set_status("Plateau recalé sur le serveur.")
+            self._apply_server_board(msg)
+
+        elif t == "opponent_away":
+            self._set_status(f"Connexion de l'adversaire perdue, attente ({int(msg.get('grace', 0))} s)…")
+
+        elif t == "opponent_back":
+            self._set_status("L'adversaire est de retour.")
+
+        elif t in ("opponent_left", "peer_left"):
+            self._set_status("L'adversaire a quitté la partie.")
+
         elif t == "error":
-            self._set_status(f"Erreur: {msg.get('reason', 'inconnue')}")
+            reason = msg.get("reason", "inconnue")
+            self._set_status(f"Erreur: {reason}")
+            if reason in ("not_your_turn", "illegal_move", "bad_direction", "game_over") and self.board_online:
+                # coup refusé par le serveur : notre plateau a pris de l'avance,
+                # on revient sur celui du serveur (joint à l'erreur)
+                print("[APP] coup refusé par le serveur:", reason, "seq", msg.get("seq"))
+                self._apply_server_board(msg)
+
 
 
 
 
+    def _apply_server_board(self, msg: dict):
+        """Recale le plateau en ligne et sa copie moteur sur l'état envoyé par le serveur."""
+        board = self.board_online
+        if board is None or not msg.get("pits"):
+            return
+        board.abort_move()   # coup local en cours d'animation : il n'a pas eu lieu
+        board.pits = list(msg["pits"])
+        board.player = int(msg.get("next", board.player))
+        board.update_counts()
+        self._online_state = engine.KatroState(msg["pits"], board.player)
+        self._update_turn_banner()
+
+    def _check_online_hash(self, msg: dict):
+        """Rejoue le coup diffusé sur la copie locale du plateau serveur et compare les hash."""
+        if self._online_state is None or "hash" not in msg:
+            return
+        try:
+            r = engine.resolve_move(self._online_state, int(msg.get("idx", -1)), int(msg.get("step", 1)))
+        except ValueError as e:
+            print("[APP] coup serveur injouable localement:", e)
+            return
+        self._online_state = r.state
+        if f"{r.state.key:016x}" != msg["hash"]:
+            print("[APP] désynchronisé au coup", msg.get("seq"))
+            self._set_status("Plateau désynchronisé avec le serveur.")
+            if self.online:
+                self.online.request_sync()   # la réponse "sync" recale le plateau
 
     def start_online_match(self):
         print("[APP] start_online_match()")
         board = KatroBoard(vs_ai=False)
         self._init_board_common(board)
+        seeds = self._online_rules.get("seeds", self.seeds_per_pit)
+        board.pits = [seeds] * (ROWS * COLS)
+        board.update_counts()
+        board.direction_mode = self._online_rules.get("direction", board.direction_mode)
+        self._online_state = engine.KatroState.initial(seeds)
         board.vs_ai = False
         board.online_mode = True
 
@@ -712,7 +904,8 @@ class KatroAppShell(MDApp):
                 on_message=self._on_ws_message,
                 on_open=lambda: self._set_status("Connecté au serveur"),
                 on_close=lambda: self._set_status("Connexion fermée"),
-                on_error=lambda e: self._set_status(f"Erreur: {e}")
+                on_error=lambda e: self._set_status(f"Erreur: {e}"),
+                identity=self.identity,
             )
             self._set_status("Connexion…")
             self.online.connect()
@@ -734,6 +927,7 @@ class KatroAppShell(MDApp):
         self.room_code = ""
         self.role = None
         self.board_online = None
+        self._online_state = None
         self.go_home()
 
     # --------- Paramètres (callbacks)
@@ -755,6 +949,20 @@ class KatroAppShell(MDApp):
             if board:
                 board.direction_mode = mode
 
+    def set_ai_level(self, level:str):
+        if level not in AI_LEVELS: return
+        self.ai_level = level
+        board = self.sm.get_screen("ai").ids.get("board_ai")
+        if board:
+            board.ai_level = level
+
+    def set_ai_engine(self, name:str):
+        if name not in AI_ENGINES: return
+        self.ai_engine = name
+        board = self.sm.get_screen("ai").ids.get("board_ai")
+        if board:
+            board.ai_engine = name
+
     def set_sound_enabled(self, value):
         self.sound_enabled = 1 if value else 0
         for sid, wid in (("local2p","board"), ("ai","board_ai")):
@@ -1,10 +1,15 @@
 # online.py
-import json, threading
-from websocket import WebSocketApp
+import threading
+from websocket import WebSocketApp, ABNF
 from kivy.clock import Clock
 
+import katro_codec as codec
+
+# reconnexion automatique pendant une partie (le serveur garde la place ~30 s)
+RECONNECT_DELAYS = (0.5, 1, 2, 4, 8, 8)
+
 class OnlineClient:
-    def __init__(self, url, on_message=None, on_open=None, on_close=None, on_error=None):
+    def __init__(self, url, on_message=None, on_open=None, on_close=None, on_error=None, identity=None):
         self.url = url
         self.on_message = on_message
         self.on_open = on_open
@@ -13,6 +18,22 @@ class OnlineClient:
         self.ws = None
         self._t = None
         self.connected = False
+        self.codec = codec.JSON   # katro.bin1 si le serveur l'accepte
+        # identité persistante {"player_id", "secret"} gardée par l'app ;
+        # None : le serveur en crée une à la 1re connexion (message "identity")
+        self.identity = identity
+        # reprise de session : jeton reçu à room_created / room_joined / match_start
+        # et dernier seq de coup reçu
+        self.resume_token = None
+        self.last_seq = 0
+        # en file de matchmaking : redemandé après une reconnexion (le serveur l'oublie)
+        self.queued = None
+        # spectateur : salle regardée (redemandée après une reconnexion) et
+        # instantané "spectating" reçu ou non
+        self.watching = None
+        self.watch_synced = False
+        self._closing = False
+        self._retry = 0
 
     def connect(self):
         def _ui(fn, *args):
@@ -20,47 +41,146 @@ class OnlineClient:
 
         def _on_open(ws):
             self.connected = True
+            self.codec = ws.sock.subprotocol or codec.JSON
+            self._retry = 0
+            self.identify()
+            if self.resume_token:
+                # une seule requête : le serveur renvoie les coups manqués et l'état
+                self.send_json({"type":"resume","token":self.resume_token,"seq":self.last_seq})
+            elif self.queued is not None:
+                self.send_json(self.queued)
+            elif self.watching is not None:
+                self.watch_synced = False
+                self.send_json(self.watching)
             if self.on_open: _ui(self.on_open)
 
         def _on_close(ws, *a):
             self.connected = False
+            if (self.resume_token or self.watching) and not self._closing:
+                self._reconnect_later()
             if self.on_close: _ui(self.on_close)
 
         def _on_error(ws, e):
             if self.on_error: _ui(self.on_error, e)
 
-        def _on_message(ws, txt):
+        def _on_message(ws, frame):
             try:
-                msg = json.loads(txt)
+                msg = codec.decode(frame)
             except Exception:
                 return
+            if self._skip(msg):
+                return
+            self._track(msg)
             if self.on_message: _ui(self.on_message, msg)
 
+        self._closing = False
         self.ws = WebSocketApp(
             self.url, on_open=_on_open, on_close=_on_close,
-            on_error=_on_error, on_message=_on_message
+            on_error=_on_error, on_message=_on_message,
+            subprotocols=list(codec.SUBPROTOCOLS)
         )
         self._t = threading.Thread(target=self.ws.run_forever, daemon=True)
         self._t.start()
 
+    def _track(self, msg):
+        t = msg.get("type")
+        if t == "identity" and msg.get("secret"):
+            self.identity = {"player_id": msg["player_id"], "secret": msg["secret"]}
+        elif t == "error" and msg.get("reason") == "bad_identity":
+            # identité inconnue du serveur : on en demande une nouvelle
+            self.identity = None
+            self.identify()
+        if msg.get("token"):
+            self.resume_token = msg["token"]
+        if t in ("start", "match_start"):
+            self.last_seq = 0
+            self.queued = None
+        elif t in ("move", "resumed", "sync") and "seq" in msg:
+            self.last_seq = int(msg["seq"])
+        elif t == "queue_left":
+            self.queued = None
+        elif t == "spectating":
+            self.watch_synced = True
+            self.last_seq = int(msg.get("seq", 0))
+        elif t == "spectate_end":
+            self.watching = None
+        elif t == "opponent_left" or (t == "error" and msg.get("reason") == "bad_token"):
+            self.resume_token = None
+
+    def _skip(self, msg):
+        # spectateur : rien avant l'instantané, ni les coups qu'il contient déjà
+        if self.watching is None or msg.get("type") not in ("move", "start"):
+            return False
+        if not self.watch_synced:
+            return True
+        return msg.get("type") == "move" and int(msg.get("seq", 0)) <= self.last_seq
+
+    def _reconnect_later(self):
+        if self._retry >= len(RECONNECT_DELAYS):
+            self.resume_token = None
+            return
+        delay = RECONNECT_DELAYS[self._retry]
+        self._retry += 1
+        t = threading.Timer(delay, lambda: (not self._closing) and self.connect())
+        t.daemon = True
+        t.start()
+
     def send_json(self, obj):
+        # encodé selon le codec négocié (binaire pour move / ping, sinon JSON)
         try:
             if self.ws and self.connected:
-                self.ws.send(json.dumps(obj))
+                frame = codec.encode(obj, self.codec)
+                if isinstance(frame, bytes):
+                    self.ws.send(frame, opcode=ABNF.OPCODE_BINARY)
+                else:
+                    self.ws.send(frame)
         except Exception:
             pass
 
     # API
-    def create_room(self): self.send_json({"type":"create_room"})
+    def identify(self, name=None):
+        msg = {"type":"identify"}
+        if self.identity: msg.update(self.identity)
+        if name: msg["name"] = name
+        self.send_json(msg)
+    def create_room(self, seeds=None, direction=None):
+        # règles de la partie (le serveur les renvoie dans "start")
+        msg = {"type":"create_room"}
+        if seeds is not None: msg["seeds"] = int(seeds)
+        if direction is not None: msg["direction"] = direction
+        self.send_json(msg)
+    def join_queue(self, rating=None, name=None):
+        # matchmaking : le serveur répond queue_joined, puis match_start
+        msg = {"type":"queue_join"}
+        if rating is not None: msg["rating"] = int(rating)
+        if name: msg["name"] = name
+        self.queued = msg
+        self.send_json(msg)
+    def leave_queue(self):
+        self.queued = None
+        self.send_json({"type":"queue_leave"})
     def join_room(self, code): self.send_json({"type":"join_room","code":str(code).upper()})
+    def spectate(self, code):
+        # regarder une salle : "spectating" (instantané) puis chaque coup
+        self.watching = {"type":"spectate","code":str(code).upper()}
+        self.watch_synced = False
+        self.send_json(self.watching)
+    def unspectate(self):
+        self.watching = None
+        self.send_json({"type":"unspectate"})
     def send_move(self, idx, step, player, nonce):
         self.send_json({"type":"move","idx":idx,"step":step,"player":player,"nonce":nonce})
-    def leave(self): self.send_json({"type":"leave"})
+    def request_sync(self):
+        # plateau désynchronisé : le serveur répond "sync" (pits + état de la partie)
+        self.send_json({"type":"sync"})
+    def leave(self):
+        self.resume_token = None
+        self.send_json({"type":"leave"})
     def close(self):
+        self._closing = True
         try:
             if self.ws:
                 self.ws.close()
         except Exception:
             pass
         self.connected = False
-
@@ -0,0 +1,480 @@
+# backplane.py — bus de messages entre workers du serveur KATRO
+#
+# Interface commune (voir Backplane) :
+#   publish(canal, dict)          envoi sans attente, dans l'ordre d'appel
+#   subscribe(canal, handler)     handler(dict) appelé pour chaque message du canal
+#   claim / get / delete          petites clés partagées (propriétaire d'une salle)
+#   keep                          clé posée sans condition (présence d'un worker)
+#   hset / hdel / hgetall         tables partagées (annuaire du lobby)
+#
+# Les clés posées par claim / keep ont une durée de vie (ttl) prolongée tant
+# que le worker tourne : s'il plante, elles expirent et ses codes de salle se
+# libèrent. Après une coupure, RedisBackplane se reconnecte (délais croissants),
+# se réabonne, repose ses clés et appelle on_reconnect() ; pendant la coupure,
+# les commandes attendues échouent (ConnectionError) au lieu de rester pendantes
+# et les envois sans réponse sont perdus.
+#
+# Deux implémentations :
+#   LocalBackplane  un seul processus (par défaut) : dicts en mémoire
+#   RedisBackplane  protocole Redis (RESP2) sur asyncio, sans dépendance ;
+#                   marche avec Redis ou avec le remplaçant local ci-dessous :
+#
+#   python backplane.py --port 6390      # mini serveur RESP pour tests / dev
+
+import argparse
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Optional
+
+
+class Backplane(ABC):
+    """Interface (les méthodes async ne servent qu'au démarrage et aux réservations)."""
+    distributed = False
+    on_reconnect: Optional[Callable[[], None]] = None
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    def publish(self, channel: str, message: dict):
+        ...
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        ...
+
+    @abstractmethod
+    async def claim(self, key: str, value: str) -> bool:
+        """Pose `key` = `value` si la clé est libre ; True si c'est fait."""
+
+    @abstractmethod
+    def keep(self, key: str, value: str):
+        """Pose `key` = `value`, gardée tant que le worker tourne (jusqu'à delete)."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def hset(self, key: str, field: str, value: str):
+        ...
+
+    @abstractmethod
+    def hdel(self, key: str, field: str):
+        ...
+
+    @abstractmethod
+    async def hgetall(self, key: str) -> dict[str, str]:
+        ...
+
+
+def make_backplane(url: str, ttl: float = 30.0) -> Backplane:
+    """"" -> LocalBackplane ; "redis://hote:port" -> RedisBackplane (clés expirant après `ttl` s)."""
+    if not url:
+        return LocalBackplane()
+    if url.startswith("redis://"):
+        host, _, port = url[len("redis://"):].rstrip("/").partition(":")
+        return RedisBackplane(host or "127.0.0.1", int(port or 6379), ttl)
+    raise ValueError(f"backplane inconnu: {url!r}")
+
+
+# ---------- un seul processus ----------
+class LocalBackplane(Backplane):
+    def __init__(self):
+        self.handlers: dict[str, list] = {}
+        self.keys: dict[str, str] = {}
+        self.hashes: dict[str, dict] = {}
+
+    def publish(self, channel: str, message: dict):
+        # livraison au tour de boucle suivant, comme un vrai bus
+        loop = asyncio.get_running_loop()
+        for handler in self.handlers.get(channel, ()):
+            loop.call_soon(handler, message)
+
+    async def subscribe(self, channel: str, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    async def claim(self, key: str, value: str) -> bool:
+        if key in self.keys:
+            return False
+        self.keys[key] = value
+        return True
+
+    def keep(self, key: str, value: str):
+        self.keys[key] = value
+
+    async def get(self, key: str) -> Optional[str]:
+        return self.keys.get(key)
+
+    def delete(self, key: str):
+        self.keys.pop(key, None)
+
+    def hset(self, key: str, field: str, value: str):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hdel(self, key: str, field: str):
+        self.hashes.get(key, {}).pop(field, None)
+
+    async def hgetall(self, key: str) -> dict[str, str]:
+        return dict(self.hashes.get(key, {}))
+
+
+# ---------- protocole RESP2 ----------
+def encode_command(*args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for a in args:
+        b = a if isinstance(a, bytes) else str(a).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+    return b"".join(out)
+
+
+class RespError(Exception):
+    pass
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Lit une réponse RESP2 (les erreurs sont renvoyées comme RespError, pas levées)."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connexion fermée")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RespError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        n = int(rest)
+        if n < 0:
+            return None
+        data = await reader.readexactly(n + 2)
+        return data[:-2]
+    if kind == b"*":
+        n = int(rest)
+        if n < 0:
+            return None
+        return [await read_reply(reader) for _ in range(n)]
+    raise ConnectionError(f"réponse RESP invalide: {line!r}")
+
+
+RECONNECT_DELAYS = (0.5, 1, 2, 4, 8)
+COMMAND_TIMEOUT = 5.0
+# octets écrits vers Redis et pas encore partis : au-delà, Redis ne suit plus
+# et la connexion est coupée (publish() n'attend pas, la file ne se viderait jamais)
+WRITE_HIGH_WATER = 8 * 1024 * 1024
+
+
+class RedisBackplane(Backplane):
+    """
+    Deux connexions : une pour les commandes (envoyées en pipeline, réponses
+    lues dans l'ordre par une tâche de fond), une pour les abonnements.
+    publish() écrit tout de suite dans le flux : l'ordre des messages d'un
+    worker est donc conservé sans attendre les réponses.
+    """
+    distributed = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, ttl: float = 30.0):
+        self.host, self.port = host, port
+        self.ttl = ttl
+        self.handlers: dict[str, list] = {}
+        self.kept: dict[str, str] = {}   # clés à prolonger (claim / keep), jusqu'à delete
+        # futures des commandes, dans l'ordre d'envoi ; None : réponse ignorée
+        self._pending: deque = deque()
+        self._cmd_writer = self._sub_writer = None
+        self._tasks: list[asyncio.Task] = []
+        self._refresher: Optional[asyncio.Task] = None
+        self._reconnecting: Optional[asyncio.Task] = None
+        self.connected = False
+        self.closing = False
+
+    async def start(self):
+        await self._connect()
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        self.closing = True
+        for t in (self._refresher, self._reconnecting):
+            if t is not None:
+                t.cancel()
+        self._disconnect()
+
+    async def _connect(self):
+        reader, self._cmd_writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            sub_reader, self._sub_writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self._cmd_writer.close()
+            raise
+        self.connected = True
+        if self.handlers:
+            self._sub_writer.write(encode_command("SUBSCRIBE", *self.handlers))
+        self._tasks = [asyncio.create_task(self._read_replies(reader)),
+                       asyncio.create_task(self._read_messages(sub_reader))]
+
+    def _disconnect(self):
+        """Ferme les deux connexions ; les commandes en attente échouent."""
+        self.connected = False
+        for t in self._tasks:
+            if t is not asyncio.current_task():
+                t.cancel()
+        self._tasks = []
+        for w in (self._cmd_writer, self._sub_writer):
+            if w is not None:
+                w.close()
+        self._cmd_writer = self._sub_writer = None
+        while self._pending:
+            fut = self._pending.popleft()
+            if fut is not None and not fut.done():
+                fut.set_exception(ConnectionError("backplane déconnecté"))
+
+    def _lost(self, why):
+        if not self.connected or self.closing:
+            return
+        print("[BACKPLANE] connexion perdue:", why)
+        self._disconnect()
+        self._reconnecting = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        attempt = 0
+        while not self.closing:
+            await asyncio.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            attempt += 1
+            try:
+                await self._connect()
+            except OSError as e:
+                print(f"[BACKPLANE] reconnexion impossible ({attempt}): {e}")
+                continue
+            print("[BACKPLANE] reconnecté")
+            self._refresh()   # le serveur a pu redémarrer : nos clés d'abord
+            if self.on_reconnect is not None:
+                self.on_reconnect()
+            return
+
+    def _ex(self) -> int:
+        return max(1, round(self.ttl))
+
+    def _refresh(self):
+        for key, value in self.kept.items():
+            self._send("SET", key, value, "EX", self._ex(), wait=False)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            self._refresh()
+
+    def _send(self, *args, wait: bool = True) -> Optional[asyncio.Future]:
+        if not self.connected:
+            if not wait:
+                return None   # perdu : rien n'attend la réponse
+            fut = asyncio.get_running_loop().create_future()
+            fut.set_exception(ConnectionError("backplane déconnecté"))
+            return fut
+        fut = asyncio.get_running_loop().create_future() if wait else None
+        self._pending.append(fut)
+        writer = self._cmd_writer
+        writer.write(encode_command(*args))
+        if writer.transport.get_write_buffer_size() > WRITE_HIGH_WATER:
+            # les commandes en attente (celle-ci comprise) échouent, puis reconnexion
+            self._lost("file d'envoi pleine")
+        return fut
+
+    async def _command(self, *args):
+        try:
+            reply = await asyncio.wait_for(self._send(*args), COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            # connexion muette : on la considère perdue plutôt que d'attendre toujours
+            self._lost("pas de réponse")
+            raise ConnectionError("backplane sans réponse") from None
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    async def _read_replies(self, reader):
+        try:
+            while True:
+                reply = await read_reply(reader)
+                fut = self._pending.popleft()
+                if fut is not None and not fut.done():
+                    fut.set_result(reply)
+        except (ConnectionError, asyncio.IncompleteReadError, IndexError) as e:
+            self._lost(f"commandes: {e!r}")
+
+    async def _read_messages(self, reader):
+        try:
+            while True:
+                item = await read_reply(reader)
+                if isinstance(item, list) and len(item) == 3 and item[0] == b"message":
+                    channel = item[1].decode()
+                    message = json.loads(item[2])
+                    for handler in self.handlers.get(channel, ()):
+                        try:
+                            handler(message)
+                        except Exception as e:
+                            print(f"[BACKPLANE] handler {channel}: {e!r}")
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self._lost(f"abonnements: {e!r}")
+
+    # -- interface --
+    def publish(self, channel: str, message: dict):
+        self._send("PUBLISH", channel, json.dumps(message), wait=False)
+
+    async def subscribe(self, channel: str, handler):
+        first = channel not in self.handlers
+        self.handlers.setdefault(channel, []).append(handler)
+        if first and self.connected:
+            self._sub_writer.write(encode_command("SUBSCRIBE", channel))
+            await self._sub_writer.drain()
+
+    async def claim(self, key: str, value: str) -> bool:
+        ok = await self._command("SET", key, value, "NX", "EX", self._ex()) == "OK"
+        if ok:
+            self.kept[key] = value
+        return ok
+
+    def keep(self, key: str, value: str):
+        self.kept[key] = value
+        self._send("SET", key, value, "EX", self._ex(), wait=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        v = await self._command("GET", key)
+        return None if v is None else v.decode()
+
+    def delete(self, key: str):
+        self.kept.pop(key, None)
+        self._send("DEL", key, wait=False)
+
+    def hset(self, key: str, field: str, value: str):
+        self._send("HSET", key, field, value, wait=False)
+
+    def hdel(self, key: str, field: str):
+        self._send("HDEL", key, field, wait=False)
+
+    async def hgetall(self, key: str) -> dict[str, str]:
+        flat = await self._command("HGETALL", key) or []
+        return {flat[i].decode(): flat[i + 1].decode() for i in range(0, len(flat), 2)}
+
+
+# ---------- remplaçant local de Redis (tests / dev) ----------
+class MiniRedis:
+    """
+    Serveur RESP2 minimal en mémoire : PING, PUBLISH, SUBSCRIBE, UNSUBSCRIBE,
+    SET (NX, EX, PX), GET, DEL, HSET, HDEL, HGETALL. Juste ce qu'utilise
+    RedisBackplane, pour lancer plusieurs workers sans installer Redis.
+    """
+
+    def __init__(self):
+        self.keys: dict[bytes, tuple[bytes, Optional[float]]] = {}
+        self.hashes: dict[bytes, dict] = {}
+        self.subscribers: dict[bytes, set] = {}
+
+    async def serve(self, host="127.0.0.1", port=6390):
+        server = await asyncio.start_server(self._client, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def _get(self, key):
+        v = self.keys.get(key)
+        if v is None:
+            return None
+        value, expires = v
+        if expires is not None and expires < time.monotonic():
+            del self.keys[key]
+            return None
+        return value
+
+    async def _client(self, reader, writer):
+        channels = set()
+        try:
+            while True:
+                cmd = await read_reply(reader)
+                if not isinstance(cmd, list) or not cmd:
+                    break
+                name, args = cmd[0].upper(), cmd[1:]
+                writer.write(self._run(name, args, writer, channels))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for ch in channels:
+                self.subscribers.get(ch, set()).discard(writer)
+            writer.close()
+
+    def _run(self, name, args, writer, channels) -> bytes:
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name == b"PUBLISH":
+            ch, data = args
+            frame = encode_command(b"message", ch, data)
+            subs = self.subscribers.get(ch, ())
+            for w in subs:
+                w.write(frame)
+            return b":%d\r\n" % len(subs)
+        if name in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+            out = []
+            for ch in args:
+                if name == b"SUBSCRIBE":
+                    self.subscribers.setdefault(ch, set()).add(writer)
+                    channels.add(ch)
+                else:
+                    self.subscribers.get(ch, set()).discard(writer)
+                    channels.discard(ch)
+                out.append(b"*3\r\n" + encode_command(name.lower())[4:] +
+                           b"$%d\r\n%s\r\n:%d\r\n" % (len(ch), ch, len(channels)))
+            return b"".join(out)
+        if name == b"SET":
+            key, value, opts = args[0], args[1], [a.upper() for a in args[2:]]
+            expires = None
+            for i, o in enumerate(opts):
+                if o in (b"EX", b"PX"):
+                    n = float(args[2 + i + 1])
+                    expires = time.monotonic() + (n if o == b"EX" else n / 1000)
+            if b"NX" in opts and self._get(key) is not None:
+                return b"$-1\r\n"
+            self.keys[key] = (value, expires)
+            return b"+OK\r\n"
+        if name == b"GET":
+            v = self._get(args[0])
+            return b"$-1\r\n" if v is None else b"$%d\r\n%s\r\n" % (len(v), v)
+        if name == b"DEL":
+            n = sum(self.keys.pop(k, None) is not None for k in args)
+            return b":%d\r\n" % n
+        if name == b"HSET":
+            h = self.hashes.setdefault(args[0], {})
+            new = 0
+            for i in range(1, len(args) - 1, 2):
+                new += args[i] not in h
+                h[args[i]] = args[i + 1]
+            return b":%d\r\n" % new
+        if name == b"HDEL":
+            h = self.hashes.get(args[0], {})
+            n = sum(h.pop(f, None) is not None for f in args[1:])
+            return b":%d\r\n" % n
+        if name == b"HGETALL":
+            h = self.hashes.get(args[0], {})
+            flat = [x for kv in h.items() for x in kv]
+            return encode_command(*flat) if flat else b"*0\r\n"
+        return b"-ERR unknown command '%s'\r\n" % name
+
+
+def _main():
+    ap = argparse.ArgumentParser(description="Mini serveur RESP (remplaçant local de Redis).")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=6390)
+    args = ap.parse_args()
+    print(f"mini-redis sur {args.host}:{args.port}")
+    asyncio.run(MiniRedis().serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    _main()
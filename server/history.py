@@ -0,0 +1,242 @@
+# history.py — historique des parties du serveur KATRO (SQLite, écriture différée)
+#
+# Le serveur ne fait jamais d'E/S disque dans la boucle asyncio :
+#   put(clé, make)   note qu'une partie a changé (début, coup, fin) ; rien n'est
+#                    écrit tout de suite. Les notes sont fusionnées par clé :
+#                    une partie jouée 40 fois dans la seconde = une seule ligne.
+#   flush()          au plus FLUSH_EVERY s après la première note (ou dès BATCH
+#                    parties en attente) : make() construit chaque ligne, puis
+#                    tout le lot part en une transaction dans le thread
+#                    d'écriture. Un seul lot à la fois : pendant qu'il s'écrit,
+#                    les notes suivantes s'accumulent pour le lot d'après.
+#   games_of / game  lectures, dans le même thread (index par joueur).
+#
+#   make_store("")                 -> NullStore (historique désactivé)
+#   make_store("katro.sqlite3")    -> SQLiteStore
+#
+# BatchWriter (l'écriture différée seule) sert aussi aux classements (ratings.py).
+
+import asyncio
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+FLUSH_EVERY = 1.0
+BATCH = 500
+
+GAMES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id        TEXT PRIMARY KEY,
+    code      TEXT NOT NULL,
+    started   REAL NOT NULL,
+    ended     REAL,                 -- NULL tant que la partie est en cours
+    status    TEXT NOT NULL,        -- playing | finished | abandoned
+    seeds     INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    player_a  TEXT,
+    name_a    TEXT,
+    player_b  TEXT,
+    name_b    TEXT,
+    moves     TEXT NOT NULL,        -- JSON [[idx, step], ...]
+    plies     INTEGER NOT NULL,
+    winner    INTEGER NOT NULL      -- 0 (pas de gagnant), 1, 2 ou 3 (nulle)
+);
+CREATE TABLE IF NOT EXISTS game_players (
+    player  TEXT NOT NULL,
+    started REAL NOT NULL,
+    game_id TEXT NOT NULL,
+    spot    TEXT NOT NULL,
+    PRIMARY KEY (player, started, game_id)
+) WITHOUT ROWID;
+"""
+
+# colonnes de games, dans l'ordre des enregistrements (dict) reçus par put()
+COLUMNS = ("id", "code", "started", "ended", "status", "seeds", "direction",
+           "player_a", "name_a", "player_b", "name_b", "moves", "plies", "winner")
+
+_UPSERT = (
+    f"INSERT INTO games ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+    "ON CONFLICT(id) DO UPDATE SET "
+    + ", ".join(f"{c} = excluded.{c}" for c in COLUMNS if c not in ("id", "code", "started"))
+)
+
+
+class GameStore(ABC):
+    """Interface : put() / flush() sans attente ; le reste est async."""
+    rows_written = 0
+    batches = 0
+    failures = 0
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    def put(self, key: str, make: Callable[[], dict]):
+        ...
+
+    def flush(self):
+        pass
+
+    def pending_count(self) -> int:
+        return 0
+
+    async def games_of(self, player: str, limit: int = 20, before: Optional[float] = None,
+                       before_id: str = "") -> list[dict]:
+        return []
+
+    async def game(self, game_id: str) -> Optional[dict]:
+        return None
+
+
+def make_store(path: str) -> GameStore:
+    """"" -> NullStore ; sinon chemin du fichier SQLite."""
+    return SQLiteStore(path) if path else NullStore()
+
+
+class NullStore(GameStore):
+    def put(self, key: str, make: Callable[[], dict]):
+        pass
+
+
+class BatchWriter(ABC):
+    """
+    Écriture différée sur une connexion SQLite à elle (voir plus haut). Les
+    sous-classes fournissent SCHEMA et _write_rows(db, lignes).
+    """
+    SCHEMA = ""
+
+    def __init__(self, path: str, flush_every: float = FLUSH_EVERY, batch: int = BATCH):
+        self.path = path
+        self.flush_every = flush_every
+        self.batch = batch
+        self.pending: dict[str, Callable] = {}   # clé -> fabrique de la ligne
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.writing: Optional[asyncio.Task] = None
+        # un seul thread : la connexion SQLite y vit, écritures et lectures s'y suivent
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="katro-db")
+        self._db: Optional[sqlite3.Connection] = None
+        self.rows_written = 0
+        self.batches = 0
+        self.failures = 0
+
+    async def run(self, fn, *args):
+        """fn(db, *args) dans le thread de la connexion."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._call, fn, args)
+
+    def _call(self, fn, args):
+        return fn(self._db, *args)
+
+    async def start(self):
+        await self.run(self._open)
+
+    async def close(self):
+        while self.pending or self.writing is not None:
+            self.flush()
+            if self.writing is not None:
+                await self.writing
+        await self.run(self._close)
+        self._pool.shutdown(wait=True)
+
+    # -- écriture différée --
+    def put(self, key: str, make: Callable[[], dict]):
+        self.pending[key] = make
+        if len(self.pending) >= self.batch:
+            self.flush()
+        elif self.handle is None:
+            self.handle = asyncio.get_running_loop().call_later(self.flush_every, self.flush)
+
+    def flush(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if not self.pending or self.writing is not None:
+            return   # le lot en cours relancera flush() en finissant
+        rows = [make() for make in self.pending.values()]
+        self.pending.clear()
+        self.writing = asyncio.get_running_loop().create_task(self._write(rows))
+
+    def pending_count(self) -> int:
+        return len(self.pending)
+
+    async def _write(self, rows: list[dict]):
+        try:
+            await self.run(self._write_rows, rows)
+            self.rows_written += len(rows)
+            self.batches += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"[DB] {self.path}: écriture de {len(rows)} lignes impossible: {e!r}")
+        finally:
+            self.writing = None
+            if self.pending and self.handle is None:
+                self.flush()
+
+    # -- thread d'écriture --
+    def _open(self, _db):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")   # plusieurs workers sur le même fichier
+        db.executescript(self.SCHEMA)
+        db.row_factory = sqlite3.Row
+        self._db = db
+
+    def _close(self, db):
+        if db is not None:
+            db.close()
+            self._db = None
+
+    @abstractmethod
+    def _write_rows(self, db: sqlite3.Connection, rows: list):
+        ...
+
+
+class SQLiteStore(BatchWriter, GameStore):
+    SCHEMA = GAMES_SCHEMA
+
+    # -- lectures --
+    async def games_of(self, player: str, limit: int = 20, before: Optional[float] = None,
+                       before_id: str = "") -> list[dict]:
+        """Parties d'un joueur, les plus récentes d'abord. Curseur (`before`, `before_id`) :
+        started et id de la dernière reçue ; l'id départage les parties commencées au même
+        instant (sans lui, `before` seul saute les suivantes)."""
+        return await self.run(self._games_of, player, limit, before, before_id)
+
+    async def game(self, game_id: str) -> Optional[dict]:
+        return await self.run(self._game, game_id)
+
+    # -- thread d'écriture --
+    def _write_rows(self, db: sqlite3.Connection, rows: list[dict]):
+        with db:
+            db.executemany(_UPSERT, [tuple(r[c] for c in COLUMNS) for r in rows])
+            db.executemany(
+                "INSERT OR IGNORE INTO game_players (player, started, game_id, spot) VALUES (?, ?, ?, ?)",
+                [(r[f"player_{spot}"], r["started"], r["id"], spot)
+                 for r in rows for spot in ("a", "b") if r[f"player_{spot}"]],
+            )
+
+    def _games_of(self, db: sqlite3.Connection, player: str, limit: int, before: Optional[float],
+                  before_id: str) -> list[dict]:
+        # (started, game_id) suit la clé primaire de game_players : parcours d'index pur
+        cur = db.execute(
+            "SELECT g.* FROM game_players p JOIN games g ON g.id = p.game_id "
+            "WHERE p.player = ? AND (p.started, p.game_id) < (?, ?) "
+            "ORDER BY p.started DESC, p.game_id DESC LIMIT ?",
+            (player, float("inf") if before is None else before, before_id, limit),
+        )
+        return [_game_dict(row) for row in cur]
+
+    def _game(self, db: sqlite3.Connection, game_id: str) -> Optional[dict]:
+        row = db.execute("SELECT * FROM games WHERE id = ?", (game_id,)).fetchone()
+        return _game_dict(row) if row else None
+
+
+def _game_dict(row: sqlite3.Row) -> dict:
+    game = dict(row)
+    game["moves"] = json.loads(game["moves"])
+    return game
@@ -0,0 +1,168 @@
+# katro_codec.py — encodage des messages websocket KATRO (client et serveur)
+# Même fichier dans client/ et server/, comme katro_engine.py.
+#
+# Le codec est négocié à la connexion par sous-protocole websocket :
+#   "katro.bin1"  messages fréquents en trames binaires à format fixe
+#                 (move, ping, presence_delta) ; tout le reste en JSON texte
+#   "katro.json"  (ou aucun sous-protocole) : tout en JSON texte, comme avant
+# Un message qui ne rentre pas dans son format fixe (champ inattendu, valeur
+# hors bornes) part simplement en JSON : decode() accepte les deux.
+#
+# Trames binaires (little-endian), 1er octet = étiquette :
+#   0x01 move client  idx u8, step i8, player u8, nonce
+#   0x02 move serveur idx u8, step i8, player u8, seq u32, hash u64, next u8, winner u8, nonce
+#   0x03 ping         [t u64]
+#   0x04 presence_delta  version u32, nb u16 de fiches added / removed / updated,
+#                     puis les fiches en un seul texte utf-8 : champs id, name, status,
+#                     avatar séparés par \x1f, fiches séparées par \x1e
+# nonce : 0 = absent, 1 = chaîne de chiffres tenant sur u64, 2 = chaîne u8 + utf-8
+
+import json
+import struct
+from typing import Optional, Union
+
+JSON = "katro.json"
+BIN1 = "katro.bin1"
+SUBPROTOCOLS = (BIN1, JSON)   # par ordre de préférence
+
+_MOVE_IN = struct.Struct("<BBbB")
+_MOVE_OUT = struct.Struct("<BBbBIQBB")
+_PING = struct.Struct("<BQ")
+_DELTA = struct.Struct("<BIHHH")
+_U64 = struct.Struct("<Q")
+
+T_MOVE_IN, T_MOVE_OUT, T_PING, T_DELTA = 1, 2, 3, 4
+TAG_TYPES = {T_MOVE_IN: "move", T_MOVE_OUT: "move", T_PING: "ping", T_DELTA: "presence_delta"}
+
+_MOVE_IN_KEYS = {"type", "idx", "step", "player", "nonce"}
+_MOVE_OUT_KEYS = _MOVE_IN_KEYS | {"seq", "hash", "next", "winner"}
+_USER_KEYS = ("id", "name", "status", "avatar")
+_DELTA_LISTS = ("added", "removed", "updated")
+_FIELD, _RECORD = "\x1f", "\x1e"
+
+
+def negotiate(offered) -> Optional[str]:
+    """Sous-protocole retenu parmi ceux proposés par le client (None : aucun proposé)."""
+    for proto in SUBPROTOCOLS:
+        if proto in (offered or ()):
+            return proto
+    return None
+
+
+class _NoFit(Exception):
+    """Le message ne rentre pas dans le format binaire : il partira en JSON."""
+
+
+def _str(s) -> bytes:
+    if not isinstance(s, str):
+        raise _NoFit
+    b = s.encode()
+    if len(b) > 255:
+        raise _NoFit
+    return bytes((len(b),)) + b
+
+
+def _nonce(nonce) -> bytes:
+    if nonce is None:
+        return b"\x00"
+    if isinstance(nonce, str) and nonce.isdigit() and nonce == str(int(nonce)) and int(nonce) < 1 << 64:
+        return b"\x01" + _U64.pack(int(nonce))
+    return b"\x02" + _str(nonce)
+
+
+def _encode_bin(msg: dict) -> bytes:
+    t = msg.get("type")
+    if t == "move":
+        keys = msg.keys()
+        if keys == _MOVE_OUT_KEYS:
+            head = _MOVE_OUT.pack(T_MOVE_OUT, msg["idx"], msg["step"], msg["player"], msg["seq"],
+                                  int(msg["hash"], 16), msg["next"], msg["winner"])
+        elif keys == _MOVE_IN_KEYS:
+            head = _MOVE_IN.pack(T_MOVE_IN, msg["idx"], msg["step"], msg["player"])
+        else:
+            raise _NoFit
+        return head + _nonce(msg["nonce"])
+    if t == "ping":
+        if len(msg) == 1:
+            return bytes((T_PING,))
+        if len(msg) == 2 and type(msg.get("t")) is int:
+            return _PING.pack(T_PING, msg["t"])
+        raise _NoFit
+    if t == "presence_delta":
+        if len(msg) != 5:
+            raise _NoFit
+        lists = [msg[name] for name in _DELTA_LISTS]
+        records = []
+        for users in lists:
+            for user in users:
+                if len(user) != 4:
+                    raise _NoFit
+                records.append(_FIELD.join([user["id"], user["name"], user["status"], user["avatar"]]))
+        body = _RECORD.join(records)
+        # un séparateur dans un nom décalerait tous les champs
+        if body.count(_FIELD) != 3 * len(records) or body.count(_RECORD) != max(0, len(records) - 1):
+            raise _NoFit
+        return _DELTA.pack(T_DELTA, msg["version"], *map(len, lists)) + body.encode()
+    raise _NoFit
+
+
+def encode(msg: dict, codec: str = JSON) -> Union[str, bytes]:
+    """Trame à envoyer : bytes si le codec et le type le permettent, sinon JSON (str)."""
+    if codec == BIN1:
+        try:
+            return _encode_bin(msg)
+        except (_NoFit, KeyError, TypeError, ValueError, struct.error):
+            pass
+    return json.dumps(msg)
+
+
+def _read_str(data: bytes, pos: int) -> tuple[str, int]:
+    n = data[pos]
+    end = pos + 1 + n
+    return data[pos + 1:end].decode(), end
+
+
+def _read_nonce(data: bytes, pos: int):
+    kind = data[pos]
+    if kind == 0:
+        return None
+    if kind == 1:
+        return str(_U64.unpack_from(data, pos + 1)[0])
+    return _read_str(data, pos + 1)[0]
+
+
+def decode(frame: Union[str, bytes]) -> dict:
+    """Message reçu, trame texte (JSON) ou binaire ; ValueError si illisible."""
+    if isinstance(frame, str):
+        return json.loads(frame)
+    try:
+        tag = frame[0]
+        if tag == T_MOVE_OUT:
+            _, idx, step, player, seq, key, nxt, winner = _MOVE_OUT.unpack_from(frame)
+            return {"type": "move", "idx": idx, "step": step, "player": player,
+                    "nonce": _read_nonce(frame, _MOVE_OUT.size), "seq": seq,
+                    "hash": f"{key:016x}", "next": nxt, "winner": winner}
+        if tag == T_MOVE_IN:
+            _, idx, step, player = _MOVE_IN.unpack_from(frame)
+            return {"type": "move", "idx": idx, "step": step, "player": player,
+                    "nonce": _read_nonce(frame, _MOVE_IN.size)}
+        if tag == T_PING:
+            if len(frame) == 1:
+                return {"type": "ping"}
+            return {"type": "ping", "t": _PING.unpack_from(frame)[1]}
+        if tag == T_DELTA:
+            _, version, *counts = _DELTA.unpack_from(frame)
+            body = frame[_DELTA.size:].decode()
+            records = body.split(_RECORD) if body else []
+            if len(records) != sum(counts):
+                raise ValueError("nombre de fiches")
+            users = [dict(zip(_USER_KEYS, r.split(_FIELD))) for r in records]
+            msg = {"type": "presence_delta", "version": version}
+            pos = 0
+            for name, n in zip(_DELTA_LISTS, counts):
+                msg[name] = users[pos:pos + n]
+                pos += n
+            return msg
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"trame binaire invalide: {e}") from None
+    raise ValueError(f"étiquette binaire inconnue: {frame[:1]!r}")
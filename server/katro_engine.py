@@ -0,0 +1,318 @@
+# katro_engine.py — moteur KATRO sans Kivy (règles pures, résolution synchrone)
+# Utilisé par le plateau (animation d'une trace), l'IA, le serveur et les outils.
+
+import random
+from typing import NamedTuple
+
+ROWS = 4
+COLS = 8
+SEEDS_PER_PIT = 3
+
+J1_ROWS = [2, 3]  # joueur 1 (bas)
+J2_ROWS = [1, 0]  # joueur 2 (haut)
+
+# 1re rangée (celle qui capture) et 2e rangée de chaque joueur
+FRONT_ROW = {1: 2, 2: 1}
+BACK_ROW = {1: 3, 2: 0}
+
+# ---------- trace ----------
+# Chaque évènement est un petit tuple d'entiers, dans l'ordre où le plateau doit l'animer :
+#   (PICK, idx, n)                 on soulève n graines de la case de départ
+#   (SOW, idx)                     une graine tombe dans idx
+#   (CAPTURE, idx, opp_idx, n)     capture en face ; n = graines reprises en main
+#   (RELAY, idx, n)                relais : on ramasse n graines et on continue
+#   (STOP, idx)                    fin du tour sur idx
+#   (END, winner)                  fin de partie (un camp est vide, ou DRAW)
+PICK, SOW, CAPTURE, RELAY, STOP, END = range(6)
+
+# Coup "infini" : la chaîne de relais boucle ou dépasse le budget -> partie nulle
+DRAW = 3
+MAX_SOWS = 4096          # budget de graines semées pour un seul coup
+CYCLE_CHECK_AFTER = 32   # nb de relais avant de mémoriser les positions (chemin rapide)
+
+
+def side_rows(p):
+    return J1_ROWS if p == 1 else J2_ROWS
+
+
+def boustro_path(p):
+    """Parcours en boucle des 16 cases d'un joueur (1re rangée →, 2e rangée ←)."""
+    rows = side_rows(p)
+    return [rows[0]*COLS + c for c in range(COLS)] + [rows[1]*COLS + c for c in reversed(range(COLS))]
+
+
+PATHS = {p: tuple(boustro_path(p)) for p in (1, 2)}
+PATH_POS = {p: {idx: i for i, idx in enumerate(PATHS[p])} for p in (1, 2)}
+SIDE_INDICES = {p: tuple(sorted(PATHS[p])) for p in (1, 2)}
+ROW_OF = bytes(i // COLS for i in range(ROWS * COLS))
+OWNER = bytes(1 if (i // COLS) in J1_ROWS else 2 for i in range(ROWS * COLS))
+
+
+# ---------- hachage de Zobrist ----------
+# Une clé 64 bits par (case, nombre de graines) + une pour "J2 au trait",
+# + une pour le mode "free" (mêlée par l'IA aux clés de sa table de transposition).
+# Graine fixe : le client et le serveur obtiennent les mêmes clés.
+MAX_SEEDS = 3 * ROWS * COLS
+_zrng = random.Random(0x4B4154524F)
+ZOBRIST = tuple(
+    (0,) + tuple(_zrng.getrandbits(64) for _ in range(MAX_SEEDS)) for _ in range(ROWS * COLS)
+)
+Z_SIDE = _zrng.getrandbits(64)
+Z_FREE = _zrng.getrandbits(64)
+del _zrng
+
+
+def zobrist(pits, player):
+    """Clé de Zobrist complète (les états la tiennent à jour de façon incrémentale)."""
+    key = Z_SIDE if player == 2 else 0
+    for i, n in enumerate(pits):
+        key ^= ZOBRIST[i][n]
+    return key
+
+
+def new_board(seeds_per_pit=SEEDS_PER_PIT):
+    return [int(seeds_per_pit)] * (ROWS * COLS)
+
+
+def is_own_pit(player, idx):
+    return (idx // COLS) in side_rows(player)
+
+
+def sum_side(pits, p):
+    return sum(pits[i] for i in SIDE_INDICES[p])
+
+
+# ---------- état compact ----------
+class KatroState:
+    """
+    Plateau compact : 32 octets + joueur au trait, avec totaux par camp,
+    nombre de cases non vides par rangée et clé de Zobrist tenus à jour à
+    chaque mouvement. `copy()` ne coûte qu'une copie de 32 octets et de deux
+    petites listes.
+    """
+    __slots__ = ("pits", "player", "totals", "nonempty", "key")
+
+    def __init__(self, pits=None, player=1):
+        self.pits = bytearray(pits if pits is not None else new_board())
+        if len(self.pits) != ROWS * COLS:
+            raise ValueError(f"plateau de {len(self.pits)} cases (attendu {ROWS * COLS})")
+        if sum(self.pits) > MAX_SEEDS:
+            raise ValueError(f"plus de {MAX_SEEDS} graines sur le plateau")
+        self.player = int(player)
+        self._recount()
+
+    @classmethod
+    def initial(cls, seeds_per_pit=SEEDS_PER_PIT, player=1):
+        return cls(new_board(seeds_per_pit), player)
+
+    def _recount(self):
+        totals = [0, 0, 0]      # index = joueur (0 inutilisé)
+        nonempty = [0] * ROWS   # cases non vides par rangée
+        for i, n in enumerate(self.pits):
+            if n:
+                totals[OWNER[i]] += n
+                nonempty[ROW_OF[i]] += 1
+        self.totals = totals
+        self.nonempty = nonempty
+        self.key = zobrist(self.pits, self.player)
+
+    def copy(self):
+        s = KatroState.__new__(KatroState)
+        s.pits = self.pits[:]
+        s.player = self.player
+        s.totals = self.totals[:]
+        s.nonempty = self.nonempty[:]
+        s.key = self.key
+        return s
+
+    # accès type liste (compat. avec KatroBoard.pits)
+    def __len__(self): return len(self.pits)
+    def __getitem__(self, idx): return self.pits[idx]
+    def __iter__(self): return iter(self.pits)
+    def to_list(self): return list(self.pits)
+
+    def __eq__(self, other):
+        if not isinstance(other, KatroState):
+            return NotImplemented
+        return self.player == other.player and self.pits == other.pits
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"KatroState(player={self.player}, totals={self.totals[1:]}, pits={list(self.pits)})"
+
+    # mouvements élémentaires (totaux tenus à jour)
+    def add(self, idx, n=1):
+        old = self.pits[idx]
+        self.pits[idx] = old + n
+        self.totals[OWNER[idx]] += n
+        z = ZOBRIST[idx]
+        self.key ^= z[old] ^ z[old + n]
+        if not old and n:
+            self.nonempty[ROW_OF[idx]] += 1
+
+    def take(self, idx):
+        """Vide la case `idx` et renvoie son contenu."""
+        n = self.pits[idx]
+        if n:
+            self.pits[idx] = 0
+            self.totals[OWNER[idx]] -= n
+            self.nonempty[ROW_OF[idx]] -= 1
+            self.key ^= ZOBRIST[idx][n]
+        return n
+
+    def set_player(self, p):
+        if p != self.player:
+            self.player = p
+            self.key ^= Z_SIDE
+
+    # tests O(1)
+    def side_empty(self, p): return not self.totals[p]
+    def row_empty(self, r): return not self.nonempty[r]
+
+    def effective_front_row(self, p):
+        """La 2e rangée devient 1re si la 1re est vide."""
+        fr = FRONT_ROW[p]
+        return BACK_ROW[p] if not self.nonempty[fr] else fr
+
+
+def as_state(state, player=None):
+    """Accepte un KatroState ou une liste de 32 entiers (+ joueur)."""
+    if isinstance(state, KatroState):
+        return state
+    return KatroState(state, 1 if player is None else player)
+
+
+def legal_moves(state, direction_mode="fixed"):
+    """Liste des coups (start_idx, step) jouables par le joueur au trait."""
+    pits = state.pits
+    steps = (1, -1) if direction_mode == "free" else (1,)
+    return [(idx, s) for idx in PATHS[state.player] if pits[idx] > 0 for s in steps]
+
+
+class MoveResult(NamedTuple):
+    state: KatroState   # plateau après le coup (state.player = joueur au trait)
+    winner: int         # 0 si la partie continue, 1 ou 2, ou DRAW (coup infini)
+    trace: list         # évènements à animer (voir plus haut)
+
+
+def resolve_move(state, start_idx, step=1, max_sows=MAX_SOWS):
+    """
+    Joue entièrement un coup : semis, puis CAPTURE > RELAIS > STOP jusqu'à l'arrêt.
+    `state` n'est pas modifié ; lève ValueError si le coup n'est pas jouable.
+
+    Le coup est borné : si la chaîne de relais repasse par une position déjà vue
+    (même clé de Zobrist, même case d'arrivée) ou si plus de `max_sows` graines ont été
+    semées, le coup ne s'arrêtera jamais et la partie est déclarée nulle (DRAW).
+    """
+    player = state.player
+    if player not in (1, 2):
+        raise ValueError(f"joueur invalide: {player}")
+    if start_idx not in PATH_POS[player]:
+        raise ValueError(f"case {start_idx} hors du camp du joueur {player}")
+    if state.pits[start_idx] <= 0:
+        raise ValueError(f"case {start_idx} vide")
+
+    s = state.copy()
+    trace = []
+    winner = _play(s, start_idx, step, max_sows, trace)
+    return MoveResult(s, winner, trace)
+
+
+def play_inplace(s, start_idx, step=1, max_sows=MAX_SOWS):
+    """
+    Variante sans copie ni trace pour les simulations (playouts, batchs) :
+    modifie `s` et renvoie le gagnant (0, 1, 2 ou DRAW). Le coup doit être
+    valide (case non vide du joueur au trait) : rien n'est vérifié ici.
+    """
+    return _play(s, start_idx, step, max_sows, None)
+
+
+def _play(s, start_idx, step, max_sows, trace):
+    player = s.player
+    pits, totals, nonempty = s.pits, s.totals, s.nonempty
+    path = PATHS[player]
+    pos = PATH_POS[player][start_idx]
+    n = len(path)
+    step = 1 if step >= 0 else -1
+    opponent = 2 if player == 1 else 1
+    front = FRONT_ROW[player]
+    opp_front, opp_back = FRONT_ROW[opponent], BACK_ROW[opponent]
+
+    # les graines en main restent comptées dans le camp du joueur : pendant le semis
+    # seuls les compteurs de cases non vides bougent, les totaux ne changent qu'à la capture
+    seeds = s.take(start_idx)
+    totals[player] += seeds
+    if trace is not None:
+        trace.append((PICK, start_idx, seeds))
+    sown = 0
+    landings = 0
+    seen = None   # positions (clé, case) déjà vues le long de la chaîne de relais
+    zob = ZOBRIST
+
+    while True:
+        sown += seeds
+        while seeds:
+            pos = (pos + step) % n
+            idx = path[pos]
+            k = pits[idx]
+            if not k:
+                nonempty[ROW_OF[idx]] += 1
+            pits[idx] = k + 1
+            z = zob[idx]
+            s.key ^= z[k] ^ z[k + 1]
+            seeds -= 1
+            if trace is not None:
+                trace.append((SOW, idx))
+        last_idx = path[pos]
+
+        # fin si un camp est vide
+        if not totals[1] or not totals[2]:
+            winner = 2 if not totals[1] else 1
+            if trace is not None:
+                trace.append((END, winner))
+            return winner
+
+        # 1) CAPTURE si sur ta 1re rangée et en face > 0 (rangée 'effective')
+        r, c = divmod(last_idx, COLS)
+        if r == front:
+            opp_row = opp_front if nonempty[opp_front] else opp_back
+            opp_idx = opp_row * COLS + c
+            if pits[opp_idx] > 0:
+                seeds = s.take(opp_idx) + s.take(last_idx)
+                totals[player] += seeds
+                # une capture est irréversible : les positions d'avant ne reviendront plus
+                if seen:
+                    seen.clear()
+                if trace is not None:
+                    trace.append((CAPTURE, last_idx, opp_idx, seeds))
+                continue
+
+        # 2) RELAIS si la case n'était pas vide (>1)
+        if pits[last_idx] > 1:
+            # boucle ou budget épuisé -> coup infini
+            if sown >= max_sows:
+                if trace is not None:
+                    trace.append((END, DRAW))
+                return DRAW
+            landings += 1
+            if landings > CYCLE_CHECK_AFTER:
+                key = (s.key, pos)
+                if seen is None:
+                    seen = set()
+                elif key in seen:
+                    if trace is not None:
+                        trace.append((END, DRAW))
+                    return DRAW
+                seen.add(key)
+            seeds = s.take(last_idx)
+            totals[player] += seeds
+            if trace is not None:
+                trace.append((RELAY, last_idx, seeds))
+            continue
+
+        # 3) STOP
+        if trace is not None:
+            trace.append((STOP, last_idx))
+        s.set_player(opponent)
+        return 0
@@ -0,0 +1,525 @@
+# katro_load.py — générateur de charge pour le serveur KATRO (asyncio, sans Kivy)
+# Ouvre des milliers de clients websocket contre un serveur lancé localement
+# (ou --url) et rejoue des scénarios réalistes ; affiche la latence p50/p95/p99
+# par type de message et le CPU du serveur, pour chiffrer chaque changement.
+#
+#   python katro_load.py --clients 2000 --scenario all
+#   python katro_load.py --clients 500 --scenario moves --codec katro.bin1 --drop 0.02
+#   python katro_load.py --clients 20 --scenario moves --spectators 200
+#   python katro_load.py --url ws://hote:8765/ws --pid 1234 --scenario lobby
+#
+# Scénarios :
+#   lobby    rafale de lobby_hello (réponse + propagation des deltas), puis
+#            rafale de déconnexions (propagation des retraits)
+#   invite   invite / invite_reply entre paires de joueurs du lobby
+#   rooms    create_room / join_room par paires
+#   moves    rooms, puis parties complètes (coups légaux) avec coupures et resume ;
+#            --spectators k : k spectateurs par salle (move_spectator), pour
+#            vérifier que move / move_fanout n'en dépendent pas
+#   queue    matchmaking : queue_join (classements tirés autour de 1500), une
+#            part d'annulations ; queue_wait = attente jusqu'à match_start
+#   all      les cinq à la suite
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import deque
+
+import websockets
+
+import katro_codec as codec
+import katro_engine as engine
+
+# types mesurés côté observateurs (les autres clients ne décodent que ce qu'ils attendent)
+_PREFIXES = ('{"type": "', '{"type":"')
+
+
+def frame_type(frame) -> str:
+    """Type d'une trame sans la décoder (préfixe JSON ou étiquette binaire)."""
+    if isinstance(frame, str):
+        for p in _PREFIXES:
+            if frame.startswith(p):
+                return frame[len(p):frame.find('"', len(p))]
+        return codec.decode(frame).get("type", "")
+    return codec.TAG_TYPES.get(frame[0], "") if frame else ""
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    i = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[i]
+
+
+# ---------- mesures ----------
+class Recorder:
+    """Latences (secondes) et erreurs par type de message."""
+
+    def __init__(self):
+        self.samples: dict[str, list] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, kind, seconds):
+        self.samples.setdefault(kind, []).append(seconds)
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self, title):
+        print(f"-- {title}")
+        print(f"   {'type':<18}{'n':>8}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for kind in sorted(set(self.samples) | set(self.errors)):
+            v = sorted(self.samples.get(kind, []))
+            print(f"   {kind:<18}{len(v):>8}{self.errors.get(kind, 0):>6}"
+                  f"{1000 * percentile(v, .5):>10.2f}{1000 * percentile(v, .95):>10.2f}"
+                  f"{1000 * percentile(v, .99):>10.2f}{1000 * (v[-1] if v else float('nan')):>10.2f}")
+
+
+class ServerCPU:
+    """Temps CPU d'un processus (Linux : /proc/<pid>/stat)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def seconds(self):
+        if self.pid is None:
+            return None
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.tick   # utime + stime
+        except (OSError, IndexError, ValueError):
+            return None
+
+
+# ---------- un client ----------
+class LoadClient:
+    __slots__ = ("h", "name", "ws", "user_id", "token", "seq", "waiters", "reader", "observer")
+
+    def __init__(self, h, name, observer=False):
+        self.h = h
+        self.name = name
+        self.ws = None
+        self.user_id = None
+        self.token = None
+        self.seq = 0
+        self.waiters: dict[str, deque] = {}
+        self.reader = None
+        self.observer = observer
+
+    async def connect(self):
+        async with self.h.connecting:
+            t0 = time.perf_counter()
+            try:
+                self.ws = await websockets.connect(
+                    self.h.url, subprotocols=self.h.subprotocols, ping_interval=None,
+                    open_timeout=30, max_size=None)
+            except Exception:
+                self.h.rec.error("connect")
+                raise
+            self.h.rec.add("connect", time.perf_counter() - t0)
+        self.reader = asyncio.create_task(self._read())
+
+    def expect(self, t) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(t, deque()).append(fut)
+        return fut
+
+    async def send(self, **msg):
+        await self.ws.send(codec.encode(msg, self.ws.subprotocol or codec.JSON))
+
+    async def request(self, kind, reply, timeout=None, **msg):
+        """Envoie `msg` et attend `reply` ; enregistre la latence sous `kind`."""
+        fut = self.expect(reply)
+        t0 = time.perf_counter()
+        await self.send(**msg)
+        return await self.h.wait(kind, fut, t0, timeout)
+
+    async def _read(self):
+        try:
+            async for frame in self.ws:
+                now = time.perf_counter()
+                t = frame_type(frame)
+                q = self.waiters.get(t)
+                watch = self.observer and t == "presence_delta"
+                if not q and not watch:
+                    continue
+                msg = codec.decode(frame)
+                if watch:
+                    self.h.saw_presence(self, msg, now)
+                while q:
+                    fut = q.popleft()
+                    if not fut.done():
+                        fut.set_result((msg, now))
+                        break
+        except (websockets.ConnectionClosed, OSError):
+            pass
+        finally:
+            for q in self.waiters.values():
+                for fut in q:
+                    if not fut.done():
+                        fut.set_exception(ConnectionError("closed"))
+            self.waiters.clear()
+
+    async def close(self, abrupt=False):
+        if self.ws is None:
+            return
+        if abrupt and getattr(self.ws, "transport", None) is not None:
+            self.ws.transport.abort()   # coupure réseau : pas de trame de fermeture
+        else:
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+        if self.reader is not None:
+            try:
+                await asyncio.wait_for(self.reader, 5)
+            except (asyncio.TimeoutError, Exception):
+                pass
+        self.ws = None
+
+
+# ---------- le banc ----------
+class Harness:
+    def __init__(self, url, codec_name, observers, timeout, connect_concurrency, identify=False):
+        self.url = url
+        self.identify = identify   # identité persistante pour chaque client (parties classées)
+        self.subprotocols = [codec_name] if codec_name != codec.JSON else None
+        self.observers = observers
+        self.timeout = timeout
+        self.connecting = asyncio.Semaphore(connect_concurrency)
+        self.rec = Recorder()
+        self.sent_at: dict[str, float] = {}     # nom -> heure de son lobby_hello
+        self.gone_at: dict[str, float] = {}     # nom -> heure de sa déconnexion
+        self.seen: dict[tuple, bool] = {}       # (observateur, nom, genre) déjà mesuré
+
+    async def wait(self, kind, fut, t0, timeout=None):
+        try:
+            msg, t1 = await asyncio.wait_for(fut, timeout or self.timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            self.rec.error(kind)
+            return None
+        self.rec.add(kind, t1 - t0)
+        return msg
+
+    def saw_presence(self, client, msg, now):
+        for kind, times, label in (("added", self.sent_at, "presence_add"),
+                                   ("removed", self.gone_at, "presence_remove")):
+            for user in msg.get(kind, ()):
+                t0 = times.get(user.get("name"))
+                key = (client.name, user.get("name"), kind)
+                if t0 is not None and key not in self.seen:
+                    self.seen[key] = True
+                    self.rec.add(label, now - t0)
+
+    async def clients(self, n, prefix):
+        cs = [LoadClient(self, f"{prefix}{i}", observer=i < self.observers) for i in range(n)]
+        results = await asyncio.gather(*(c.connect() for c in cs), return_exceptions=True)
+        cs = [c for c, r in zip(cs, results) if not isinstance(r, Exception)]
+        if self.identify:
+            await asyncio.gather(*(c.request("identify", "identity", type="identify", name=c.name) for c in cs))
+        return cs
+
+    async def hello_all(self, cs, ramp):
+        async def one(i, c):
+            await asyncio.sleep(ramp * i / max(1, len(cs)))
+            self.sent_at[c.name] = time.perf_counter()
+            msg = await c.request("lobby_hello", "presence_snapshot", type="lobby_hello", name=c.name)
+            if msg:
+                c.user_id = msg.get("your_id")
+        await asyncio.gather(*(one(i, c) for i, c in enumerate(cs)))
+
+    async def settle(self, seconds=1.0):
+        await asyncio.sleep(seconds)
+
+
+# ---------- scénarios ----------
+async def scenario_lobby(h, n, ramp):
+    cs = await h.clients(n, "lob")
+    await h.hello_all(cs, ramp)
+    await h.settle(2.0)
+    # rafale de déconnexions (la moitié brutales)
+    async def bye(i, c):
+        await asyncio.sleep(ramp * i / max(1, len(cs)))
+        h.gone_at[c.name] = time.perf_counter()
+        await c.close(abrupt=i % 2 == 0)
+    observers = [c for c in cs if c.observer]
+    await asyncio.gather(*(bye(i, c) for i, c in enumerate(cs) if not c.observer))
+    await h.settle(2.0)
+    await asyncio.gather(*(c.close() for c in observers))
+
+
+async def scenario_invite(h, n, ramp, decline):
+    cs = await h.clients(n - n % 2, "inv")
+    await h.hello_all(cs, ramp)
+    await h.settle(0.5)
+    rng = random.Random(1)
+
+    async def pair(a, b):
+        if not a.user_id or not b.user_id:
+            return
+        incoming = b.expect("invite_incoming")
+        t0 = time.perf_counter()
+        await a.send(type="invite", to_id=b.user_id)
+        if not await h.wait("invite", incoming, t0):
+            return
+        if rng.random() < decline:
+            declined = a.expect("invite_declined")
+            t0 = time.perf_counter()
+            await b.send(type="invite_reply", to_id=a.user_id, accepted=False)
+            await h.wait("invite_declined", declined, t0)
+            return
+        start_a = a.expect("match_start")
+        t0 = time.perf_counter()
+        await b.send(type="invite_reply", to_id=a.user_id, accepted=True)
+        mb = await h.wait("invite_reply", b.expect("match_start"), t0)
+        await h.wait("match_start_peer", start_a, t0)
+        if mb:
+            await a.send(type="leave")
+            await b.send(type="leave")
+
+    pairs = [(cs[i], cs[i + 1]) for i in range(0, len(cs), 2)]
+    await asyncio.gather(*(pair(a, b) for a, b in pairs))
+    await asyncio.gather(*(c.close() for c in cs))
+
+
+async def open_rooms(h, n, ramp, prefix="room"):
+    cs = await h.clients(n - n % 2, prefix)
+    pairs = [(cs[i], cs[i + 1]) for i in range(0, len(cs), 2)]
+
+    async def pair(i, a, b):
+        await asyncio.sleep(ramp * i / max(1, len(pairs)))
+        created = await a.request("create_room", "room_created", type="create_room", name=a.name)
+        if not created:
+            return None
+        a.token = created.get("token")
+        start_a = a.expect("start")
+        start_b = b.expect("start")
+        t0 = time.perf_counter()
+        joined = await b.request("join_room", "room_joined", type="join_room", code=created["code"], name=b.name)
+        if not joined:
+            return None
+        b.token = joined.get("token")
+        await h.wait("start", start_a, t0)
+        await h.wait("start_joiner", start_b, t0)
+        return a, b
+
+    res = await asyncio.gather(*(pair(i, a, b) for i, (a, b) in enumerate(pairs)))
+    return cs, [p for p in res if p]
+
+
+async def scenario_rooms(h, n, ramp):
+    cs, _ = await open_rooms(h, n, ramp)
+    await asyncio.gather(*(c.send(type="leave") for c in cs if c.ws))
+    await asyncio.gather(*(c.close() for c in cs))
+
+
+async def scenario_moves(h, n, ramp, think, max_plies, drop, spectators=0):
+    cs, pairs = await open_rooms(h, n, ramp, "mov")
+    rng = random.Random(2)
+    audiences = {}
+    if spectators:
+        watchers = await h.clients(spectators * len(pairs), "spc")
+        for i, (a, b) in enumerate(pairs):
+            audiences[a] = watchers[i * spectators:(i + 1) * spectators]
+        await asyncio.gather(*(s.request("spectate", "spectating", type="spectate", code=a.token.partition(".")[0])
+                               for a, ss in audiences.items() for s in ss))
+        cs += watchers
+
+    async def resume(c):
+        """Coupure brutale puis reconnexion avec le jeton."""
+        await c.close(abrupt=True)
+        await c.connect()
+        return await c.request("resume", "resumed", type="resume", token=c.token, seq=c.seq)
+
+    async def game(a, b):
+        players = {1: a, 2: b}
+        state = engine.KatroState.initial(engine.SEEDS_PER_PIT)
+        for _ in range(max_plies):
+            await asyncio.sleep(rng.uniform(0, 2 * think))
+            if drop and rng.random() < drop:
+                c = players[rng.choice((1, 2))]
+                if not await resume(c):
+                    return
+            mover, other = players[state.player], players[3 - state.player]
+            idx, step = rng.choice(engine.legal_moves(state, "fixed"))
+            own, peer = mover.expect("move"), other.expect("move")
+            seen = [s.expect("move") for s in audiences.get(a, ())]
+            t0 = time.perf_counter()
+            await mover.send(type="move", idx=idx, step=step, player=state.player,
+                             nonce=str(time.time_ns()))
+            m = await h.wait("move", own, t0)
+            await h.wait("move_fanout", peer, t0)
+            for fut in seen:
+                await h.wait("move_spectator", fut, t0)
+            if not m:
+                return
+            a.seq = b.seq = m["seq"]
+            state = engine.resolve_move(state, idx, step).state
+            if m.get("winner"):
+                break
+        for c in (a, b):
+            if c.ws:
+                await c.send(type="leave")
+
+    await asyncio.gather(*(game(a, b) for a, b in pairs))
+    await asyncio.gather(*(c.close() for c in cs))
+
+
+async def scenario_queue(h, n, ramp, spread, cancel):
+    cs = await h.clients(n, "mmq")
+    rng = random.Random(3)
+
+    async def one(i, c):
+        await asyncio.sleep(ramp * i / max(1, len(cs)))
+        start = c.expect("match_start")
+        t0 = time.perf_counter()
+        await c.send(type="queue_join", rating=int(rng.gauss(1500, spread)), name=c.name)
+        if not await h.wait("queue_join", c.expect("queue_joined"), t0):
+            start.cancel()
+            return
+        if rng.random() < cancel:
+            start.cancel()
+            await c.request("queue_leave", "queue_left", type="queue_leave")
+            return
+        # fenêtre maximale atteinte en (MM_MAX_WINDOW - MM_WINDOW) / MM_WIDEN s, 28 s par défaut
+        if await h.wait("queue_wait", start, t0, max(h.timeout, 40)):
+            await c.send(type="leave")
+
+    await asyncio.gather(*(one(i, c) for i, c in enumerate(cs)))
+    await asyncio.gather(*(c.close() for c in cs))
+
+
+# ---------- serveur local ----------
+# serveur local de test : ni historique ni classement sur disque (sinon les
+# parties de charge finissent dans katro_*.sqlite3 à côté de server.py),
+# sauf si l'environnement ou `env` les demandent explicitement
+SERVER_ENV = {"KATRO_HISTORY": "", "KATRO_RATINGS": ""}
+
+
+def start_server(port, env):
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server:app", "--port", str(port),
+                             "--log-level", "warning"], cwd=here,
+                            env={**SERVER_ENV, **os.environ, **env}, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/").read()
+            return proc
+        except Exception:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("le serveur n'a pas démarré")
+
+
+def scrape_metrics(url):
+    """Quelques lignes de /metrics (retard de boucle, envois ratés) ; {} si indisponible."""
+    http = url.replace("ws://", "http://").replace("wss://", "https://").rsplit("/ws", 1)[0]
+    try:
+        text = urllib.request.urlopen(http + "/metrics", timeout=5).read().decode()
+    except Exception:
+        return {}
+    out = {}
+    for line in text.splitlines():
+        if line.startswith(("katro_event_loop_lag_histogram_seconds_sum",
+                            "katro_event_loop_lag_histogram_seconds_count",
+                            "katro_send_failures_total", "katro_kicks_total", "katro_bytes_out_total")):
+            k, v = line.rsplit(" ", 1)
+            out[k] = float(v)
+    return out
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+async def run(args, pid):
+    cpu = ServerCPU(pid)
+    names = ["lobby", "invite", "rooms", "moves", "queue"] if args.scenario == "all" else [args.scenario]
+    for name in names:
+        h = Harness(args.url, args.codec, args.observers, args.timeout, args.connect_concurrency,
+                    args.identify)
+        before = scrape_metrics(args.url)
+        c0, t0 = cpu.seconds(), time.perf_counter()
+        if name == "lobby":
+            await scenario_lobby(h, args.clients, args.ramp)
+        elif name == "invite":
+            await scenario_invite(h, args.clients, args.ramp, args.decline)
+        elif name == "rooms":
+            await scenario_rooms(h, args.clients, args.ramp)
+        elif name == "moves":
+            await scenario_moves(h, args.clients, args.ramp, args.think, args.max_plies, args.drop,
+                                 args.spectators)
+        else:
+            await scenario_queue(h, args.clients, args.ramp, args.spread, args.cancel)
+        wall = time.perf_counter() - t0
+        c1 = cpu.seconds()
+        after = scrape_metrics(args.url)
+        h.rec.report(f"{name}: {args.clients} clients, {wall:.1f}s")
+        if c0 is not None and c1 is not None:
+            print(f"   CPU serveur {c1 - c0:.2f}s ({100 * (c1 - c0) / wall:.0f}% d'un cœur)")
+        if before and after:
+            lag_n = after.get("katro_event_loop_lag_histogram_seconds_count", 0) - \
+                before.get("katro_event_loop_lag_histogram_seconds_count", 0)
+            lag_s = after.get("katro_event_loop_lag_histogram_seconds_sum", 0) - \
+                before.get("katro_event_loop_lag_histogram_seconds_sum", 0)
+            fails = after.get("katro_send_failures_total", 0) - before.get("katro_send_failures_total", 0)
+            out = after.get("katro_bytes_out_total", 0) - before.get("katro_bytes_out_total", 0)
+            if lag_n:
+                print(f"   retard moyen de la boucle serveur {1000 * lag_s / lag_n:.1f} ms, "
+                      f"envois ratés {fails:.0f}, {out / 1e6:.1f} Mo envoyés")
+        print()
+
+
+def _main():
+    ap = argparse.ArgumentParser(description="Charge asyncio pour le serveur KATRO.")
+    ap.add_argument("--scenario", choices=("lobby", "invite", "rooms", "moves", "queue", "all"), default="all")
+    ap.add_argument("--clients", type=int, default=1000)
+    ap.add_argument("--url", help="serveur existant (sinon un serveur est lancé localement)")
+    ap.add_argument("--pid", type=int, help="pid du serveur existant (pour son CPU)")
+    ap.add_argument("--port", type=int, default=8790, help="port du serveur local")
+    ap.add_argument("--codec", choices=(codec.JSON, codec.BIN1), default=codec.JSON)
+    ap.add_argument("--ramp", type=float, default=2.0, help="étalement des rafales (s)")
+    ap.add_argument("--observers", type=int, default=10, help="clients qui mesurent la propagation du lobby")
+    ap.add_argument("--think", type=float, default=0.2, help="réflexion moyenne entre deux coups (s)")
+    ap.add_argument("--max-plies", type=int, default=60)
+    ap.add_argument("--drop", type=float, default=0.0, help="probabilité de coupure + resume avant chaque coup")
+    ap.add_argument("--spectators", type=int, default=0, help="spectateurs par salle (moves)")
+    ap.add_argument("--decline", type=float, default=0.2, help="part des invitations refusées")
+    ap.add_argument("--spread", type=float, default=300, help="écart-type des classements (queue)")
+    ap.add_argument("--cancel", type=float, default=0.1, help="part des joueurs qui quittent la file")
+    ap.add_argument("--identify", action="store_true",
+                    help="chaque client s'identifie (parties classées, classement serveur en file)")
+    ap.add_argument("--timeout", type=float, default=15.0)
+    ap.add_argument("--connect-concurrency", type=int, default=200)
+    args = ap.parse_args()
+
+    limit = raise_fd_limit()
+    if args.clients * (2 + args.spectators) + 64 > limit:
+        print(f"attention : limite de fichiers ouverts {limit} pour {args.clients} clients")
+    proc = None
+    pid = args.pid
+    if not args.url:
+        proc = start_server(args.port, {})
+        pid = proc.pid
+        args.url = f"ws://127.0.0.1:{args.port}/ws"
+    try:
+        asyncio.run(run(args, pid))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    _main()
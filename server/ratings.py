@@ -0,0 +1,362 @@
+# ratings.py — identités persistantes et classement Glicko du serveur KATRO
+#
+# Identité : un id public et un secret remis une seule fois au client, qui les
+# garde et les renvoie à chaque connexion ("identify") ; le serveur n'en garde
+# que l'empreinte (sha256).
+#
+# Classement Glicko (Glickman, 1999) : un classement r et un écart-type RD.
+# Une partie classée met à jour les deux joueurs à partir de leurs valeurs
+# d'avant la partie ; RD remonte avec l'inactivité (RD_PER_DAY par jour) et
+# décroît à chaque partie, jusqu'à RD_MIN.
+#
+# RatingBook tient tout en mémoire :
+#   players   id -> Player
+#   ladder    Ladder : (-r, id) triés des joueurs ayant au moins une partie ;
+#             rang d'un joueur et pages du classement en O(log N), sans disque
+# Les joueurs modifiés sont écrits par lots (history.BatchWriter) ; au
+# démarrage, toute la table est relue une fois.
+
+import hashlib
+import hmac
+import math
+import secrets
+import sqlite3
+import time
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Optional
+
+from history import BatchWriter
+
+DEFAULT_RATING = 1500.0
+DEFAULT_RD = 350.0
+RD_MIN = 30.0
+RD_PER_DAY = 35.0          # remontée de RD par jour sans partie
+
+_Q = math.log(10) / 400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id      TEXT PRIMARY KEY,
+    secret  TEXT NOT NULL,        -- sha256 du secret remis au client
+    name    TEXT NOT NULL,
+    rating  REAL NOT NULL,
+    rd      REAL NOT NULL,
+    games   INTEGER NOT NULL,
+    wins    INTEGER NOT NULL,
+    losses  INTEGER NOT NULL,
+    draws   INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+FIELDS = ("id", "secret", "name", "rating", "rd", "games", "wins", "losses", "draws", "updated")
+
+
+# ---------- Glicko ----------
+def _g(rd: float) -> float:
+    return 1 / math.sqrt(1 + 3 * (_Q * rd / math.pi) ** 2)
+
+
+def expected(r: float, r_opp: float, rd_opp: float) -> float:
+    """Score attendu de r contre (r_opp, rd_opp)."""
+    return 1 / (1 + 10 ** (-_g(rd_opp) * (r - r_opp) / 400))
+
+
+def glicko_update(r: float, rd: float, r_opp: float, rd_opp: float, score: float) -> tuple[float, float]:
+    """Nouveaux (r, RD) après une partie de score 1 / 0.5 / 0 contre (r_opp, rd_opp)."""
+    g = _g(rd_opp)
+    e = expected(r, r_opp, rd_opp)
+    d2 = 1 / (_Q * _Q * g * g * e * (1 - e))
+    denom = 1 / (rd * rd) + 1 / d2
+    return r + _Q / denom * g * (score - e), max(RD_MIN, math.sqrt(1 / denom))
+
+
+def aged_rd(rd: float, idle_seconds: float) -> float:
+    return min(DEFAULT_RD, math.sqrt(rd * rd + RD_PER_DAY ** 2 * max(0.0, idle_seconds) / 86400))
+
+
+def hash_secret(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+# ---------- joueurs ----------
+class Player:
+    __slots__ = FIELDS
+
+    def __init__(self, id: str, secret: str, name: str, rating: float = DEFAULT_RATING,
+                 rd: float = DEFAULT_RD, games: int = 0, wins: int = 0, losses: int = 0,
+                 draws: int = 0, updated: float = 0.0):
+        self.id = id
+        self.secret = secret
+        self.name = name
+        self.rating = rating
+        self.rd = rd
+        self.games = games
+        self.wins = wins
+        self.losses = losses
+        self.draws = draws
+        self.updated = updated
+
+    def row(self) -> tuple:
+        return tuple(getattr(self, f) for f in FIELDS)
+
+    def state(self) -> dict:
+        """Tout le joueur (empreinte comprise) : persistance et relais entre workers."""
+        return dict(zip(FIELDS, self.row()))
+
+    def public(self) -> dict:
+        return {"id": self.id, "name": self.name, "rating": round(self.rating), "rd": round(self.rd),
+                "games": self.games, "wins": self.wins, "losses": self.losses, "draws": self.draws}
+
+
+class RatingStore(BatchWriter):
+    SCHEMA = SCHEMA
+
+    def _write_rows(self, db: sqlite3.Connection, rows: list[tuple]):
+        with db:
+            db.executemany(
+                f"INSERT OR REPLACE INTO players ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                rows,
+            )
+
+    async def load_all(self) -> list[tuple]:
+        return await self.run(lambda db: db.execute(f"SELECT {', '.join(FIELDS)} FROM players").fetchall())
+
+
+def make_rating_store(path: str) -> Optional[RatingStore]:
+    """"" -> None (classements en mémoire seulement) ; sinon chemin du fichier SQLite."""
+    return RatingStore(path) if path else None
+
+
+# ---------- classement ----------
+class Ladder:
+    """
+    Liste triée en seaux (au plus 2 * LOAD éléments chacun) : insérer ou retirer
+    ne déplace qu'un seau, pas tout le classement. `maxes` (dernier élément de
+    chaque seau) trouve le seau par bisection ; un arbre de Fenwick sur la
+    taille des seaux donne la position d'un élément et le seau d'un rang en
+    O(log N). L'arbre n'est reconstruit qu'à la création ou à la disparition
+    d'un seau.
+    """
+    __slots__ = ("buckets", "maxes", "tree", "size")
+    LOAD = 500
+
+    def __init__(self, items=()):
+        items = sorted(items)
+        n = self.LOAD
+        self.buckets = [items[i:i + n] for i in range(0, len(items), n)]
+        self.maxes = [b[-1] for b in self.buckets]
+        self.size = len(items)
+        self._rebuild()
+
+    def _rebuild(self):
+        tree = [0] * (len(self.buckets) + 1)
+        for i, b in enumerate(self.buckets, 1):
+            tree[i] += len(b)
+            j = i + (i & -i)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self.tree = tree
+
+    def _grow(self, k: int, delta: int):
+        tree = self.tree
+        k += 1
+        while k < len(tree):
+            tree[k] += delta
+            k += k & -k
+
+    def _before(self, k: int) -> int:
+        """Nombre d'éléments dans les seaux 0..k-1."""
+        tree, total = self.tree, 0
+        while k:
+            total += tree[k]
+            k -= k & -k
+        return total
+
+    def _locate(self, pos: int) -> tuple[int, int]:
+        """(seau, position dans le seau) du pos-ième élément (0 <= pos < size)."""
+        tree, k = self.tree, 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            j = k + step
+            if j < len(tree) and tree[j] <= pos:
+                pos -= tree[j]
+                k = j
+            step >>= 1
+        return k, pos
+
+    def add(self, item):
+        buckets, maxes = self.buckets, self.maxes
+        self.size += 1
+        if not buckets:
+            buckets.append([item])
+            maxes.append(item)
+            self._rebuild()
+            return
+        k = bisect_left(maxes, item)
+        if k == len(maxes):
+            k -= 1
+            buckets[k].append(item)
+            maxes[k] = item
+        else:
+            insort(buckets[k], item)
+        b = buckets[k]
+        if len(b) > 2 * self.LOAD:
+            buckets[k:k + 1] = [b[:self.LOAD], b[self.LOAD:]]
+            maxes[k:k + 1] = [b[self.LOAD - 1], b[-1]]
+            self._rebuild()
+        else:
+            self._grow(k, 1)
+
+    def discard(self, item) -> bool:
+        maxes = self.maxes
+        k = bisect_left(maxes, item)
+        if k == len(maxes):
+            return False
+        b = self.buckets[k]
+        i = bisect_left(b, item)
+        if b[i] != item:
+            return False
+        del b[i]
+        self.size -= 1
+        if b:
+            maxes[k] = b[-1]
+            self._grow(k, -1)
+        else:
+            del self.buckets[k], maxes[k]
+            self._rebuild()
+        return True
+
+    def index(self, item) -> int:
+        """Nombre d'éléments strictement inférieurs à `item`."""
+        k = bisect_left(self.maxes, item)
+        if k == len(self.maxes):
+            return self.size
+        return self._before(k) + bisect_left(self.buckets[k], item)
+
+    def slice(self, offset: int, limit: int) -> list:
+        if offset >= self.size or limit <= 0:
+            return []
+        k, i = self._locate(offset)
+        out = []
+        for b in islice(self.buckets, k, None):
+            out.extend(b[i:i + limit - len(out)])
+            if len(out) >= limit:
+                break
+            i = 0
+        return out
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for b in self.buckets:
+            yield from b
+
+
+class RatingBook:
+    __slots__ = ("store", "players", "ladder")
+
+    def __init__(self, store: Optional[RatingStore] = None):
+        self.store = store
+        self.players: dict[str, Player] = {}
+        self.ladder = Ladder()   # (-r, id), joueurs classés
+
+    async def start(self):
+        if self.store is None:
+            return
+        await self.store.start()
+        for row in await self.store.load_all():
+            p = Player(*row)
+            self.players[p.id] = p
+        self.ladder = Ladder((-p.rating, p.id) for p in self.players.values() if p.games)
+
+    async def close(self):
+        if self.store is not None:
+            await self.store.close()
+
+    def _save(self, p: Player):
+        if self.store is not None:
+            row = p.row()   # instantané : d'autres parties peuvent suivre avant le lot
+            self.store.put(p.id, lambda: row)
+
+    # -- identités --
+    def create(self, name: str) -> tuple[Player, str]:
+        """Nouveau joueur ; renvoie aussi le secret en clair (il n'est gardé nulle part)."""
+        pid = secrets.token_hex(8)
+        while pid in self.players:
+            pid = secrets.token_hex(8)
+        secret = secrets.token_urlsafe(18)
+        p = Player(pid, hash_secret(secret), name, updated=time.time())
+        self.players[pid] = p
+        self._save(p)
+        return p, secret
+
+    def check(self, pid: str, secret: str) -> Optional[Player]:
+        p = self.players.get(pid)
+        if p is None or not hmac.compare_digest(p.secret, hash_secret(secret)):
+            return None
+        return p
+
+    def rename(self, p: Player, name: str):
+        p.name = name
+        self._save(p)
+
+    def get(self, pid: Optional[str]) -> Optional[Player]:
+        return self.players.get(pid) if pid else None
+
+    # -- parties --
+    def record(self, a: str, b: str, score_a: float) -> Optional[tuple[Player, Player]]:
+        """Partie classée entre a et b (score de a : 1, 0.5 ou 0) ; None si un joueur est inconnu."""
+        pa, pb = self.players.get(a), self.players.get(b)
+        if pa is None or pb is None or pa is pb:
+            return None
+        now = time.time()
+        rd_a, rd_b = aged_rd(pa.rd, now - pa.updated), aged_rd(pb.rd, now - pb.updated)
+        new_a = glicko_update(pa.rating, rd_a, pb.rating, rd_b, score_a)
+        new_b = glicko_update(pb.rating, rd_b, pa.rating, rd_a, 1 - score_a)
+        for p, (r, rd), score in ((pa, new_a, score_a), (pb, new_b, 1 - score_a)):
+            self._unrank(p)
+            p.rating, p.rd, p.updated = r, rd, now
+            p.games += 1
+            if score == 1:
+                p.wins += 1
+            elif score == 0:
+                p.losses += 1
+            else:
+                p.draws += 1
+            self.ladder.add((-p.rating, p.id))
+            self._save(p)
+        return pa, pb
+
+    def apply(self, state: dict):
+        """Joueur modifié par un autre worker (déjà écrit par lui)."""
+        p = self.players.get(state["id"])
+        if p is None:
+            p = self.players[state["id"]] = Player(**state)
+        else:
+            self._unrank(p)
+            for f in FIELDS:
+                setattr(p, f, state[f])
+        if p.games:
+            self.ladder.add((-p.rating, p.id))
+
+    def _unrank(self, p: Player):
+        if p.games:
+            self.ladder.discard((-p.rating, p.id))
+
+    # -- classement --
+    def rank(self, pid: str) -> Optional[int]:
+        """Rang (1 = premier) d'un joueur classé."""
+        p = self.players.get(pid)
+        if p is None or not p.games:
+            return None
+        return self.ladder.index((-p.rating, p.id)) + 1
+
+    def page(self, offset: int, limit: int) -> list[dict]:
+        return [{"rank": offset + i + 1, **self.players[pid].public()}
+                for i, (_, pid) in enumerate(self.ladder.slice(offset, limit))]
+
+    def __len__(self):
+        return len(self.ladder)
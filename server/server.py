@@ -2,39 +2,522 @@ import asyncio
 import json
 import secrets
 import os
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
 from typing import Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import PlainTextResponse
 import uvicorn
 
+import katro_engine as engine
+import katro_codec as codec
+from backplane import make_backplane
+from history import make_store
+from ratings import RatingBook, make_rating_store
+
 app = FastAPI()
 
-# ========= Parties classiques (rooms de jeu 1v1) ========= #
+# ========= Envoi : file sortante par connexion ========= #
+#
+# Chaque connexion a une file bornée vidée par sa propre tâche d'écriture :
+# un broadcast ne fait que déposer la même trame déjà encodée dans chaque file,
+# sans attendre le réseau. Quand la file d'un client lent est pleine :
+#   "resync"     : on jette ses deltas de présence en attente et on lui renverra
+#                  un snapshot complet dès qu'il aura rattrapé son retard ;
+#   "disconnect" : on le déconnecte.
+# Seule la présence (snapshots et deltas) est jetable ; les messages de partie
+# ne sont jamais jetés : si la file reste pleine malgré
+# tout, le client est déconnecté dans les deux cas.
+OUTBOX_LIMIT = int(os.getenv("KATRO_OUTBOX_LIMIT", "256"))
+SLOW_CONSUMER = os.getenv("KATRO_SLOW_CONSUMER", "resync")   # "resync" | "disconnect"
+
+# Reprise de session : après une coupure réseau, la place d'un joueur reste
+# réservée RESUME_GRACE secondes ; le client revient avec son jeton ("resume").
+RESUME_GRACE = float(os.getenv("KATRO_RESUME_GRACE", "30"))
+
+# Plusieurs workers / machines : ils partagent le lobby et se relaient les
+# messages de partie par un backplane pub/sub (voir backplane.py).
+#   KATRO_BACKPLANE=""                      un seul processus (par défaut)
+#   KATRO_BACKPLANE="redis://hote:6379"     Redis ou `python backplane.py`
+# Chaque salle appartient au worker qui l'a créée (clé "room:<code>") ; les
+# joueurs connectés ailleurs y sont représentés par une RemoteSession.
+# Clés partagées prolongées tant que le worker tourne ("worker:<id>", salles) :
+# s'il plante, elles expirent après BACKPLANE_TTL s, ses codes se libèrent et
+# les autres workers retirent ses joueurs du lobby.
+WORKER_ID = secrets.token_hex(4)
+BACKPLANE_TTL = float(os.getenv("KATRO_BACKPLANE_TTL", "30"))
+backplane = make_backplane(os.getenv("KATRO_BACKPLANE", ""), BACKPLANE_TTL)
+
+# Historique des parties (début, coups, fin) : fichier SQLite écrit par lots
+# dans un thread à part, jamais dans la boucle (voir history.py).
+#   KATRO_HISTORY="katro_history.sqlite3"   (par défaut) ; "" pour désactiver
+history = make_store(os.getenv("KATRO_HISTORY", "katro_history.sqlite3"))
+
+# Identités persistantes et classement Glicko (voir ratings.py) : tenus en
+# mémoire, écrits par lots ; les autres workers reçoivent les changements par
+# le canal "ratings" du backplane.
+#   KATRO_RATINGS="katro_ratings.sqlite3"   (par défaut) ; "" : mémoire seulement
+ratings = RatingBook(make_rating_store(os.getenv("KATRO_RATINGS", "katro_ratings.sqlite3")))
+# nouvelles identités ("identify" sans player_id) permises par connexion :
+# chacune reste en mémoire et sur disque pour toujours
+IDENTITIES_PER_CONNECTION = int(os.getenv("KATRO_IDENTITIES_PER_CONNECTION", "3"))
+
+# ========= Métriques (voir /metrics et /stats) ========= #
+#
+# Compteurs en mémoire, mis à jour sur place : aucun coût au-delà d'une
+# addition par message, rien à installer.
+
+class Histogram:
+    """Histogramme à seaux fixes (bornes hautes croissantes + un seau "au-delà")."""
+    __slots__ = ("bounds", "count", "total", "buckets")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(bounds) + 1)
+
+    def record(self, value: float):
+        self.count += 1
+        self.total += value
+        self.buckets[bisect_left(self.bounds, value)] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Borne haute du seau qui contient le quantile q (estimation)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# destinataires d'un broadcast ; retard de la boucle asyncio (secondes)
+FANOUT_BUCKETS = (1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+class Metrics:
+    __slots__ = ("msgs_out", "bytes_in", "bytes_out", "send_failures", "kicks", "bad_messages",
+                 "fanout", "loop_lag", "loop_lag_last", "lag_task")
+
+    def __init__(self):
+        self.msgs_out: dict[str, int] = {}   # type -> trames envoyées
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.send_failures = 0
+        self.kicks: dict[str, int] = {}      # raison -> déconnexions forcées
+        self.bad_messages = 0                # trames illisibles ou handler en erreur
+        self.fanout = {"room": Histogram(FANOUT_BUCKETS), "lobby": Histogram(FANOUT_BUCKETS),
+                       "spectators": Histogram(FANOUT_BUCKETS)}
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self.loop_lag_last = 0.0
+        self.lag_task: Optional[asyncio.Task] = None
+
+    def sent(self, frame):
+        """Une trame partie sur le réseau : type (lu en tête de trame) et taille."""
+        if isinstance(frame, str):
+            t = "other"
+            if frame.startswith('{"type": "'):
+                t = frame[10:frame.find('"', 10)]
+            elif frame.startswith('{"type":"'):
+                t = frame[9:frame.find('"', 9)]
+            size = len(frame) if frame.isascii() else len(frame.encode())
+        else:
+            t = codec.TAG_TYPES.get(frame[0], "other") if frame else "other"
+            size = len(frame)
+        self.msgs_out[t] = self.msgs_out.get(t, 0) + 1
+        self.bytes_out += size
+
+
+metrics = Metrics()
+
+
+async def watch_loop_lag(interval: float = 0.5):
+    """Retard de la boucle : temps dormi au-delà de `interval` (handlers trop longs)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - t0 - interval)
+        metrics.loop_lag_last = lag
+        metrics.loop_lag.record(lag)
+
+
+# ========= Registre des connexions ========= #
+#
+# Un seul registre remplace les anciens dicts parallèles (rooms, ws_to_room_code,
+# lobby_users, ws_to_user_id). Index O(1) dans les deux sens :
+#   ws -> Session, user_id -> Session (lobby), code -> Room,
+#   Session.room -> Room et Room.a / Room.b -> Session.
+
+class Session:
+    """Une connexion websocket (joueur du lobby et/ou d'une salle)."""
+    __slots__ = ("ws", "sid", "codec", "user_id", "player", "name", "status", "avatar", "room", "role",
+                 "watching", "outbox", "wake", "writer", "reader", "stale", "closing", "lobby_view",
+                 "identities")
+
+    def __init__(self, ws: WebSocket, codec_name: str = codec.JSON):
+        self.ws = ws
+        self.sid = secrets.token_hex(6)      # adresse de la session pour les autres workers
+        self.codec = codec_name              # négocié à la connexion (katro_codec)
+        self.user_id: Optional[str] = None   # défini quand la session est dans le lobby
+        self.player: Optional[str] = None    # identité persistante ("identify")
+        self.name: str = "Joueur"
+        self.status: str = "dispo"
+        self.avatar: str = "avatar_01"
+        self.room: Optional["Room | RemoteRoom"] = None
+        self.role: Optional[str] = None      # "a" ou "b" dans self.room
+        self.watching: Optional[tuple[str, str]] = None   # (code, propriétaire) de la salle regardée
+        # file sortante : (trame, jetable) ; jetable = delta de présence
+        self.outbox: deque = deque()
+        self.wake = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.reader: Optional[asyncio.Task] = None   # tâche de ws_endpoint
+        self.stale = False      # deltas jetés : un snapshot est dû
+        self.closing = False    # client lent déconnecté
+        self.lobby_view = (None, "", PAGE_SIZE)   # filtre du snapshot : (statut, préfixe, taille de page)
+        self.identities = 0     # identités créées par cette connexion
+
+    def push(self, frame, droppable: bool = False):
+        """Dépose une trame encodée (str JSON ou bytes) dans la file, sans attendre (voir plus haut)."""
+        if self.closing:
+            return
+        q = self.outbox
+        if droppable and self.stale:
+            return   # le snapshot à venir couvrira ce delta
+        if len(q) >= OUTBOX_LIMIT:
+            if SLOW_CONSUMER == "resync":
+                kept = [item for item in q if not item[1]]
+                if len(kept) < len(q):
+                    q.clear()
+                    q.extend(kept)
+                    self.stale = True
+                if droppable:
+                    self.stale = True
+                    self.wake.set()
+                    return
+            if len(q) >= OUTBOX_LIMIT:
+                self.kick()
+                return
+        q.append((frame, droppable))
+        self.wake.set()
+
+    def kick(self, why: str = "slow consumer"):
+        """Client trop lent (ou remplacé) : on vide sa file et la tâche d'écriture ferme la connexion."""
+        print(f"[SERVER] {why} {self.user_id or '-'}: disconnect")
+        metrics.kicks[why] = metrics.kicks.get(why, 0) + 1
+        self.closing = True
+        self.outbox.clear()
+        self.wake.set()
+
+    def attach(self, room, role: str):
+        self.room = room
+        self.role = role
+        matchmaker.leave(self)   # assis ailleurs (invitation, code) : plus en file
+        stop_spectating(self)    # ni spectateur
+
+    def detach(self):
+        self.room = None
+        self.role = None
+
+    def public(self) -> dict:
+        """Fiche lobby envoyée aux autres joueurs."""
+        return {"id": self.user_id, "name": self.name, "status": self.status, "avatar": self.avatar}
+
+
+class RemoteSession:
+    """
+    Joueur connecté à un autre worker, assis dans une salle de ce worker-ci.
+    Même interface que Session pour Room / Registry / send : chaque trame est
+    relayée au worker du joueur, qui la dépose dans sa file. Il est désigné par
+    son sid, ou par son user_id tant que le sid n'est pas connu (invitation).
+    """
+    __slots__ = ("worker", "sid", "user_id", "player", "name", "room", "role")
+    codec = codec.JSON   # relayé en JSON, réencodé par le worker du joueur
+
+    def __init__(self, worker: str, sid: Optional[str], user_id: Optional[str], name: str = "Joueur",
+                 player: Optional[str] = None):
+        self.worker = worker
+        self.sid = sid
+        self.user_id = user_id
+        self.player = player
+        self.name = name
+        self.room: Optional[Room] = None
+        self.role: Optional[str] = None
+
+    def _to(self, op: str, **data):
+        backplane.publish(f"w:{self.worker}", {"op": op, "sid": self.sid, "uid": self.user_id, **data})
+
+    def push(self, frame, droppable: bool = False):
+        self._to("push", frame=frame)
+
+    def kick(self, why: str = "replaced"):
+        self._to("kick", why=why)
+
+    def attach(self, room, role: str):
+        self.room = room
+        self.role = role
+        self._to("attach", code=room.code, role=role, owner=WORKER_ID)
+
+    def detach(self):
+        if self.room is not None:
+            self._to("detach", code=self.room.code)
+        self.room = None
+        self.role = None
+
+    def matches(self, op: dict) -> bool:
+        """L'opération relayée vient-elle de ce joueur ?"""
+        if op.get("worker") != self.worker:
+            return False
+        if self.sid is not None:
+            return op.get("sid") == self.sid
+        return op.get("uid") is not None and op.get("uid") == self.user_id
+
+
+class RemoteRoom:
+    """Salle tenue par un autre worker : les messages de partie lui sont relayés."""
+    __slots__ = ("code", "owner")
 
-# code -> {
-#   "a": ws ou None,
-#   "b": ws ou None,
-#   "names": {"a": str|None, "b": str|None}
-# }
-rooms: dict[str, dict] = {}
+    def __init__(self, code: str, owner: str):
+        self.code = code
+        self.owner = owner
 
-# NOUVEAU : mapping websocket -> code de salle
-ws_to_room_code: dict[WebSocket, str] = {}
 
-# ========= Lobby (joueurs en ligne) ========= #
+# rôle dans la salle -> joueur sur le plateau
+ROLE_PLAYER = {"a": 1, "b": 2}
 
-# Joueurs connectés au lobby.
-#   lobby_users[user_id] = {
-#       "id": user_id,
-#       "name": str,
-#       "status": str,
-#       "avatar": str,   # ex: "avatar_01"
-#   }
-lobby_users: dict[str, dict] = {}
 
-# Mapping websocket -> user_id
-ws_to_user_id: dict[WebSocket, str] = {}
+class Room:
+    """
+    Salle de jeu 1v1 : deux places `a` et `b` (Session ou None) et la partie
+    en cours, tenue par le serveur (plateau, coups joués, gagnant). Les
+    spectateurs ne sont pas assis : voir Registry.audiences et `watchers`.
+    """
+    __slots__ = ("code", "a", "b", "names", "player_ids", "seeds", "direction", "game_id", "started",
+                 "rated", "state", "seq", "moves", "winner", "tokens", "away", "watchers")
+
+    def __init__(self, code: str, seeds: int = engine.SEEDS_PER_PIT, direction: str = "fixed"):
+        self.code = code
+        self.a: Optional[Session] = None
+        self.b: Optional[Session] = None
+        self.names = {"a": None, "b": None}
+        self.player_ids = {"a": None, "b": None}   # identités persistantes des places
+        self.seeds = seeds
+        self.direction = direction
+        self.game_id: Optional[str] = None   # identifiant de la partie dans l'historique
+        self.started = 0.0
+        self.rated = False      # classements déjà mis à jour pour cette partie
+        self.state: Optional[engine.KatroState] = None   # None tant que la partie n'a pas commencé
+        self.seq = 0            # nb de coups joués
+        self.moves: list[tuple[int, int]] = []   # (idx, step) dans l'ordre
+        self.winner = 0
+        self.tokens = {"a": None, "b": None}     # jetons de reprise par place
+        self.away: dict[str, asyncio.TimerHandle] = {}   # place réservée -> expiration
+        self.watchers: dict[str, int] = {}   # autre worker -> nb de ses spectateurs
+
+    def start_game(self):
+        self.game_id = secrets.token_hex(8)
+        self.started = time.time()
+        self.rated = False
+        self.state = engine.KatroState.initial(self.seeds)
+        self.seq = 0
+        self.moves = []
+        self.winner = 0
+
+    def game_info(self) -> dict:
+        """Règles et état courant, joints à start / match_start / move."""
+        return {
+            "seeds": self.seeds,
+            "direction": self.direction,
+            "seq": self.seq,
+            "hash": state_hash(self.state),
+            "next": self.state.player if self.state else 1,
+            "winner": self.winner,
+        }
+
+    def players(self):
+        return [s for s in (self.a, self.b) if s is not None]
+
+    def other(self, sess: Session) -> Optional[Session]:
+        return self.b if self.a is sess else self.a
+
+    def is_full(self) -> bool:
+        return self.a is not None and self.b is not None
+
+    def is_empty(self) -> bool:
+        return self.a is None and self.b is None
+
+    def is_abandoned(self) -> bool:
+        """Plus personne assis ni attendu."""
+        return self.is_empty() and not self.away
+
+
+class Registry:
+    __slots__ = ("sessions", "by_sid", "by_user", "rooms", "by_token", "audiences")
+
+    def __init__(self):
+        self.sessions: dict[WebSocket, Session] = {}
+        self.by_sid: dict[str, Session] = {}
+        self.by_user: dict[str, Session] = {}   # membres du lobby
+        self.rooms: dict[str, Room] = {}
+        self.by_token: dict[str, tuple[Room, str]] = {}   # jeton de reprise -> (salle, place)
+        # spectateurs connectés ici, par code de salle (qu'elle soit ici ou ailleurs)
+        self.audiences: dict[str, dict[str, Session]] = {}
+
+    # -- connexions --
+    def connect(self, ws: WebSocket, codec_name: str = codec.JSON) -> Session:
+        sess = Session(ws, codec_name)
+        self.sessions[ws] = sess
+        self.by_sid[sess.sid] = sess
+        return sess
+
+    def disconnect(self, sess: Session):
+        self.sessions.pop(sess.ws, None)
+        self.by_sid.pop(sess.sid, None)
+
+    # -- lobby --
+    def join_lobby(self, sess: Session, name: str, avatar: str) -> bool:
+        """Inscrit (ou met à jour) la session dans le lobby ; True si nouvelle."""
+        is_new = sess.user_id is None
+        if is_new:
+            user_id = secrets.token_hex(4)
+            while user_id in self.by_user:
+                user_id = secrets.token_hex(4)
+            sess.user_id = user_id
+            self.by_user[user_id] = sess
+        sess.name = name
+        sess.avatar = avatar
+        sess.status = "dispo"  # tu pourras gérer AFK, occupé, etc. plus tard
+        return is_new
+
+    def leave_lobby(self, sess: Session) -> Optional[dict]:
+        """Retire la session du lobby ; renvoie sa fiche si elle y était."""
+        if sess.user_id is None:
+            return None
+        user = sess.public()
+        self.by_user.pop(sess.user_id, None)
+        sess.user_id = None
+        return user
+
+    def session_of_user(self, user_id: str) -> Optional[Session]:
+        return self.by_user.get(user_id)
+
+    def lobby_members(self):
+        return self.by_user.values()
+
+    # -- salles --
+    async def new_room(self, seeds: int = engine.SEEDS_PER_PIT, direction: str = "fixed") -> Room:
+        """Nouvelle salle, avec un code réservé auprès des autres workers."""
+        code = new_code()
+        while code in self.rooms or not await backplane.claim(f"room:{code}", WORKER_ID):
+            code = new_code()
+        room = Room(code, seeds, direction)
+        self.rooms[code] = room
+        return room
+
+    def seat(self, room: Room, spot: str, sess: Session, name: Optional[str]) -> str:
+        """Assoit la session et lui remet un nouveau jeton de reprise."""
+        setattr(room, spot, sess)
+        room.names[spot] = name
+        room.player_ids[spot] = sess.player
+        sess.attach(room, spot)
+        self.revoke(room, spot)
+        # le code en tête du jeton permet de retrouver la salle depuis n'importe quel worker
+        token = f"{room.code}.{secrets.token_urlsafe(16)}"
+        room.tokens[spot] = token
+        self.by_token[token] = (room, spot)
+        return token
+
+    def revoke(self, room: Room, spot: str):
+        token = room.tokens.get(spot)
+        if token:
+            self.by_token.pop(token, None)
+            room.tokens[spot] = None
+        handle = room.away.pop(spot, None)
+        if handle is not None:
+            handle.cancel()
+
+    def hold_seat(self, sess: Session, on_expire) -> Optional[Room]:
+        """Coupure réseau : libère la place mais la garde réservée (jeton valide)."""
+        room, spot = sess.room, sess.role
+        if room is None:
+            return None
+        setattr(room, spot, None)
+        sess.detach()
+        room.away[spot] = asyncio.get_running_loop().call_later(RESUME_GRACE, on_expire, room, spot)
+        return room
+
+    def resume(self, token: str, sess: Session) -> Optional[tuple[Room, str, Optional[Session]]]:
+        """
+        Rend sa place à une session qui revient avec son jeton. Renvoie
+        (salle, place, ancienne session encore assise ou None), ou None si le
+        jeton est inconnu / expiré.
+        """
+        found = self.by_token.get(token)
+        if found is None:
+            return None
+        room, spot = found
+        handle = room.away.pop(spot, None)
+        if handle is not None:
+            handle.cancel()
+        # l'ancienne connexion n'a peut-être pas encore vu la coupure : elle est remplacée
+        old = getattr(room, spot)
+        if old is not None and old is not sess:
+            old.detach()
+        setattr(room, spot, sess)
+        sess.attach(room, spot)
+        return room, spot, old
+
+    def unseat(self, sess: Session) -> Optional[Room]:
+        """Libère la place de la session ; renvoie la salle qu'elle occupait."""
+        room = sess.room
+        if room is None:
+            return None
+        if room.a is sess:
+            room.a = None
+        if room.b is sess:
+            room.b = None
+        self.revoke(room, sess.role)
+        sess.detach()
+        return room
+
+    def close_room(self, room: Room):
+        if self.rooms.pop(room.code, None) is room:
+            backplane.delete(f"room:{room.code}")
+            record_game(room, ended=True)
+            end_audience(room)
+        for s in room.players():
+            s.detach()
+        room.a = room.b = None
+        for spot in ("a", "b"):
+            self.revoke(room, spot)
+
+    # -- spectateurs --
+    def watch(self, sess: Session, code: str, owner: str):
+        self.audiences.setdefault(code, {})[sess.sid] = sess
+        sess.watching = (code, owner)
+
+    def unwatch(self, sess: Session) -> Optional[tuple[str, str]]:
+        """Retire le spectateur ; renvoie (code, propriétaire) de la salle qu'il regardait."""
+        watching = sess.watching
+        if watching is None:
+            return None
+        audience = self.audiences.get(watching[0])
+        if audience is not None:
+            audience.pop(sess.sid, None)
+            if not audience:
+                del self.audiences[watching[0]]
+        sess.watching = None
+        return watching
+
+
+registry = Registry()
 
 
 @app.get("/")
@@ -47,364 +530,1672 @@ def new_code() -> str:
     return secrets.token_hex(2).upper()
 
 
-async def send(ws: WebSocket, type_, **data):
+def state_hash(state: Optional[engine.KatroState]) -> Optional[str]:
+    """Clé de Zobrist du plateau en hexadécimal (les clients la recalculent)."""
+    return None if state is None else f"{state.key:016x}"
+
+
+def text(value, default: str = "", limit: int = 20) -> str:
+    """Champ texte d'un message client : vide -> default, sinon converti en str et tronqué."""
+    return str(value)[:limit] if value else default
+
+
+def game_options(msg: dict) -> tuple[int, str]:
+    """Graines par case et sens demandés par le créateur (sinon les valeurs par défaut)."""
+    seeds = msg.get("seeds")
+    seeds = seeds if seeds in (2, 3) else engine.SEEDS_PER_PIT
+    direction = msg.get("direction")
+    direction = direction if direction in ("fixed", "free") else "fixed"
+    return seeds, direction
+
+
+def play_move(room: Room, sess: Session, msg: dict) -> Optional[str]:
+    """
+    Joue un coup reçu sur le plateau de la salle (règles de katro_engine) et le
+    diffuse aux deux joueurs, puis aux spectateurs, avec seq, hash et joueur
+    suivant ; renvoie la raison du refus s'il n'est pas jouable (rien n'est
+    alors diffusé).
+    """
+    if room.state is None:
+        return "not_started"
+    if room.winner:
+        return "game_over"
+    player = ROLE_PLAYER.get(sess.role)
+    if player != room.state.player:
+        return "not_your_turn"
+    try:
+        idx = int(msg.get("idx"))
+        step = int(msg.get("step", 1))
+    except (TypeError, ValueError, OverflowError):
+        return "bad_move"
+    if step not in (1, -1) or (step == -1 and room.direction != "free"):
+        return "bad_direction"
+    try:
+        result = engine.resolve_move(room.state, idx, step)
+    except ValueError:
+        return "illegal_move"
+
+    room.state = result.state
+    room.winner = result.winner
+    room.seq += 1
+    room.moves.append((idx, step))
+    record_game(room)
+    broadcast(room, {
+        "type": "move",
+        "idx": idx,
+        "step": step,
+        "player": player,
+        "nonce": msg.get("nonce"),
+        "seq": room.seq,
+        "hash": state_hash(room.state),
+        "next": room.state.player,
+        "winner": room.winner,
+    }, spectators=True)
+    rate_game(room)
+    return None
+
+
+def game_record(room: Room, ended: Optional[float] = None) -> dict:
+    """Ligne d'historique de la partie de la salle (colonnes : history.COLUMNS)."""
+    status = "playing" if ended is None else ("finished" if room.winner else "abandoned")
+    return {
+        "id": room.game_id,
+        "code": room.code,
+        "started": room.started,
+        "ended": ended,
+        "status": status,
+        "seeds": room.seeds,
+        "direction": room.direction,
+        # identité persistante seulement (None si anonyme : pas indexé par joueur) ;
+        # le nom n'est qu'affiché, plusieurs joueurs peuvent porter le même
+        "player_a": room.player_ids["a"],
+        "name_a": room.names["a"],
+        "player_b": room.player_ids["b"],
+        "name_b": room.names["b"],
+        "moves": json.dumps(room.moves),
+        "plies": room.seq,
+        "winner": room.winner,
+    }
+
+
+def record_game(room: Room, ended: bool = False):
+    """
+    Début, coup joué ou fin de partie : la ligne partira dans le prochain lot
+    de l'historique. En cours de partie elle n'est construite qu'au moment du
+    lot (un seul json.dumps quel que soit le nombre de coups entre-temps) ;
+    à la fin c'est un instantané, la salle pouvant servir à une autre partie.
+    """
+    if room.state is None or (ended and room.winner):
+        return   # pas commencée, ou déjà notée à son dernier coup
+    if room.winner or ended:
+        row = game_record(room, time.time())
+        history.put(room.game_id, lambda: row)
+    else:
+        history.put(room.game_id, lambda: game_record(room))
+
+
+def rate_game(room: Room, loser: Optional[str] = None):
+    """
+    Fin d'une partie classée (gagnant sur le plateau, ou abandon de `loser`) :
+    classements des deux identités mis à jour, relayés aux autres workers et
+    annoncés aux joueurs encore assis. Sans deux identités, rien à faire.
+    """
+    if room.rated or room.state is None:
+        return
+    if loser is not None:
+        score_a = 0.0 if loser == "a" else 1.0
+    elif room.winner:
+        score_a = {1: 1.0, 2: 0.0}.get(room.winner, 0.5)   # engine.DRAW : nulle
+    else:
+        return
+    room.rated = True
+    result = ratings.record(room.player_ids["a"] or "", room.player_ids["b"] or "", score_a)
+    if result is None:
+        return
+    publish_players(*result)
+    for spot, p in zip(("a", "b"), result):
+        seated = getattr(room, spot)
+        if seated is not None:
+            seated.push(json.dumps({"type": "rating", **p.public(), "rank": ratings.rank(p.id)}))
+
+
+def expire_seat(room: Room, spot: str):
+    """Fin du délai de grâce : le joueur absent ne reviendra pas."""
+    if room.away.pop(spot, None) is None or registry.rooms.get(room.code) is not room:
+        return
+    registry.revoke(room, spot)
+    if room.seq:
+        rate_game(room, loser=spot)   # pas revenu à temps : partie perdue
+    other = getattr(room, "b" if spot == "a" else "a")
+    if other is not None:
+        send(other, "opponent_left")
+    if other is not None or room.is_abandoned():
+        registry.close_room(room)
+
+
+def room_snapshot(room: Room) -> dict:
+    """Plateau complet et état de la partie : de quoi recaler un client désynchronisé."""
+    return {"pits": room.state.to_list() if room.state else None, **room.game_info()}
+
+
+def resume_info(room: Room, spot: str, from_seq) -> dict:
+    """
+    Réponse à "resume" : les coups joués depuis le dernier seq reçu par le client
+    (journal compact [[idx, step], ...]) et l'état complet, pour rattraper en un aller-retour.
+    """
+    try:
+        from_seq = int(from_seq)
+    except (TypeError, ValueError, OverflowError):
+        from_seq = 0
+    if not 0 <= from_seq <= room.seq:
+        from_seq = 0
+    return {
+        "code": room.code,
+        "role": spot,
+        "names": room.names,
+        "from": from_seq,
+        "moves": [list(m) for m in room.moves[from_seq:]],
+        **room_snapshot(room),
+    }
+
+
+# ========= Opérations de salle ========= #
+#
+# Communes aux joueurs locaux (Session) et aux joueurs d'un autre worker
+# (RemoteSession, via le backplane) : elles tournent sur le worker propriétaire.
+
+def room_join(sess, code: str, name: Optional[str]):
+    room = registry.rooms.get(code)
+    if room is None or room.is_full():
+        send(sess, "error", reason="room_unavailable")
+        return
+
+    spot = "a" if room.a is None else "b"
+    joiner_name = text(name, "J2" if spot == "b" else "J1")
+    token = registry.seat(room, spot, sess, joiner_name)
+    send(sess, "room_joined", code=code, role=spot, token=token)
+
+    # prévenir l'autre
+    broadcast(room, json.dumps({"type": "peer_joined"}))
+
+    # start quand 2 présents: nouvelle partie, avec les noms et les règles
+    if room.is_full():
+        record_game(room, ended=True)   # partie précédente laissée en plan
+        room.start_game()
+        record_game(room)
+        broadcast(
+            room,
+            json.dumps(
+                {
+                    "type": "start",
+                    "names": room.names,
+                    **room.game_info(),
+                }
+            ),
+            spectators=True,
+        )
+
+
+def room_message(sess, msg: dict, raw: str):
+    """move (arbitré par le serveur), sync (plateau du serveur), chat / ping (relayés tels quels)."""
+    room = sess.room
+    t = msg.get("type")
+    if t == "move":
+        reason = play_move(room, sess, msg)
+        if reason:
+            # le client a déjà joué le coup chez lui : il se recale sur le plateau joint
+            send(sess, "error", reason=reason, nonce=msg.get("nonce"), **room_snapshot(room))
+    elif t == "sync":
+        send(sess, "sync", **room_snapshot(room))
+    else:
+        # trame texte relayée telle quelle ; binaire : réencodée pour chaque codec
+        broadcast(room, raw if isinstance(raw, str) else msg)
+
+
+def room_resume(sess, token: str, from_seq):
+    found = registry.resume(token, sess)
+    if found is None:
+        send(sess, "error", reason="bad_token")
+        return
+    room, spot, old = found
+    if old is not None:
+        old.kick("replaced by resume")
+    send(sess, "resumed", **resume_info(room, spot, from_seq))
+    other = room.other(sess)
+    if other is not None:
+        send(other, "opponent_back")
+
+
+def room_depart(sess, dropped: bool):
+    """
+    Coupure ou erreur (dropped), ou "leave" explicite d'un joueur assis :
+    notification à l'adversaire. Seul le "leave" compte comme abandon classé.
+    """
+    room = sess.room
+    other = room.other(sess)
+    if dropped and room.state is not None and not room.winner:
+        # coupure pendant une partie : la place reste réservée RESUME_GRACE s
+        registry.hold_seat(sess, expire_seat)
+        notice = "opponent_away"
+    elif dropped:
+        # pas de partie en cours : l'adversaire est prévenu, la salle fermée
+        registry.close_room(room)
+        notice = "opponent_left"
+    else:
+        # départ volontaire : on libère la place, la salle vit tant qu'elle n'est pas vide
+        if room.seq and not room.winner:
+            rate_game(room, loser=sess.role)   # abandon en cours de partie
+        registry.unseat(sess)
+        if room.is_abandoned():
+            registry.close_room(room)
+        notice = "peer_left"
+    if other is not None:
+        if notice == "opponent_away":
+            send(other, notice, grace=RESUME_GRACE)
+        else:
+            send(other, notice)
+
+
+def send(sess: Session, type_, **data):
     """Helper pour envoyer un message typé à un client de partie."""
-    await ws.send_text(json.dumps({"type": type_, **data}))
+    sess.push(codec.encode({"type": type_, **data}, sess.codec))
+
+
+def encoder(msg):
+    """
+    frame(nom de codec) -> trame de `msg`, encodée au plus une fois par codec.
+    Une trame JSON déjà encodée (str) sert telle quelle à tous les codecs.
+    """
+    if isinstance(msg, str):
+        return lambda codec_name: msg
+    frames = {}
+
+    def frame(codec_name: str):
+        f = frames.get(codec_name)
+        if f is None:
+            f = frames[codec_name] = codec.encode(msg, codec_name)
+        return f
+    return frame
 
 
-async def broadcast(code: str, msg: str):
-    """Broadcast dans une salle de jeu (partie à 2)."""
-    if code not in rooms:
+def broadcast(room: Optional[Room], msg, spectators: bool = False):
+    """
+    Broadcast dans une salle de jeu (partie à 2) : trame JSON déjà encodée, ou dict.
+    spectators=True (coups, début de partie) : la même trame part ensuite aux spectateurs.
+    """
+    if room is None:
         return
-    for k in ("a", "b"):
-        ws = rooms[code].get(k)
-        if ws:
-            try:
-                await ws.send_text(msg)
-            except Exception:
-                pass
+    players = room.players()
+    metrics.fanout["room"].record(len(players))
+    frame = encoder(msg)
+    for sess in players:
+        sess.push(frame(sess.codec))
+    if spectators and (room.code in registry.audiences or room.watchers):
+        to_audience(room, frame)
 
 
-async def lobby_broadcast(payload: dict, exclude: Optional[WebSocket] = None):
+def lobby_broadcast(payload: dict, exclude: Optional[Session] = None):
     """
     Broadcast d'un message de lobby (presence_delta, etc.)
     à tous les joueurs du lobby, sauf éventuellement `exclude`.
+    La trame est encodée une fois par codec ; un client lent peut la perdre (resync).
     """
-    raw = json.dumps(payload)
-    for ws in list(ws_to_user_id.keys()):
-        if exclude is not None and ws is exclude:
-            continue
-        try:
-            await ws.send_text(raw)
-        except Exception:
-            # on ignore les erreurs réseau ponctuelles
-            pass
+    frame = encoder(payload)
+    n = 0
+    for sess in registry.lobby_members():
+        if sess is not exclude:
+            sess.push(frame(sess.codec), droppable=True)
+            n += 1
+    metrics.fanout["lobby"].record(n)
+
+
+# ========= Spectateurs ========= #
+#
+# N'importe qui peut regarder une salle par son code ("spectate") : il reçoit
+# un instantané ("spectating" : noms, coups joués, plateau, seq) puis chaque
+# coup et chaque début de partie, jusqu'à "spectate_end".
+#
+# Les joueurs d'abord : broadcast() dépose la trame dans leurs deux files,
+# puis la confie à la pompe des spectateurs (AudiencePump), qui ne remplit
+# que SPECTATOR_BATCH files par tour de boucle. Entre deux tranches, la boucle
+# lit le réseau : les coups des joueurs ne font jamais la queue derrière des
+# milliers de spectateurs. Chaque trame est encodée une fois par codec et le
+# même objet est déposé dans toutes les files, sans copie ; un spectateur trop
+# lent est déconnecté (OUTBOX_LIMIT), il ne perd jamais un coup en silence.
+#
+# Spectateurs d'un autre worker : le propriétaire de la salle compte ses
+# spectateurs par worker (Room.watchers) et lui publie chaque trame une seule
+# fois ("audience") ; ce worker la passe à sa propre pompe (Registry.audiences).
+# Les instantanés passent par la même pompe, dans l'ordre : un coup déjà
+# compris dans l'instantané peut arriver juste avant lui, le client ignore
+# tout ce qui précède "spectating".
+SPECTATOR_BATCH = int(os.getenv("KATRO_SPECTATOR_BATCH", "32"))
+
+
+class AudiencePump:
+    """Diffusions aux spectateurs d'ici, dans l'ordre, par tranches (voir plus haut)."""
+    __slots__ = ("jobs", "pos", "handle")
+
+    def __init__(self):
+        # [code, frame(codec), fin, destinataires] ; destinataires None : le public
+        # de la salle, relevé quand la diffusion commence
+        self.jobs: deque = deque()
+        self.pos = 0    # destinataires déjà servis de la première diffusion
+        self.handle: Optional[asyncio.Handle] = None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, code: str, frame, end: bool = False, targets: Optional[list] = None):
+        self.jobs.append([code, frame, end, targets])
+        if self.handle is None:
+            self.handle = asyncio.get_running_loop().call_soon(self.run)
+
+    def run(self):
+        self.handle = None
+        budget = SPECTATOR_BATCH
+        while self.jobs and budget > 0:
+            job = self.jobs[0]
+            code, frame, end, targets = job
+            if targets is None:
+                audience = registry.audiences.get(code)
+                targets = job[3] = list(audience.values()) if audience else []
+                metrics.fanout["spectators"].record(len(targets))
+            batch = targets[self.pos:self.pos + budget]
+            for sess in batch:
+                if sess.watching is not None and sess.watching[0] == code:
+                    sess.push(frame(sess.codec))
+                    if end:
+                        registry.unwatch(sess)
+            self.pos += len(batch)
+            budget -= len(batch)
+            if self.pos >= len(targets):
+                self.jobs.popleft()
+                self.pos = 0
+        if self.jobs:
+            self.handle = asyncio.get_running_loop().call_soon(self.run)
+
+
+audience_pump = AudiencePump()
+
+
+def spectate_snapshot(room: Room) -> dict:
+    return {
+        "type": "spectating",
+        "code": room.code,
+        "names": room.names,
+        "moves": [list(m) for m in room.moves],
+        **room_snapshot(room),
+    }
 
 
-async def send_presence_snapshot_to(ws: WebSocket):
+def to_audience(room: Room, frame, end: bool = False):
+    """Trame de la salle (frame(codec)) vers ses spectateurs d'ici et des autres workers."""
+    if room.watchers:
+        op = {"op": "audience", "code": room.code, "frame": frame(codec.JSON), "end": end}
+        for worker in room.watchers:
+            backplane.publish(f"w:{worker}", op)
+        if end:
+            room.watchers.clear()
+    if room.code in registry.audiences:
+        audience_pump.add(room.code, frame, end)
+
+
+def end_audience(room: Room, reason: str = "room_closed"):
+    """Salle fermée : fin pour ses spectateurs, après les trames déjà en route."""
+    if room.code in registry.audiences or room.watchers:
+        to_audience(room, encoder(json.dumps({"type": "spectate_end", "code": room.code, "reason": reason})),
+                    end=True)
+
+
+def stop_spectating(sess: Session):
+    watching = registry.unwatch(sess)
+    if watching is not None and watching[1] != WORKER_ID:
+        relay(watching[1], "unspectate", sess, code=watching[0])
+
+
+# ========= Présence : deltas groupés par tick ========= #
+#
+# Les arrivées / départs / mises à jour du lobby ne partent plus un par un :
+# ils sont fusionnés par user_id pendant PRESENCE_TICK secondes, puis un seul
+# presence_delta, encodé une fois, part à tout le lobby. Un ajout suivi d'un
+# retrait dans le même tick s'annule. Le delta part aussi à son auteur :
+# "added" / "updated" sont des mises à jour par id, le client ignore sa propre
+# fiche grâce à your_id.
+PRESENCE_TICK = float(os.getenv("KATRO_PRESENCE_TICK", "0.15"))
+
+# Snapshots paginés : taille de page par défaut / maximale
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class PresenceBatcher:
+    __slots__ = ("tick", "pending", "handle")
+
+    def __init__(self, tick: float):
+        self.tick = tick
+        self.pending: dict[str, tuple[str, dict]] = {}   # user_id -> (genre, fiche)
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+    def added(self, user: dict):
+        self._note(user, "added")
+
+    def updated(self, user: dict):
+        self._note(user, "updated")
+
+    def removed(self, user: dict):
+        self._note(user, "removed")
+
+    def _note(self, user: dict, kind: str):
+        uid = user["id"]
+        prev = self.pending.get(uid)
+        if prev is not None:
+            before = prev[0]
+            if kind == "removed" and before == "added":
+                del self.pending[uid]   # arrivé puis reparti : rien à dire
+                return
+            if kind == "updated" and before == "added":
+                kind = "added"
+            elif kind == "added" and before == "removed":
+                kind = "updated"
+        self.pending[uid] = (kind, user)
+        if self.handle is None:
+            self.handle = asyncio.get_running_loop().call_later(self.tick, self.flush)
+
+    def flush(self):
+        """Publie le delta du tick sur le canal "lobby" (tous les workers, celui-ci compris)."""
+        self.handle = None
+        if not self.pending:
+            return
+        delta = {"worker": WORKER_ID, "added": [], "removed": [], "updated": []}
+        for kind, user in self.pending.values():
+            delta[kind].append(user)
+            if backplane.distributed:
+                # annuaire partagé : l'état de départ d'un worker qui démarre
+                if kind == "removed":
+                    backplane.hdel("lobby", user["id"])
+                else:
+                    backplane.hset("lobby", user["id"], json.dumps({"user": user, "worker": WORKER_ID}))
+        self.pending.clear()
+        backplane.publish("lobby", delta)
+
+
+class LobbyView:
     """
-    Envoie à un websocket le snapshot complet des autres joueurs du lobby.
-    On exclut le joueur lui-même de la liste et on lui donne son your_id.
+    Vue publiée du lobby : son état au dernier tick, numérotée par `version`.
+    Un snapshot de version v suivi des deltas de version > v donne donc l'état
+    exact. Les membres sont gardés triés par (nom en minuscules, id), en tout
+    et par statut : une page filtrée coûte O(log N + taille de page). Les pages
+    encodées sont gardées en cache jusqu'au tick suivant, si bien qu'une rafale
+    de lobby_hello réutilise la même trame.
     """
-    user_id = ws_to_user_id.get(ws)
-    if not user_id:
+    __slots__ = ("version", "users", "where", "order", "by_status", "pages", "sweeper")
+
+    def __init__(self):
+        self.version = 0
+        self.users: dict[str, dict] = {}          # id -> fiche publiée
+        self.where: dict[str, str] = {}           # id -> worker où le joueur est connecté
+        self.order: list[tuple[str, str]] = []    # (nom minuscule, id), trié
+        self.by_status: dict[str, list] = {}      # statut -> même chose, filtré
+        self.pages: dict[tuple, str] = {}         # requête -> fin de trame encodée
+        self.sweeper: Optional[asyncio.Task] = None   # sweep_workers (plusieurs workers)
+
+    @staticmethod
+    def _key(user: dict) -> tuple[str, str]:
+        return ((user.get("name") or "").lower(), user["id"])
+
+    def _unlist(self, user: dict):
+        key = self._key(user)
+        for keys in (self.order, self.by_status.get(user.get("status"), [])):
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def apply(self, kind: str, user: dict, worker: str = WORKER_ID):
+        old = self.users.pop(user["id"], None)
+        if old is not None:
+            self._unlist(old)
+        if kind == "removed":
+            self.where.pop(user["id"], None)
+            return
+        self.users[user["id"]] = user
+        self.where[user["id"]] = worker
+        key = self._key(user)
+        insort(self.order, key)
+        insort(self.by_status.setdefault(user.get("status"), []), key)
+
+    def bump(self) -> int:
+        self.version += 1
+        self.pages.clear()
+        return self.version
+
+    def page(self, status: Optional[str], prefix: str, cursor, size: int) -> str:
+        """Fin de trame JSON (après your_id) d'une page de snapshot, en cache."""
+        ckey = (status, prefix, tuple(cursor) if cursor else None, size)
+        tail = self.pages.get(ckey)
+        if tail is not None:
+            return tail
+        keys = self.order if status is None else self.by_status.get(status, [])
+        lo = bisect_left(keys, (prefix, ""))
+        hi = bisect_left(keys, (prefix + "\uffff", "")) if prefix else len(keys)
+        start = lo
+        if cursor:
+            start = max(lo, bisect_right(keys, (str(cursor[0]), str(cursor[1]))))
+        chunk = keys[start:min(hi, start + size)]
+        users = [self.users[uid] for _, uid in chunk]
+        next_cursor = list(chunk[-1]) if chunk and start + size < hi else None
+        body = json.dumps({
+            "version": self.version,
+            "cursor": cursor or None,
+            "next_cursor": next_cursor,
+            "total": hi - lo,
+            "users": users,
+        })
+        tail = body[1:]   # sans l'accolade ouvrante
+        if len(self.pages) < 1024:
+            self.pages[ckey] = tail
+        return tail
+
+
+presence = PresenceBatcher(PRESENCE_TICK)
+lobby_view = LobbyView()
+
+
+def presence_snapshot(sess: Session, cursor=None) -> str:
+    """
+    Une page du snapshot du lobby (vue publiée, filtre de la session).
+    Seul your_id dépend du destinataire : il est collé devant la page en cache.
+    La liste peut contenir la fiche du joueur lui-même (il la reconnaît à your_id).
+    """
+    status, prefix, size = sess.lobby_view
+    tail = lobby_view.page(status, prefix, cursor, size)
+    return '{"type": "presence_snapshot", "your_id": ' + json.dumps(sess.user_id) + ", " + tail
+
+
+def set_lobby_view(sess: Session, msg: dict):
+    """Filtre / taille de page demandés par le client (lobby_hello, lobby_page)."""
+    status, prefix, size = sess.lobby_view
+    if "status" in msg:
+        status = str(msg["status"])[:20] if msg["status"] else None
+    if "prefix" in msg:
+        prefix = str(msg["prefix"] or "")[:20].lower()
+    if "page_size" in msg:
+        try:
+            size = max(1, min(MAX_PAGE_SIZE, int(msg["page_size"])))
+        except (TypeError, ValueError, OverflowError):
+            pass
+    sess.lobby_view = (status, prefix, size)
+
+
+def send_presence_snapshot_to(sess: Session, cursor=None):
+    if sess.user_id is None:
         # pas encore enregistré, rien à envoyer
         return
+    # jetable lui aussi : un snapshot plus récent le remplace
+    sess.push(presence_snapshot(sess, cursor), droppable=True)
+
+
+def leave_lobby(sess: Session):
+    """Retire la session du lobby et prévient les autres."""
+    user = registry.leave_lobby(sess)
+    if user:
+        presence.removed(user)
+
+
+def on_lobby_delta(delta: dict):
+    """Delta de présence d'un worker (ou de celui-ci) : vue publiée puis lobby local."""
+    worker = delta["worker"]
+    for kind in ("added", "removed", "updated"):
+        for user in delta[kind]:
+            lobby_view.apply(kind, user, worker)
+    lobby_broadcast({
+        "type": "presence_delta",
+        "added": delta["added"],
+        "removed": delta["removed"],
+        "updated": delta["updated"],
+        "version": lobby_view.bump(),
+    })
+
+
+def republish_lobby():
+    """Backplane reconnecté (peut-être redémarré) : nos joueurs dans l'annuaire partagé."""
+    for sess in registry.lobby_members():
+        backplane.hset("lobby", sess.user_id, json.dumps({"user": sess.public(), "worker": WORKER_ID}))
+
+
+def drop_worker(worker: str):
+    """Worker disparu (clé "worker:<id>" expirée) : ses joueurs quittent le lobby."""
+    users = [lobby_view.users[uid] for uid, w in lobby_view.where.items() if w == worker]
+    for user in users:
+        backplane.hdel("lobby", user["id"])
+    if users:
+        print(f"[SERVER] worker {worker} disparu : {len(users)} joueurs retirés du lobby")
+        on_lobby_delta({"worker": worker, "added": [], "removed": users, "updated": []})
+
+
+async def sweep_workers():
+    """Toutes les BACKPLANE_TTL / 3 s : retire du lobby les joueurs des workers disparus."""
+    while True:
+        await asyncio.sleep(BACKPLANE_TTL / 3)
+        for worker in {w for w in lobby_view.where.values() if w != WORKER_ID}:
+            try:
+                alive = await backplane.get(f"worker:{worker}")
+            except ConnectionError:
+                break   # backplane en reconnexion : au prochain tour
+            if alive is None:
+                drop_worker(worker)
+
+
+def remote_user(user_id: str) -> Optional[RemoteSession]:
+    """Joueur du lobby connecté à un autre worker (None s'il est inconnu ou local)."""
+    worker = lobby_view.where.get(user_id)
+    if worker is None or worker == WORKER_ID:
+        return None
+    user = lobby_view.users.get(user_id) or {}
+    return RemoteSession(worker, None, user_id, user.get("name") or "Joueur")
+
+
+# ========= Matchmaking : file d'attente par tranche de classement ========= #
+#
+# "queue_join" met le joueur en file avec son classement ; il est apparié au
+# joueur en attente le plus proche dont l'écart est accepté, puis les deux
+# reçoivent match_start, comme après une invitation.
+# L'écart accepté (fenêtre) s'élargit avec l'attente : MM_WINDOW au départ,
+# + MM_WIDEN par seconde, jusqu'à MM_MAX_WINDOW ; deux joueurs s'acceptent si
+# leur écart tient dans la plus large de leurs deux fenêtres.
+# Les joueurs sont rangés par tranche de MM_BUCKET points (ordre d'arrivée
+# dans chaque tranche) et les tranches non vides dans une liste triée : une
+# recherche = une bisection + quelques tranches voisines, sans jamais
+# parcourir la file ni le lobby. Toutes les MM_TICK secondes, la tête (la
+# plus ancienne) de chaque tranche retente sa chance avec sa fenêtre élargie.
+# Chaque worker a sa propre file : ses joueurs sont appariés entre eux.
+MM_BUCKET = 50
+MM_WINDOW = float(os.getenv("KATRO_MM_WINDOW", "100"))
+MM_WIDEN = float(os.getenv("KATRO_MM_WIDEN", "25"))
+MM_MAX_WINDOW = float(os.getenv("KATRO_MM_MAX_WINDOW", "800"))
+MM_TICK = float(os.getenv("KATRO_MM_TICK", "1.0"))
+DEFAULT_RATING = 1500
+
+# temps d'attente avant appariement (secondes)
+WAIT_BUCKETS = (0.1, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+
+class QueueEntry:
+    __slots__ = ("sess", "rating", "since")
+
+    def __init__(self, sess: Session, rating: int, since: float):
+        self.sess = sess
+        self.rating = rating
+        self.since = since
+
+    def window(self, now: float) -> float:
+        return min(MM_MAX_WINDOW, MM_WINDOW + MM_WIDEN * (now - self.since))
+
+
+class Matchmaker:
+    __slots__ = ("buckets", "keys", "entries", "wait", "matches", "task")
+
+    def __init__(self):
+        self.buckets: dict[int, dict[str, QueueEntry]] = {}   # tranche -> sid -> entrée (ordre d'arrivée)
+        self.keys: list[int] = []                             # tranches non vides, triées
+        self.entries: dict[str, QueueEntry] = {}              # sid -> entrée
+        self.wait = Histogram(WAIT_BUCKETS)
+        self.matches = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def join(self, sess: Session, rating: int) -> Optional[tuple[QueueEntry, QueueEntry]]:
+        """Met la session en file ; renvoie (plus ancien, nouveau) si un adversaire est trouvé tout de suite."""
+        self.leave(sess)
+        entry = QueueEntry(sess, rating, time.monotonic())
+        other = self._nearest(entry, entry.since)
+        if other is None:
+            self._insert(entry)
+            return None
+        self._remove(other)
+        return self._paired(other, entry)
+
+    def leave(self, sess: Session) -> bool:
+        """Retire la session de la file (annulation, déconnexion, partie trouvée ailleurs)."""
+        entry = self.entries.get(sess.sid)
+        if entry is None or entry.sess is not sess:
+            return False
+        self._remove(entry)
+        return True
+
+    def requeue(self, entry: QueueEntry):
+        """Remet un joueur dont l'adversaire a disparu, sans perdre son ancienneté."""
+        if entry.sess.sid not in self.entries:
+            self._insert(entry)
+
+    def tick(self) -> list[tuple[QueueEntry, QueueEntry]]:
+        """Fenêtres élargies : la tête de chaque tranche cherche à nouveau un adversaire."""
+        now = time.monotonic()
+        pairs = []
+        for key in list(self.keys):
+            bucket = self.buckets.get(key)
+            if not bucket:
+                continue
+            head = next(iter(bucket.values()))
+            other = self._nearest(head, now)
+            if other is not None:
+                self._remove(head)
+                self._remove(other)
+                pairs.append(self._paired(*sorted((head, other), key=lambda e: e.since)))
+        return pairs
+
+    # -- interne --
+    def _paired(self, first: QueueEntry, second: QueueEntry) -> tuple[QueueEntry, QueueEntry]:
+        now = time.monotonic()
+        self.wait.record(now - first.since)
+        self.wait.record(now - second.since)
+        self.matches += 1
+        return first, second
+
+    def _insert(self, entry: QueueEntry):
+        key = entry.rating // MM_BUCKET
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = {}
+            insort(self.keys, key)
+        bucket[entry.sess.sid] = entry
+        self.entries[entry.sess.sid] = entry
+
+    def _remove(self, entry: QueueEntry):
+        sid = entry.sess.sid
+        self.entries.pop(sid, None)
+        key = entry.rating // MM_BUCKET
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return
+        bucket.pop(sid, None)
+        if not bucket:
+            del self.buckets[key]
+            self.keys.pop(bisect_left(self.keys, key))
+
+    def _nearest(self, entry: QueueEntry, now: float) -> Optional[QueueEntry]:
+        """
+        Adversaire le plus proche en classement qui accepte l'écart (ou que
+        `entry` accepte). On part de la tranche de `entry` et on s'écarte des
+        deux côtés tant qu'une tranche peut encore faire mieux : au plus
+        2 * MM_MAX_WINDOW / MM_BUCKET tranches examinées, chacune en entier. Une
+        tranche ne garde d'ordinaire qu'un joueur (MM_BUCKET < MM_WINDOW : deux
+        joueurs d'une même tranche s'acceptent toujours).
+        """
+        keys, rating = self.keys, entry.rating
+        mine = entry.window(now)
+        hi = bisect_left(keys, rating // MM_BUCKET)
+        lo = hi - 1
+        best, best_gap = None, MM_MAX_WINDOW + 1
+        while lo >= 0 or hi < len(keys):
+            # tranche la plus proche parmi les deux candidates (écart minimal possible)
+            gap_lo = rating - (keys[lo] + 1) * MM_BUCKET + 1 if lo >= 0 else None
+            gap_hi = max(0, keys[hi] * MM_BUCKET - rating) if hi < len(keys) else None
+            if gap_hi is None or (gap_lo is not None and gap_lo < gap_hi):
+                key, floor = keys[lo], max(0, gap_lo)
+                lo -= 1
+            else:
+                key, floor = keys[hi], gap_hi
+                hi += 1
+            if floor >= best_gap:
+                break
+            # toute la tranche : sa tête peut refuser l'écart quand une autre l'accepte
+            # (à écart égal, la plus ancienne l'emporte : ordre d'arrivée)
+            for other in self.buckets[key].values():
+                if other is entry:
+                    continue
+                gap = abs(other.rating - rating)
+                if gap < best_gap and gap <= max(mine, other.window(now)):
+                    best, best_gap = other, gap
+                    if gap == 0:
+                        return best
+        return best
+
+
+matchmaker = Matchmaker()
+
 
-    others = [u for uid, u in lobby_users.items() if uid != user_id]
-    snapshot = {
-        "type": "presence_snapshot",
-        "your_id": user_id,  # permet au client de savoir qui il est
-        "users": others,
+def parse_rating(value) -> int:
+    try:
+        return max(0, min(4000, int(value)))
+    except (TypeError, ValueError, OverflowError):
+        return DEFAULT_RATING
+
+
+def waiting(sess: Session) -> bool:
+    """Toujours connecté et pas encore assis dans une salle."""
+    return not sess.closing and sess.room is None and registry.by_sid.get(sess.sid) is sess
+
+
+async def start_match(first, second, room: Optional[Room] = None) -> Room:
+    """Assoit deux joueurs (Session ou RemoteSession) dans une salle neuve et leur envoie match_start."""
+    if room is None:
+        room = await registry.new_room()
+    tokens = {
+        "a": registry.seat(room, "a", first, first.name or "J1"),
+        "b": registry.seat(room, "b", second, second.name or "J2"),
     }
-    await ws.send_text(json.dumps(snapshot))
+    room.start_game()
+    record_game(room)
+    for player in (first, second):
+        player.push(
+            json.dumps(
+                {
+                    "type": "match_start",
+                    "code": room.code,
+                    "role": player.role,
+                    "names": room.names,
+                    "token": tokens[player.role],
+                    **room.game_info(),
+                }
+            )
+        )
+    return room
 
 
-def get_ws_by_user_id(user_id: str) -> Optional[WebSocket]:
-    """Retrouve le WebSocket correspondant à un user_id du lobby."""
-    for ws, uid in ws_to_user_id.items():
-        if uid == user_id:
-            return ws
+async def start_queued_match(first: QueueEntry, second: QueueEntry):
+    # la réservation du code cède la main : un des deux a pu partir entre-temps
+    room = await registry.new_room()
+    if waiting(first.sess) and waiting(second.sess):
+        await start_match(first.sess, second.sess, room)
+        return
+    registry.close_room(room)
+    for entry in (first, second):
+        if waiting(entry.sess):
+            matchmaker.requeue(entry)
+
+
+async def matchmaking_loop():
+    while True:
+        await asyncio.sleep(MM_TICK)
+        for first, second in matchmaker.tick():
+            try:
+                await start_queued_match(first, second)
+            except Exception as e:
+                print("[SERVER] matchmaking:", repr(e))
+
+
+# ========= Backplane : relais entre workers ========= #
+#
+# Canal "w:<worker>" : opérations adressées à un worker.
+#   vers le worker d'un joueur    : push, kick, attach, detach
+#   vers le propriétaire de salle : join, bind, msg, depart, resume, spectate, unspectate
+#   vers le worker de spectateurs : audience
+
+async def owner_of(code: str) -> Optional[str]:
+    """Worker propriétaire d'une salle (lecture partagée seulement si elle n'est pas ici)."""
+    if code in registry.rooms:
+        return WORKER_ID
+    return await backplane.get(f"room:{code}")
+
+
+def relay(owner: str, op: str, sess: Session, **data):
+    """Relaie une opération d'un joueur local au worker propriétaire de sa salle."""
+    backplane.publish(f"w:{owner}", {"op": op, "worker": WORKER_ID, "sid": sess.sid,
+                                     "uid": sess.user_id, "player": sess.player, **data})
+
+
+def local_session(op: dict) -> Optional[Session]:
+    sess = registry.by_sid.get(op.get("sid"))
+    if sess is None and op.get("uid"):
+        sess = registry.by_user.get(op["uid"])
+    return sess
+
+
+def seated_remote(op: dict) -> Optional[RemoteSession]:
+    room = registry.rooms.get(op.get("code"))
+    if room is None:
+        return None
+    for s in room.players():
+        if isinstance(s, RemoteSession) and s.matches(op):
+            return s
     return None
 
 
-@app.websocket("/ws")
-async def ws_endpoint(ws: WebSocket):
-    await ws.accept()
-    role = None
-    code: Optional[str] = None
+def op_push(op: dict):
+    sess = local_session(op)
+    if sess is not None:
+        frame = op["frame"]
+        if sess.codec != codec.JSON:
+            frame = codec.encode(json.loads(frame), sess.codec)
+        sess.push(frame)
 
-    try:
-        while True:
-            raw = await ws.receive_text()
-            msg = json.loads(raw)
-            t = msg.get("type")
-
-            # ---------- LOBBY : joueurs en ligne ----------
-            if t == "lobby_hello":
-                # Un client s'annonce dans le lobby
-                name = (msg.get("name") or "Joueur")[:20]
-                avatar = msg.get("avatar") or "avatar_01"
-
-                existing_id = ws_to_user_id.get(ws)
-                is_new = existing_id is None
-                user_id = existing_id or secrets.token_hex(4)
-
-                # Enregistrer / mettre à jour l'utilisateur
-                user = {
-                    "id": user_id,
-                    "name": name,
-                    "status": "dispo",  # tu pourras gérer AFK, occupé, etc. plus tard
-                    "avatar": avatar,
-                }
-                lobby_users[user_id] = user
-                ws_to_user_id[ws] = user_id
-
-                # 1) envoyer au client un snapshot des AUTRES
-                await send_presence_snapshot_to(ws)
-
-                # 2) prévenir les autres joueurs du lobby de l'arrivée / mise à jour
-                delta = {
-                    "type": "presence_delta",
-                    "added": [user] if is_new else [],
-                    "removed": [],
-                    "updated": [] if is_new else [user],
-                }
-                await lobby_broadcast(delta, exclude=ws)
-
-            elif t == "lobby_goodbye":
-                # Le client quitte volontairement le lobby
-                user_id = ws_to_user_id.pop(ws, None)
-                if user_id:
-                    user = lobby_users.pop(user_id, None)
-                    if user:
-                        delta = {
-                            "type": "presence_delta",
-                            "added": [],
-                            "removed": [user],
-                            "updated": [],
-                        }
-                        await lobby_broadcast(delta, exclude=ws)
-
-            # ---------- INVITATIONS (lobby_invite / lobby_answer) ----------
-            elif t == "invite":
-                # Le client (ws) invite un autre joueur à jouer
-                from_id = ws_to_user_id.get(ws)
-                if not from_id:
-                    continue
-                to_id = str(msg.get("to_id") or "")
-                if not to_id:
-                    continue
 
-                print(f"[SERVER] invite from {from_id} to {to_id}")
+def op_kick(op: dict):
+    sess = local_session(op)
+    if sess is not None:
+        sess.kick(op.get("why") or "replaced")
 
-                target_ws = get_ws_by_user_id(to_id)
-                if not target_ws:
-                    continue  # joueur plus là
 
-                from_user = lobby_users.get(from_id, {"name": "Joueur"})
-                payload = {
-                    "type": "invite_incoming",
-                    "from_id": from_id,
-                    "from_name": from_user.get("name") or "Joueur",
-                    "avatar": from_user.get("avatar") or "avatar_01",
-                }
-                await target_ws.send_text(json.dumps(payload))
+def op_attach(op: dict):
+    sess = local_session(op)
+    if sess is None:
+        return
+    if sess.room is not None and sess.room.code != op["code"]:
+        # déjà assis ailleurs (invitation acceptée entre-temps) : on rend la place
+        relay(op["owner"], "depart", sess, code=op["code"], dropped=False)
+        return
+    sess.attach(RemoteRoom(op["code"], op["owner"]), op["role"])
+    # le propriétaire ne connaît peut-être que notre user_id : on lui donne le sid
+    relay(op["owner"], "bind", sess, code=op["code"])
 
-            elif t == "invite_reply":
-                # Un joueur accepte / refuse une invitation
-                from_id = ws_to_user_id.get(ws)
-                if not from_id:
-                    continue
-                to_id = str(msg.get("to_id") or "")
-                if not to_id:
-                    continue
-                accepted = bool(msg.get("accepted"))
 
-                print(f"[SERVER] invite_reply from {from_id} to {to_id}, accepted={accepted}")
+def op_detach(op: dict):
+    sess = local_session(op)
+    if sess is not None and isinstance(sess.room, RemoteRoom) and sess.room.code == op["code"]:
+        sess.detach()
 
-                inviter_ws = get_ws_by_user_id(to_id)
-                if not inviter_ws:
-                    continue  # l'autre n'est plus connecté
 
-                from_user = lobby_users.get(from_id, {"name": "Joueur"})
-                inviter_user = lobby_users.get(to_id, {"name": "Joueur"})
+def op_join(op: dict):
+    sess = RemoteSession(op["worker"], op["sid"], op["uid"], player=op.get("player"))
+    room_join(sess, op["code"], op.get("name"))
 
-                if not accepted:
-                    # Simple refus
-                    payload = {
-                        "type": "invite_declined",
-                        "from_id": from_id,
-                        "from_name": from_user.get("name") or "Joueur",
-                    }
-                    await inviter_ws.send_text(json.dumps(payload))
-                    continue
 
-                # Invitation acceptée -> création d'une salle et match_start pour les 2
-                code = new_code()
-                while code in rooms:
-                    code = new_code()
-
-                rooms[code] = {
-                    "a": inviter_ws,
-                    "b": ws,
-                    "names": {
-                        "a": inviter_user.get("name") or "J1",
-                        "b": from_user.get("name") or "J2",
-                    },
-                }
-                ws_to_room_code[inviter_ws] = code
-                ws_to_room_code[ws] = code
-
-                names = rooms[code]["names"]
-
-                # message match_start pour les 2 joueurs
-                await inviter_ws.send_text(
-                    json.dumps(
-                        {
-                            "type": "match_start",
-                            "code": code,
-                            "role": "a",
-                            "names": names,
-                        }
-                    )
-                )
-                await ws.send_text(
-                    json.dumps(
-                        {
-                            "type": "match_start",
-                            "code": code,
-                            "role": "b",
-                            "names": names,
-                        }
-                    )
-                )
-
-            # ---------- PARTIES CLASSIQUES (création/join par code) ----------
-            elif t == "create_room":
-                code = new_code()
-                while code in rooms:
-                    code = new_code()
-
-                creator_name = (msg.get("name") or "J1")[:20]
-                rooms[code] = {
-                    "a": ws,
-                    "b": None,
-                    "names": {"a": creator_name, "b": None},
-                }
-                role = "a"
-                ws_to_room_code[ws] = code
-                await send(ws, "room_created", code=code, role=role)
-
-            elif t == "join_room":
-                code = (msg.get("code", "") or "").upper()
-                if code not in rooms or (rooms[code]["a"] and rooms[code]["b"]):
-                    await send(ws, "error", reason="room_unavailable")
-                    continue
+def op_bind(op: dict):
+    room = registry.rooms.get(op.get("code"))
+    for s in room.players() if room else ():
+        if isinstance(s, RemoteSession) and s.sid is None and s.matches(op):
+            s.sid = op["sid"]
+            s.player = room.player_ids[s.role] = op.get("player")
 
-                spot = "a" if rooms[code]["a"] is None else "b"
-                rooms[code][spot] = ws
-
-                joiner_name = (
-                    msg.get("name") or ("J2" if spot == "b" else "J1")
-                )[:20]
-                rooms[code]["names"][spot] = joiner_name
-
-                role = spot
-                ws_to_room_code[ws] = code
-                await send(ws, "room_joined", code=code, role=role)
-
-                # prévenir l'autre
-                await broadcast(code, json.dumps({"type": "peer_joined"}))
-
-                # start quand 2 présents: inclure les noms
-                if rooms[code]["a"] and rooms[code]["b"]:
-                    await broadcast(
-                        code,
-                        json.dumps(
-                            {
-                                "type": "start",
-                                "names": rooms[code]["names"],
-                            }
-                        ),
-                    )
-
-            elif t in ("move", "chat", "ping"):
-                # on retrouve le code de salle via le mapping global
-                room_code = ws_to_room_code.get(ws)
-                if not room_code:
-                    continue
-                await broadcast(room_code, raw)
 
-            elif t == "leave":
-                # côté client on ferme la partie
-                break
+def op_msg(op: dict):
+    sess = seated_remote(op)
+    if sess is not None:
+        room_message(sess, json.loads(op["raw"]), op["raw"])
 
-    except WebSocketDisconnect:
-        # --- Nouveau : gérer la sortie pendant une partie ---
-        if ws in ws_to_room_code:
-            code = ws_to_room_code.pop(ws)
-            room = rooms.get(code)
-
-            if room:
-                # déterminer qui est l'adversaire
-                opponent_key = "b" if room["a"] is ws else "a"
-                opponent_ws = room.get(opponent_key)
-
-                # notifier l'autre joueur
-                if opponent_ws:
-                    try:
-                        await opponent_ws.send_text(json.dumps({
-                            "type": "opponent_left"
-                        }))
-                    except:
-                        pass
-
-                # fermer la salle
-                try:
-                    rooms.pop(code, None)
-                except:
-                    pass
 
-        # --- ancien code de gestion de lobby_goodbye ---    
-        user_id = ws_to_user_id.pop(ws, None)
-        if user_id:
-            user = lobby_users.pop(user_id, None)
-            if user:
-                delta = {
-                    "type": "presence_delta",
-                    "added": [],
-                    "removed": [user],
-                    "updated": [],
-                }
-                await lobby_broadcast(delta, exclude=ws)
+def op_depart(op: dict):
+    sess = seated_remote(op)
+    if sess is not None:
+        room_depart(sess, op["dropped"])
 
-    finally:
-        # ---------- Nettoyage lobby ----------
-        user_id = ws_to_user_id.pop(ws, None)
-        if user_id:
-            user = lobby_users.pop(user_id, None)
-            if user:
-                delta = {
-                    "type": "presence_delta",
-                    "added": [],
-                    "removed": [user],
-                    "updated": [],
-                }
-                await lobby_broadcast(delta, exclude=ws)
 
-        # ---------- Nettoyage rooms + notification à l'adversaire ----------
-        room_code = ws_to_room_code.pop(ws, None)
-        if room_code and room_code in rooms:
-            room = rooms[room_code]
-
-            # identifier l'autre joueur AVANT de nous enlever
-            other_ws = None
-            for k in ("a", "b"):
-                ws_slot = room.get(k)
-                if ws_slot is not None and ws_slot is not ws:
-                    other_ws = ws_slot
-
-            # enlever ce websocket de la salle
-            for k in ("a", "b"):
-                if room.get(k) is ws:
-                    room[k] = None
-
-            # prévenir l'adversaire s'il est encore connecté
-            if other_ws is not None:
+def op_resume(op: dict):
+    sess = RemoteSession(op["worker"], op["sid"], op["uid"], player=op.get("player"))
+    room_resume(sess, op["token"], op.get("seq"))
+
+
+def op_spectate(op: dict):
+    room = registry.rooms.get(op.get("code"))
+    worker = op["worker"]
+    if room is None:
+        # fermée entre-temps : fin pour les spectateurs de ce code sur ce worker
+        frame = json.dumps({"type": "spectate_end", "code": op.get("code"), "reason": "room_closed"})
+        backplane.publish(f"w:{worker}", {"op": "audience", "code": op.get("code"), "frame": frame, "end": True})
+        return
+    room.watchers[worker] = room.watchers.get(worker, 0) + 1
+    # par "audience" comme les coups : même file d'attente que ceux d'avant
+    backplane.publish(f"w:{worker}", {"op": "audience", "code": room.code, "sid": op["sid"],
+                                      "frame": json.dumps(spectate_snapshot(room))})
+
+
+def op_unspectate(op: dict):
+    room = registry.rooms.get(op.get("code"))
+    if room is None or op["worker"] not in room.watchers:
+        return
+    room.watchers[op["worker"]] -= 1
+    if not room.watchers[op["worker"]]:
+        del room.watchers[op["worker"]]
+
+
+def op_audience(op: dict):
+    code = op.get("code")
+    if code not in registry.audiences:
+        return
+    targets = None
+    if op.get("sid"):
+        sess = registry.by_sid.get(op["sid"])
+        if sess is None:
+            return
+        targets = [sess]
+    raw = op["frame"]
+    frames = {codec.JSON: raw}   # réencodée au plus une fois par autre codec
+
+    def frame(codec_name: str):
+        f = frames.get(codec_name)
+        if f is None:
+            f = frames[codec_name] = codec.encode(json.loads(raw), codec_name)
+        return f
+    audience_pump.add(code, frame, op.get("end", False), targets)
+
+
+WORKER_OPS = {
+    "push": op_push, "kick": op_kick, "attach": op_attach, "detach": op_detach,
+    "join": op_join, "bind": op_bind, "msg": op_msg, "depart": op_depart, "resume": op_resume,
+    "spectate": op_spectate, "unspectate": op_unspectate, "audience": op_audience,
+}
+
+
+def on_worker_op(op: dict):
+    handler = WORKER_OPS.get(op.get("op"))
+    if handler is not None:
+        handler(op)
+
+
+@app.on_event("startup")
+async def start_backplane():
+    await history.start()
+    await ratings.start()
+    await backplane.start()
+    await backplane.subscribe("lobby", on_lobby_delta)
+    await backplane.subscribe(f"w:{WORKER_ID}", on_worker_op)
+    await backplane.subscribe("ratings", on_ratings)
+    metrics.lag_task = asyncio.create_task(watch_loop_lag())
+    matchmaker.task = asyncio.create_task(matchmaking_loop())
+    if backplane.distributed:
+        backplane.keep(f"worker:{WORKER_ID}", "1")
+        backplane.on_reconnect = republish_lobby
+        # lobby des workers déjà lancés (les deltas suivants arrivent par "lobby") ;
+        # les entrées d'un worker disparu sont effacées au passage
+        alive = {WORKER_ID: True}
+        for uid, raw in (await backplane.hgetall("lobby")).items():
+            entry = json.loads(raw)
+            worker = entry["worker"]
+            if worker not in alive:
+                alive[worker] = await backplane.get(f"worker:{worker}") is not None
+            if not alive[worker]:
+                backplane.hdel("lobby", uid)
+            elif entry["user"]["id"] not in lobby_view.users:
+                lobby_view.apply("added", entry["user"], worker)
+        lobby_view.bump()
+        lobby_view.sweeper = asyncio.create_task(sweep_workers())
+    print(f"[SERVER] worker {WORKER_ID} ({type(backplane).__name__})")
+
+
+@app.on_event("shutdown")
+async def stop_backplane():
+    # nos joueurs disparaissent du lobby des autres workers
+    for sess in list(registry.lobby_members()):
+        leave_lobby(sess)
+    presence.flush()
+    backplane.delete(f"worker:{WORKER_ID}")
+    await backplane.close()
+    await history.close()
+    await ratings.close()
+
+
+async def writer_loop(sess: Session):
+    """Tâche d'écriture d'une connexion : vide sa file dans l'ordre."""
+    ws, q = sess.ws, sess.outbox
+    try:
+        while True:
+            if sess.closing:
+                # un client bloqué peut ne jamais lire la trame de fermeture :
+                # au bout du délai, on interrompt sa boucle de lecture
                 try:
-                    await other_ws.send_text(
-                        json.dumps({"type": "peer_left"})
-                    )
+                    await asyncio.wait_for(ws.close(code=1013), 5.0)   # "try again later"
                 except Exception:
-                    # on ignore les erreurs réseau
                     pass
+                if sess.reader is not None:
+                    sess.reader.cancel()
+                return
+            if q:
+                frame, _ = q.popleft()
+                if isinstance(frame, str):
+                    await ws.send_text(frame)
+                else:
+                    await ws.send_bytes(frame)
+                metrics.sent(frame)
+            elif sess.stale:
+                # retard rattrapé : un snapshot frais remplace les deltas jetés
+                sess.stale = False
+                if sess.user_id is not None:
+                    frame = presence_snapshot(sess)
+                    await ws.send_text(frame)
+                    metrics.sent(frame)
+            else:
+                sess.wake.clear()
+                await sess.wake.wait()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # connexion fermée côté réseau : la boucle de lecture s'en rendra compte
+        metrics.send_failures += 1
+        sess.closing = True
+        sess.outbox.clear()
+
+
+# ========= Messages clients : table de dispatch ========= #
+#
+# Un handler par type de message : async def on_xxx(sess, msg, raw). Il
+# renvoie True pour terminer la session ("leave"). Ajouter un type de message,
+# c'est ajouter une fonction et une entrée dans MESSAGE_HANDLERS.
+# Chaque appel est compté et chronométré par type (MessageStats, voir /stats).
+
+# bornes des seaux de latence (secondes) ; le dernier seau est "au-delà"
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class MessageStats(Histogram):
+    """Compteurs et histogramme de latence d'un type de message."""
+    __slots__ = ("errors",)
+
+    def __init__(self):
+        super().__init__(LATENCY_BUCKETS)
+        self.errors = 0
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(1000 * self.total / self.count, 4) if self.count else None,
+            "p50_ms": _ms(self.quantile(0.5)),
+            "p95_ms": _ms(self.quantile(0.95)),
+            "p99_ms": _ms(self.quantile(0.99)),
+        }
+
+
+def _ms(seconds: Optional[float]):
+    """Secondes -> millisecondes pour /stats (au-delà du dernier seau : ">1000")."""
+    if seconds is None:
+        return None
+    if seconds == float("inf"):
+        return f">{LATENCY_BUCKETS[-1] * 1000:g}"
+    return round(seconds * 1000, 3)
+
+
+# ---------- LOBBY : joueurs en ligne ----------
+async def on_lobby_hello(sess: Session, msg: dict, raw):
+    # Un client s'annonce dans le lobby
+    name = text(msg.get("name"), "Joueur")
+    avatar = text(msg.get("avatar"), "avatar_01", 40)
+    is_new = registry.join_lobby(sess, name, avatar)
+    user = sess.public()
+
+    # 1) envoyer au client la 1re page du snapshot (filtre optionnel)
+    set_lobby_view(sess, msg)
+    send_presence_snapshot_to(sess)
+
+    # 2) prévenir les autres joueurs du lobby (au prochain tick)
+    if is_new:
+        presence.added(user)
+    else:
+        presence.updated(user)
+
+
+async def on_lobby_page(sess: Session, msg: dict, raw):
+    # page suivante : {"cursor": next_cursor reçu, + filtre optionnel}
+    cursor = msg.get("cursor")
+    if cursor is not None and not (isinstance(cursor, list) and len(cursor) == 2):
+        send(sess, "error", reason="bad_cursor")
+        return
+    if cursor is not None:
+        cursor = [str(cursor[0]), str(cursor[1])]
+    set_lobby_view(sess, msg)
+    send_presence_snapshot_to(sess, cursor)
+
 
-            # si la salle est maintenant vide, on la supprime
-            if not room.get("a") and not room.get("b"):
-                rooms.pop(room_code, None)
+async def on_lobby_goodbye(sess: Session, msg: dict, raw):
+    # Le client quitte volontairement le lobby
+    leave_lobby(sess)
 
 
+# ---------- INVITATIONS (lobby_invite / lobby_answer) ----------
+async def on_invite(sess: Session, msg: dict, raw):
+    # Le client invite un autre joueur à jouer
+    from_id = sess.user_id
+    if not from_id:
+        return
+    to_id = str(msg.get("to_id") or "")
+    if not to_id:
+        return
+
+    print(f"[SERVER] invite from {from_id} to {to_id}")
+
+    # joueur connecté ici ou à un autre worker
+    target = registry.session_of_user(to_id) or remote_user(to_id)
+    if not target:
+        return  # joueur plus là
+
+    payload = {
+        "type": "invite_incoming",
+        "from_id": from_id,
+        "from_name": sess.name or "Joueur",
+        "avatar": sess.avatar or "avatar_01",
+    }
+    target.push(json.dumps(payload))
+
+
+async def on_invite_reply(sess: Session, msg: dict, raw):
+    # Un joueur accepte / refuse une invitation
+    from_id = sess.user_id
+    if not from_id:
+        return
+    to_id = str(msg.get("to_id") or "")
+    if not to_id:
+        return
+    accepted = bool(msg.get("accepted"))
+
+    print(f"[SERVER] invite_reply from {from_id} to {to_id}, accepted={accepted}")
+
+    inviter = registry.session_of_user(to_id) or remote_user(to_id)
+    if not inviter:
+        return  # l'autre n'est plus connecté
+
+    if accepted and sess.room is not None:
+        send(sess, "error", reason="already_in_room")
+        return
+    if accepted and inviter.room is not None:
+        # assis ailleurs depuis l'invitation (un inviteur d'un autre worker
+        # est vérifié par le sien, voir op_attach)
+        send(sess, "error", reason="room_unavailable")
+        return
+
+    if not accepted:
+        # Simple refus
+        payload = {
+            "type": "invite_declined",
+            "from_id": from_id,
+            "from_name": sess.name or "Joueur",
+        }
+        inviter.push(json.dumps(payload))
+        return
+
+    # Invitation acceptée -> création d'une salle (ici) et match_start pour les 2
+    await start_match(inviter, sess)
+
+
+# ---------- PARTIES CLASSIQUES (création/join par code) ----------
+async def on_create_room(sess: Session, msg: dict, raw):
+    # une seule place par session : Registry.seat écraserait sess.room, et
+    # l'ancienne salle garderait un joueur qu'elle ne verrait jamais partir
+    if sess.room is not None:
+        send(sess, "error", reason="already_in_room")
+        return
+    creator_name = text(msg.get("name"), "J1")
+    room = await registry.new_room(*game_options(msg))
+    token = registry.seat(room, "a", sess, creator_name)
+    send(sess, "room_created", code=room.code, role=sess.role, token=token)
+
+
+async def on_join_room(sess: Session, msg: dict, raw):
+    # la salle peut être tenue par un autre worker : routage par code
+    if sess.room is not None:
+        send(sess, "error", reason="already_in_room")
+        return
+    code = text(msg.get("code")).upper()
+    name = text(msg.get("name"))
+    owner = await owner_of(code)
+    if owner is None:
+        send(sess, "error", reason="room_unavailable")
+    elif owner == WORKER_ID:
+        room_join(sess, code, name)
+    else:
+        relay(owner, "join", sess, code=code, name=name)
+
+
+async def on_resume(sess: Session, msg: dict, raw):
+    # retour après coupure : {"token", "seq" = dernier coup reçu}
+    if sess.room is not None:
+        send(sess, "error", reason="already_in_room")
+        return
+    token = str(msg.get("token") or "")
+    owner = await owner_of(token.partition(".")[0])
+    if owner is None:
+        send(sess, "error", reason="bad_token")
+    elif owner == WORKER_ID:
+        room_resume(sess, token, msg.get("seq"))
+    else:
+        relay(owner, "resume", sess, token=token, seq=msg.get("seq"))
+
+
+async def on_room_message(sess: Session, msg: dict, raw):
+    # move / sync / chat / ping : le serveur arbitre les coups ; la salle est retrouvée depuis la session
+    room = sess.room
+    if room is None:
+        return
+    if isinstance(room, RemoteRoom):
+        relay(room.owner, "msg", sess, code=room.code,
+              raw=raw if isinstance(raw, str) else json.dumps(msg))
+    else:
+        room_message(sess, msg, raw)
+
+
+# ---------- SPECTATEURS ----------
+async def on_spectate(sess: Session, msg: dict, raw):
+    # {"code"} : regarder une salle, d'ici ou d'un autre worker
+    if sess.room is not None:
+        send(sess, "error", reason="already_in_room")
+        return
+    code = text(msg.get("code")).upper()
+    owner = await owner_of(code)
+    if owner is None:
+        send(sess, "error", reason="room_unavailable")
+        return
+    stop_spectating(sess)
+    registry.watch(sess, code, owner)
+    if owner == WORKER_ID:
+        audience_pump.add(code, encoder(spectate_snapshot(registry.rooms[code])), targets=[sess])
+    else:
+        relay(owner, "spectate", sess, code=code)
+
+
+async def on_unspectate(sess: Session, msg: dict, raw):
+    watching = sess.watching
+    stop_spectating(sess)
+    if watching is not None:
+        send(sess, "spectate_end", code=watching[0], reason="left")
+
+
+# ---------- IDENTITÉ + CLASSEMENT ----------
+async def on_identify(sess: Session, msg: dict, raw):
+    # {"player_id", "secret", "name"?} : identité gardée par le client ;
+    # sans player_id, une nouvelle identité est créée et son secret renvoyé une fois
+    name = text(msg.get("name"), sess.name or "Joueur")
+    pid = msg.get("player_id")
+    secret = None
+    if pid:
+        player = ratings.check(str(pid), str(msg.get("secret") or ""))
+        if player is None:
+            send(sess, "error", reason="bad_identity")
+            return
+        if msg.get("name") and player.name != name:
+            ratings.rename(player, name)
+            publish_players(player)
+    else:
+        if sess.identities >= IDENTITIES_PER_CONNECTION:
+            send(sess, "error", reason="too_many_identities")
+            return
+        sess.identities += 1
+        player, secret = ratings.create(name)
+        publish_players(player)
+    sess.player = player.id
+    sess.name = player.name
+    extra = {"secret": secret} if secret else {}
+    send(sess, "identity", player_id=player.id, rank=ratings.rank(player.id), **player.public(), **extra)
+
+
+def publish_players(*players):
+    """Joueurs créés / modifiés ici : les autres workers les reçoivent par "ratings"."""
+    backplane.publish("ratings", {"worker": WORKER_ID, "players": [p.state() for p in players]})
+
+
+def on_ratings(update: dict):
+    if update.get("worker") != WORKER_ID:
+        for state in update["players"]:
+            ratings.apply(state)
+
+
+# ---------- MATCHMAKING (file d'attente) ----------
+async def on_queue_join(sess: Session, msg: dict, raw):
+    # {"rating"?, "name"?} : chercher un adversaire de niveau proche
+    if sess.room is not None:
+        send(sess, "error", reason="already_in_room")
+        return
+    if msg.get("name"):
+        sess.name = text(msg["name"])
+    # classement du serveur si le joueur s'est identifié, sinon celui annoncé
+    player = ratings.get(sess.player)
+    rating = round(player.rating) if player else parse_rating(msg.get("rating", DEFAULT_RATING))
+    pair = matchmaker.join(sess, rating)
+    send(sess, "queue_joined", rating=rating, window=MM_WINDOW)
+    if pair is not None:
+        await start_queued_match(*pair)
+
+
+async def on_queue_leave(sess: Session, msg: dict, raw):
+    matchmaker.leave(sess)
+    send(sess, "queue_left")
+
+
+async def on_leave(sess: Session, msg: dict, raw):
+    # côté client on ferme la partie
+    return True
+
+
+MESSAGE_HANDLERS = {
+    "lobby_hello": on_lobby_hello,
+    "lobby_page": on_lobby_page,
+    "lobby_goodbye": on_lobby_goodbye,
+    "invite": on_invite,
+    "invite_reply": on_invite_reply,
+    "create_room": on_create_room,
+    "join_room": on_join_room,
+    "resume": on_resume,
+    "spectate": on_spectate,
+    "unspectate": on_unspectate,
+    "identify": on_identify,
+    "queue_join": on_queue_join,
+    "queue_leave": on_queue_leave,
+    "move": on_room_message,
+    "chat": on_room_message,
+    "ping": on_room_message,
+    "sync": on_room_message,
+    "leave": on_leave,
+}
+
+# un seul compteur pour les types inconnus : les clients ne créent pas de séries
+message_stats: dict[str, MessageStats] = {t: MessageStats() for t in (*MESSAGE_HANDLERS, "unknown")}
+
+
+async def dispatch(sess: Session, msg: dict, raw) -> bool:
+    """Appelle le handler du type de message en le chronométrant ; True = fin de session."""
+    if not isinstance(msg, dict) or not isinstance(msg.get("type"), str):
+        # pas un objet {"type": ...} : aucun handler ne le verra
+        metrics.bad_messages += 1
+        send(sess, "error", reason="bad_message")
+        return False
+    t = msg["type"]
+    handler = MESSAGE_HANDLERS.get(t)
+    if handler is None:
+        message_stats["unknown"].count += 1
+        return False
+    stats = message_stats[t]
+    t0 = time.perf_counter()
+    try:
+        return bool(await handler(sess, msg, raw))
+    except Exception:
+        stats.errors += 1
+        raise
+    finally:
+        stats.record(time.perf_counter() - t0)
+
+
+@app.get("/stats")
+def stats():
+    """Nombre d'appels et latence (moyenne, quantiles estimés) par type de message."""
+    return {t: s.summary() for t, s in message_stats.items() if s.count}
+
+
+@app.get("/leaderboard")
+def leaderboard(offset: int = 0, limit: int = 50):
+    """Une page du classement, en mémoire (bisection + tranche, jamais de disque)."""
+    offset, limit = max(0, offset), max(1, min(200, limit))
+    return {"total": len(ratings), "offset": offset, "players": ratings.page(offset, limit)}
+
+
+@app.get("/leaderboard/{player_id}")
+def leaderboard_player(player_id: str):
+    player = ratings.get(player_id)
+    if player is None:
+        raise HTTPException(status_code=404, detail="unknown_player")
+    return {"rank": ratings.rank(player_id), **player.public()}
+
+
+@app.get("/history/{player}")
+async def player_history(player: str, limit: int = 20, before: Optional[float] = None,
+                         before_id: str = ""):
+    """Parties d'une identité (player_id), les plus récentes d'abord ; `next` donne
+    les paramètres `before` / `before_id` de la page suivante."""
+    limit = max(1, min(100, limit))
+    games = await history.games_of(player, limit, before, before_id)
+    last = games[-1] if len(games) == limit else None
+    return {"player": player, "games": games,
+            "next": {"before": last["started"], "before_id": last["id"]} if last else None}
+
+
+@app.get("/games/{game_id}")
+async def game_detail(game_id: str):
+    game = await history.game(game_id)
+    if game is None:
+        raise HTTPException(status_code=404, detail="unknown_game")
+    return game
+
+
+def _prom_histogram(lines: list, name: str, hist: Histogram, labels: str = ""):
+    sep = "," if labels else ""
+    seen = 0
+    for bound, n in zip(hist.bounds, hist.buckets):
+        seen += n
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{bound:g}"}} {seen}')
+    lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {hist.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {hist.total:g}")
+    lines.append(f"{name}_count{suffix} {hist.count}")
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Métriques au format texte Prometheus (version 0.0.4)."""
+    rooms = registry.rooms.values()
+    half_open = sum(1 for r in rooms if not r.is_full())
+    lines = []
+
+    def metric(name: str, kind: str, help_: str, samples):
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+    metric("katro_connections_open", "gauge", "Open websocket connections on this worker.",
+           [("", len(registry.sessions))])
+    metric("katro_lobby_members", "gauge", "Lobby members connected to this worker / on all workers.",
+           [('scope="local"', len(registry.by_user)), ('scope="all"', len(lobby_view.users))])
+    metric("katro_rooms_active", "gauge", "Rooms owned by this worker.", [("", len(registry.rooms))])
+    metric("katro_rooms_half_open", "gauge", "Rooms with an empty or held seat.", [("", half_open)])
+    metric("katro_seats_held", "gauge", "Seats held for a disconnected player (resume grace).",
+           [("", sum(len(r.away) for r in rooms))])
+    metric("katro_messages_in_total", "counter", "Client messages received, by type.",
+           [(f'type="{t}"', s.count) for t, s in message_stats.items()])
+    metric("katro_message_errors_total", "counter", "Client messages whose handler raised, by type.",
+           [(f'type="{t}"', s.errors) for t, s in message_stats.items()])
+    metric("katro_messages_out_total", "counter", "Frames sent to clients, by type.",
+           [(f'type="{t}"', n) for t, n in sorted(metrics.msgs_out.items())])
+    metric("katro_bytes_in_total", "counter", "Websocket payload bytes received.", [("", metrics.bytes_in)])
+    metric("katro_bytes_out_total", "counter", "Websocket payload bytes sent.", [("", metrics.bytes_out)])
+    metric("katro_send_failures_total", "counter", "Failed websocket sends.", [("", metrics.send_failures)])
+    metric("katro_bad_messages_total", "counter", "Client frames that could not be decoded or handled.",
+           [("", metrics.bad_messages)])
+    metric("katro_kicks_total", "counter", "Connections closed by the server, by reason.",
+           [(f'reason="{why}"', n) for why, n in sorted(metrics.kicks.items())])
+    metric("katro_outbox_frames", "gauge", "Frames waiting in outbound queues.",
+           [("", sum(len(s.outbox) for s in registry.sessions.values()))])
+    metric("katro_spectators", "gauge", "Spectators connected to this worker / remote workers watching our rooms.",
+           [('scope="local"', sum(len(a) for a in registry.audiences.values())),
+            ('scope="remote"', sum(sum(r.watchers.values()) for r in rooms))])
+    metric("katro_spectator_backlog", "gauge", "Spectator broadcasts not yet fully queued.",
+           [("", len(audience_pump))])
+    metric("katro_matchmaking_queued", "gauge", "Players waiting in the matchmaking queue.",
+           [("", len(matchmaker))])
+    metric("katro_matchmaking_matches_total", "counter", "Matches made by the matchmaking queue.",
+           [("", matchmaker.matches)])
+    metric("katro_history_pending", "gauge", "Games waiting for the next history batch.",
+           [("", history.pending_count())])
+    metric("katro_history_rows_written_total", "counter", "Game rows written to the history store.",
+           [("", history.rows_written)])
+    metric("katro_history_batches_total", "counter", "History batches committed.", [("", history.batches)])
+    metric("katro_history_write_failures_total", "counter", "History batches that failed to commit.",
+           [("", history.failures)])
+    metric("katro_players_known", "gauge", "Persistent player identities in memory.",
+           [("", len(ratings.players))])
+    metric("katro_players_ranked", "gauge", "Players on the leaderboard (at least one rated game).",
+           [("", len(ratings))])
+    metric("katro_event_loop_lag_seconds", "gauge", "Last measured event loop lag.",
+           [("", f"{metrics.loop_lag_last:g}")])
+
+    lines.append("# HELP katro_event_loop_lag_histogram_seconds Event loop lag samples.")
+    lines.append("# TYPE katro_event_loop_lag_histogram_seconds histogram")
+    _prom_histogram(lines, "katro_event_loop_lag_histogram_seconds", metrics.loop_lag)
+    lines.append("# HELP katro_matchmaking_wait_seconds Time spent in the matchmaking queue before a match.")
+    lines.append("# TYPE katro_matchmaking_wait_seconds histogram")
+    _prom_histogram(lines, "katro_matchmaking_wait_seconds", matchmaker.wait)
+    lines.append("# HELP katro_broadcast_fanout Recipients per broadcast.")
+    lines.append("# TYPE katro_broadcast_fanout histogram")
+    for scope, hist in metrics.fanout.items():
+        _prom_histogram(lines, "katro_broadcast_fanout", hist, f'scope="{scope}"')
+    lines.append("# HELP katro_message_handler_seconds Handler latency, by message type.")
+    lines.append("# TYPE katro_message_handler_seconds histogram")
+    for t, s in message_stats.items():
+        if t != "unknown":
+            _prom_histogram(lines, "katro_message_handler_seconds", s, f'type="{t}"')
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@app.websocket("/ws")
+async def ws_endpoint(ws: WebSocket):
+    # codec : sous-protocole proposé par le client (katro.bin1), sinon JSON
+    chosen = codec.negotiate(ws.scope.get("subprotocols"))
+    await ws.accept(subprotocol=chosen)
+    sess = registry.connect(ws, chosen or codec.JSON)
+    sess.reader = asyncio.current_task()
+    sess.writer = asyncio.create_task(writer_loop(sess))
+    # coupure, sauf "leave" explicite : seul un départ demandé compte comme
+    # abandon (classement), jamais une erreur
+    dropped = True
+
+    try:
+        while True:
+            frame = await ws.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            raw = frame.get("text")
+            if raw is None:
+                raw = frame.get("bytes") or b""
+                metrics.bytes_in += len(raw)
+            else:
+                metrics.bytes_in += len(raw) if raw.isascii() else len(raw.encode())
+            try:
+                msg = codec.decode(raw)
+                done = await dispatch(sess, msg, raw)
+            except ConnectionError:
+                # backplane coupé (en reconnexion) : réservation de code, routage...
+                send(sess, "error", reason="backplane_unavailable")
+                continue
+            except Exception as e:
+                # trame illisible ou handler en erreur : la connexion continue
+                metrics.bad_messages += 1
+                print(f"[SERVER] bad message from {sess.user_id or sess.sid}: {e!r}")
+                send(sess, "error", reason="bad_message")
+                continue
+
+            if done:
+                dropped = False
+                break
+
+            # receive() rend les trames déjà reçues sans céder la main :
+            # on laisse notre tâche d'écriture vider la file avant la suivante
+            if sess.outbox:
+                await asyncio.sleep(0)
+
+    except WebSocketDisconnect:
+        pass
+    except asyncio.CancelledError:
+        # annulation par writer_loop (client lent) : une coupure comme une autre
+        if not sess.closing:
+            raise
+
+    finally:
+        # ---------- Nettoyage rooms + notification à l'adversaire ----------
+        room = sess.room
+        if isinstance(room, RemoteRoom):
+            relay(room.owner, "depart", sess, code=room.code, dropped=dropped)
+            sess.detach()
+        elif room is not None:
+            room_depart(sess, dropped)
+
+        # ---------- Nettoyage lobby + file d'attente + spectateur ----------
+        matchmaker.leave(sess)
+        stop_spectating(sess)
+        leave_lobby(sess)
+        registry.disconnect(sess)
+        if not sess.closing:
+            sess.closing = True
+            sess.writer.cancel()
+
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "8765"))
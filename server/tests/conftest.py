@@ -0,0 +1,20 @@
+# Tests du serveur : `python -m pytest` depuis server/ (ou la racine du dépôt).
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# ni historique ni classement sur disque pendant les tests
+os.environ.setdefault("KATRO_HISTORY", "")
+os.environ.setdefault("KATRO_RATINGS", "")
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    import server
+    with TestClient(server.app) as c:
+        yield c
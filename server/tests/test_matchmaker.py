@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+import server
+
+
+def entry(sid, rating, since):
+    return server.QueueEntry(SimpleNamespace(sid=sid), rating, since)
+
+
+def test_nearest_looks_past_bucket_head(monkeypatch):
+    # fenêtre fixe plus étroite qu'une tranche : deux joueurs de la même tranche peuvent se refuser
+    monkeypatch.setattr(server, "MM_WINDOW", 10.0)
+    monkeypatch.setattr(server, "MM_WIDEN", 0.0)
+    mm = server.Matchmaker()
+    old, young = entry("old", 1549, 0.0), entry("young", 1500, 1.0)
+    mm._insert(old)
+    mm._insert(young)
+    assert mm.buckets[1549 // server.MM_BUCKET] == {"old": old, "young": young}
+    assert mm._nearest(entry("new", 1495, 2.0), 2.0) is young
+
+
+def test_nearest_prefers_oldest_on_equal_gap(monkeypatch):
+    monkeypatch.setattr(server, "MM_WINDOW", 10.0)
+    monkeypatch.setattr(server, "MM_WIDEN", 0.0)
+    mm = server.Matchmaker()
+    high, low = entry("high", 1540, 0.0), entry("low", 1520, 1.0)
+    mm._insert(high)
+    mm._insert(low)
+    assert mm._nearest(entry("new", 1530, 2.0), 2.0) is high
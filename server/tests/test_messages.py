@@ -0,0 +1,12 @@
+# Trames invalides : erreur "bad_message" (clé "reason", comme toutes les erreurs), la connexion continue.
+import pytest
+
+
+@pytest.mark.parametrize("frame", ["not json", "[1, 2]", '"texte"', '{"type": 7}', "{}"])
+def test_bad_frame_reports_reason(client, frame):
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text(frame)
+        assert ws.receive_json() == {"type": "error", "reason": "bad_message"}
+        # toujours connecté
+        ws.send_json({"type": "create_room", "name": "A"})
+        assert ws.receive_json()["type"] == "room_created"
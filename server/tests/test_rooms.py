@@ -0,0 +1,90 @@
+# Une session n'occupe qu'une place : create / join / invitation refusés si elle est déjà assise.
+import server
+
+
+def recv(ws, kind):
+    while True:
+        msg = ws.receive_json()
+        if msg["type"] == kind:
+            return msg
+
+
+def refused(ws, msg):
+    """Envoie msg puis un message témoin (curseur invalide) ; renvoie la raison
+    de la première erreur reçue avant la réponse au témoin (None sinon)."""
+    ws.send_json(msg)
+    ws.send_json({"type": "lobby_page", "cursor": "témoin"})
+    first = None
+    while True:
+        m = ws.receive_json()
+        if m["type"] == "error":
+            if m.get("reason") == "bad_cursor":
+                return first
+            first = first or m.get("reason")
+
+
+def create(ws, name="A"):
+    ws.send_json({"type": "create_room", "name": name})
+    return recv(ws, "room_created")["code"]
+
+
+def hello(ws, name):
+    """Entre dans le lobby ; renvoie le user_id attribué."""
+    ws.send_json({"type": "lobby_hello", "name": name})
+    return recv(ws, "presence_snapshot")["your_id"]
+
+
+def test_create_twice_is_refused(client):
+    with client.websocket_connect("/ws") as a:
+        before = len(server.registry.rooms)
+        code = create(a)
+        assert refused(a, {"type": "create_room", "name": "A"}) == "already_in_room"
+        assert len(server.registry.rooms) == before + 1 and code in server.registry.rooms
+
+
+def test_join_own_room_is_refused(client):
+    with client.websocket_connect("/ws") as a:
+        code = create(a)
+        assert refused(a, {"type": "join_room", "code": code, "name": "A"}) == "already_in_room"
+        room = server.registry.rooms[code]
+        assert room.b is None and not room.is_full()
+
+
+def test_join_while_seated_is_refused(client):
+    with client.websocket_connect("/ws") as a, client.websocket_connect("/ws") as b:
+        code_a = create(a)
+        code_b = create(b, "B")
+        assert refused(b, {"type": "join_room", "code": code_a, "name": "B"}) == "already_in_room"
+        assert server.registry.rooms[code_a].b is None
+        assert server.registry.rooms[code_b].a is not None
+
+
+def test_opponent_left_after_refused_second_room(client):
+    # le scénario de la revue : A redemande une salle, B rejoint la première, A se déconnecte
+    with client.websocket_connect("/ws") as b:
+        with client.websocket_connect("/ws") as a:
+            code = create(a)
+            assert refused(a, {"type": "create_room", "name": "A"}) == "already_in_room"
+            b.send_json({"type": "join_room", "code": code, "name": "B"})
+            recv(b, "start")
+        assert recv(b, "opponent_away")["type"] == "opponent_away"
+
+
+def test_accept_invite_while_seated_is_refused(client):
+    with client.websocket_connect("/ws") as a, client.websocket_connect("/ws") as b:
+        uid_a = hello(a, "A")
+        hello(b, "B")
+        create(b, "B")
+        before = len(server.registry.rooms)
+        assert refused(b, {"type": "invite_reply", "to_id": uid_a, "accepted": True}) == "already_in_room"
+        assert len(server.registry.rooms) == before
+
+
+def test_accept_invite_from_seated_inviter_is_refused(client):
+    with client.websocket_connect("/ws") as a, client.websocket_connect("/ws") as b:
+        uid_a = hello(a, "A")
+        hello(b, "B")
+        create(a)
+        before = len(server.registry.rooms)
+        assert refused(b, {"type": "invite_reply", "to_id": uid_a, "accepted": True}) == "room_unavailable"
+        assert len(server.registry.rooms) == before
@@ -0,0 +1,17 @@
+# Moteur et codec sont copiés tels quels dans client/ et server/ (chacun est
+# déployé seul) : les deux copies doivent rester identiques, sinon les clés de
+# Zobrist ou les trames binaires ne correspondent plus.
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.mark.parametrize("name", ["katro_engine.py", "katro_codec.py"])
+def test_client_and_server_copies_match(name):
+    with open(os.path.join(ROOT, "client", name), "rb") as f:
+        client = f.read()
+    with open(os.path.join(ROOT, "server", name), "rb") as f:
+        server = f.read()
+    assert client == server, f"client/{name} et server/{name} diffèrent : recopier le fichier modifié"
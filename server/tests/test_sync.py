@@ -0,0 +1,36 @@
+# Un client désynchronisé se recale : plateau joint au refus d'un coup, et message "sync".
+import katro_engine as engine
+from test_rooms import create, recv
+
+
+def start_game(a, b):
+    code = create(a)
+    b.send_json({"type": "join_room", "code": code, "name": "B"})
+    recv(a, "start")
+    recv(b, "start")
+
+
+def test_refused_move_carries_the_server_board(client):
+    with client.websocket_connect("/ws") as a, client.websocket_connect("/ws") as b:
+        start_game(a, b)
+        s = engine.KatroState.initial(engine.SEEDS_PER_PIT)
+        idx, step = engine.legal_moves(s)[0]
+        a.send_json({"type": "move", "idx": idx, "step": step, "nonce": "n1"})
+        moved = recv(b, "move")
+        s = engine.resolve_move(s, idx, step).state
+        # J1 rejoue alors que c'est à J2 : refusé, avec le plateau du serveur
+        a.send_json({"type": "move", "idx": idx, "step": step, "nonce": "n2"})
+        err = recv(a, "error")
+        assert err["reason"] == "not_your_turn" and err["nonce"] == "n2"
+        assert err["pits"] == s.to_list() and err["next"] == s.player
+        assert err["seq"] == moved["seq"] and err["hash"] == moved["hash"]
+
+
+def test_sync_returns_the_server_board(client):
+    with client.websocket_connect("/ws") as a, client.websocket_connect("/ws") as b:
+        start_game(a, b)
+        b.send_json({"type": "sync"})
+        m = recv(b, "sync")
+        s = engine.KatroState.initial(engine.SEEDS_PER_PIT)
+        assert m["pits"] == s.to_list() and m["next"] == 1 and m["seq"] == 0
+        assert m["hash"] == f"{s.key:016x}"